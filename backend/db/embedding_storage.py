@@ -0,0 +1,307 @@
+"""Storage formats for the embeddings column and an online migration between them.
+
+Formats:
+    float8   DOUBLE PRECISION[]  (legacy, 8 bytes per value)
+    float4   REAL[]              (4 bytes per value)
+    bytea    raw little-endian float32 bytes, no array header
+    vector   pgvector ``vector`` (4 bytes per value, server-side distance)
+    halfvec  pgvector ``halfvec`` (2 bytes per value, server-side distance)
+
+Convert an existing table in place, in resumable batches::
+
+    python -m backend.db.embedding_storage --to bytea --batch-size 5000
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+logger = logging.getLogger("avsp.embedding_storage")
+
+COLUMN_TYPES = {
+    "float8": "DOUBLE PRECISION[]",
+    "float4": "REAL[]",
+    "bytea": "BYTEA",
+    "vector": "vector",
+    "halfvec": "halfvec",
+}
+PGVECTOR_FORMATS = ("vector", "halfvec")
+
+_MIGRATION_COLUMN = "embedding_migrating"
+
+
+def column_type(fmt: str) -> str:
+    if fmt not in COLUMN_TYPES:
+        raise ValueError(
+            f"Unknown embedding storage format {fmt!r}, expected one of {sorted(COLUMN_TYPES)}"
+        )
+    return COLUMN_TYPES[fmt]
+
+
+def value_placeholder(fmt: str) -> str:
+    """Placeholder that casts a bound parameter to the column type."""
+    if fmt in PGVECTOR_FORMATS:
+        return f"%s::{fmt}"
+    if fmt == "float4":
+        return "%s::real[]"
+    return "%s"
+
+
+def vector_literal(values) -> str:
+    return "[" + ",".join(f"{value:.8f}" for value in values) + "]"
+
+
+def encode(embedding, fmt: str):
+    values = np.asarray(embedding, dtype=np.float32)
+    if fmt == "bytea":
+        return psycopg2.Binary(values.astype("<f4", copy=False).tobytes())
+    if fmt in PGVECTOR_FORMATS:
+        return vector_literal(values)
+    return values.tolist()
+
+
+def decode_many(values: Sequence, fmt: str) -> np.ndarray:
+    """Decode fetched column values into an (N, D) float32 matrix."""
+    if not values:
+        return np.empty((0, 0), dtype=np.float32)
+    if fmt == "bytea":
+        flat = np.frombuffer(b"".join(values), dtype="<f4")
+        return flat.reshape(len(values), -1)
+    if fmt in PGVECTOR_FORMATS:
+        return np.asarray(
+            [np.asarray(value[1:-1].split(","), dtype=np.float32) for value in values],
+            dtype=np.float32,
+        )
+    return np.asarray(values, dtype=np.float32)
+
+
+def detect_format(conn, schema: str, table: str, column: str = "embedding") -> Optional[str]:
+    query = """
+        SELECT data_type, udt_name
+        FROM information_schema.columns
+        WHERE table_schema = %s
+          AND table_name = %s
+          AND column_name = %s
+    """
+    with conn.cursor() as cur:
+        cur.execute(query, (schema, table, column))
+        row = cur.fetchone()
+    if not row:
+        return None
+    data_type, udt_name = row
+    if data_type == "USER-DEFINED" and udt_name in PGVECTOR_FORMATS:
+        return udt_name
+    if data_type == "bytea":
+        return "bytea"
+    if data_type == "ARRAY" and udt_name == "_float4":
+        return "float4"
+    if data_type == "ARRAY" and udt_name == "_float8":
+        return "float8"
+    raise ValueError(f"Unsupported embedding column type {data_type}/{udt_name}")
+
+
+def migrate(conn, schema: str, table: str, target: str, batch_size: int = 5000) -> int:
+    """Convert the embedding column of ``schema.table`` to ``target``.
+
+    Converted values are written to a shadow column in short committed batches
+    that only lock the rows they touch, so readers and writers keep running.
+    A trigger clears the shadow value of rows rewritten meanwhile, so they are
+    converted again. Rerunning after a crash picks up the remaining rows. Only
+    the final column swap takes a brief exclusive lock. Dropping the old column
+    does not shrink existing tuples on disk; run VACUUM FULL (or pg_repack)
+    afterwards to reclaim the space.
+    """
+    conn.autocommit = False
+    source = detect_format(conn, schema, table)
+    if source is None:
+        raise ValueError(f"{schema}.{table} has no embedding column")
+    in_progress = detect_format(conn, schema, table, _MIGRATION_COLUMN)
+    if in_progress is not None and in_progress != target:
+        raise ValueError(
+            f"A migration to {in_progress} is in progress; rerun it with --to {in_progress}"
+        )
+    if source == target and in_progress is None:
+        logger.info("Embedding column is already %s, nothing to do", target)
+        return 0
+
+    ident = {
+        "table": sql.SQL("{}.{}").format(sql.Identifier(schema), sql.Identifier(table)),
+        "shadow": sql.Identifier(_MIGRATION_COLUMN),
+        "func": sql.SQL("{}.{}").format(
+            sql.Identifier(schema), sql.Identifier(f"{table}_embedding_migration_reset")
+        ),
+        "trigger": sql.Identifier(f"{table}_embedding_migration_reset"),
+        "pending_index": sql.Identifier(f"{table}_embedding_migration_pending"),
+    }
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {shadow} {type}").format(
+                type=sql.SQL(column_type(target)), **ident
+            )
+        )
+        cur.execute(
+            sql.SQL(
+                """
+                CREATE OR REPLACE FUNCTION {func}() RETURNS trigger AS $$
+                BEGIN
+                    IF NEW.embedding IS DISTINCT FROM OLD.embedding THEN
+                        NEW.{shadow} := NULL;
+                    END IF;
+                    RETURN NEW;
+                END
+                $$ LANGUAGE plpgsql
+                """
+            ).format(**ident)
+        )
+        cur.execute(sql.SQL("DROP TRIGGER IF EXISTS {trigger} ON {table}").format(**ident))
+        cur.execute(
+            sql.SQL(
+                "CREATE TRIGGER {trigger} BEFORE UPDATE ON {table} "
+                "FOR EACH ROW EXECUTE FUNCTION {func}()"
+            ).format(**ident)
+        )
+    conn.commit()
+
+    # Unconverted rows are found through a partial index that shrinks as the
+    # migration progresses, instead of rescanning the table for every batch.
+    conn.autocommit = True
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS {pending_index} "
+                "ON {table} (storage_path) WHERE {shadow} IS NULL"
+            ).format(**ident)
+        )
+    conn.autocommit = False
+
+    converted = 0
+    started = time.perf_counter()
+    while True:
+        batch = _convert_batch(conn, ident, source, target, batch_size, lock=False)
+        conn.commit()
+        if not batch:
+            break
+        converted += batch
+        logger.info(
+            "Converted %s rows (%.0f rows/s)",
+            converted,
+            converted / max(time.perf_counter() - started, 1e-9),
+        )
+
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE").format(**ident))
+    # Rows written since the last batch are converted under the lock.
+    while _convert_batch(conn, ident, source, target, batch_size, lock=True):
+        pass
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("DROP TRIGGER IF EXISTS {trigger} ON {table}").format(**ident))
+        cur.execute(sql.SQL("DROP FUNCTION IF EXISTS {func}()").format(**ident))
+        # The pending-rows index would survive the rename as a useless index on
+        # "embedding IS NULL". The table lock is already held, so no CONCURRENTLY.
+        cur.execute(
+            sql.SQL("DROP INDEX IF EXISTS {schema}.{pending_index}").format(
+                schema=sql.Identifier(schema), **ident
+            )
+        )
+        cur.execute(sql.SQL("ALTER TABLE {table} DROP COLUMN embedding").format(**ident))
+        cur.execute(
+            sql.SQL("ALTER TABLE {table} RENAME COLUMN {shadow} TO embedding").format(**ident)
+        )
+        cur.execute(
+            sql.SQL(
+                "ALTER TABLE {table} ADD CONSTRAINT {name} "
+                "CHECK (embedding IS NOT NULL) NOT VALID"
+            ).format(name=sql.Identifier(f"{table}_embedding_not_null"), **ident)
+        )
+    conn.commit()
+    # VALIDATE only takes a SHARE UPDATE EXCLUSIVE lock, so it runs unblocked.
+    with conn.cursor() as cur:
+        cur.execute(
+            sql.SQL("ALTER TABLE {table} VALIDATE CONSTRAINT {name}").format(
+                name=sql.Identifier(f"{table}_embedding_not_null"), **ident
+            )
+        )
+    conn.commit()
+    logger.info("Embedding column migrated from %s to %s: rows=%s", source, target, converted)
+    return converted
+
+
+def _convert_batch(conn, ident, source: str, target: str, batch_size: int, lock: bool) -> int:
+    select_stmt = sql.SQL(
+        """
+        SELECT storage_path, embedding
+        FROM {table}
+        WHERE {shadow} IS NULL
+        ORDER BY storage_path
+        LIMIT %s
+        {locking}
+        """
+    ).format(
+        locking=sql.SQL("") if lock else sql.SQL("FOR UPDATE SKIP LOCKED"),
+        **ident,
+    )
+    with conn.cursor() as cur:
+        cur.execute(select_stmt, (batch_size,))
+        rows = cur.fetchall()
+        if not rows:
+            return 0
+        matrix = decode_many([row[1] for row in rows], source)
+        values = [(row[0], encode(vector, target)) for row, vector in zip(rows, matrix)]
+        update_stmt = sql.SQL(
+            """
+            UPDATE {table} AS t
+            SET {shadow} = v.embedding
+            FROM (VALUES %s) AS v(storage_path, embedding)
+            WHERE t.storage_path = v.storage_path
+            """
+        ).format(**ident)
+        execute_values(
+            cur,
+            update_stmt.as_string(cur),
+            values,
+            template=f"(%s, {value_placeholder(target)})",
+        )
+    return len(rows)
+
+
+def main() -> None:
+    from configs.common import (
+        EMBEDDINGS_SCHEMA,
+        EMBEDDINGS_TABLE,
+        POSTGRES_DB,
+        POSTGRES_HOST,
+        POSTGRES_PASSWORD,
+        POSTGRES_PORT,
+        POSTGRES_USER,
+    )
+
+    parser = argparse.ArgumentParser(description="Convert the embedding column format.")
+    parser.add_argument("--to", required=True, choices=sorted(COLUMN_TYPES))
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--schema", default=EMBEDDINGS_SCHEMA)
+    parser.add_argument("--table", default=EMBEDDINGS_TABLE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    conn = psycopg2.connect(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+    )
+    try:
+        migrate(conn, args.schema, args.table, args.to, batch_size=args.batch_size)
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
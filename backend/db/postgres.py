@@ -1,7 +1,8 @@
 from __future__ import annotations
 
+import io
 from dataclasses import dataclass
-from typing import Iterable, List
+from typing import Iterable, Iterator, List, Sequence, Set
 
 import pandas as pd
 import psycopg2
@@ -20,9 +21,99 @@ class PostgresConfig:
     table: str
 
 
+# COPY reads NULL as this marker; an empty CSV field stays an empty string.
+_COPY_NULL = r"\N"
+_INDEXED_COLUMNS = ("storage_path", "source_link")
+
+
+def _integral_floats_as_int(df: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """Float columns holding only whole numbers, as nullable Int64.
+
+    An integer column that picks up a NaN becomes float64, and ``to_csv``
+    then writes ``123.0``, which COPY rejects for a BIGINT column.
+    """
+    converted = {}
+    for column in columns:
+        values = df[column]
+        if not pd.api.types.is_float_dtype(values.dtype):
+            continue
+        present = values.dropna()
+        if (
+            len(present)
+            and present.abs().max() < 2**63
+            and (present == present.round()).all()
+        ):
+            converted[column] = values.astype("Int64")
+    if not converted:
+        return df
+    df = df.copy()
+    for column, values in converted.items():
+        df[column] = values
+    return df
+
+
+class _CsvStream(io.RawIOBase):
+    """File-like CSV view over DataFrames, rendered ``chunk_rows`` rows at a time.
+
+    ``copy_expert`` pulls from it, so only one chunk of text is ever in memory.
+    """
+
+    def __init__(self, frames: Sequence[pd.DataFrame], columns: List[str], chunk_rows: int):
+        self._chunks = self._render(frames, columns, chunk_rows)
+        self._pending = b""
+
+    @staticmethod
+    def _render(frames, columns, chunk_rows) -> Iterator[bytes]:
+        for df in frames:
+            df = _integral_floats_as_int(df, columns)
+            for start in range(0, len(df), chunk_rows):
+                yield df.iloc[start : start + chunk_rows].to_csv(
+                    columns=columns, header=False, index=False, na_rep=_COPY_NULL
+                ).encode("utf-8")
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._pending) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
 class PostgresWriter:
-    def __init__(self, config: PostgresConfig):
+    """Writes frame metadata DataFrames into one Postgres table.
+
+    ``method="copy"`` streams rows through ``COPY ... FROM STDIN`` as CSV;
+    ``method="values"`` is the older per-row ``INSERT ... VALUES`` path, kept
+    as a fallback. ``write`` buffers DataFrames across episodes and loads them
+    in one COPY once ``flush_rows`` rows are pending; ``insert_df`` writes
+    immediately.
+    """
+
+    METHODS = ("copy", "values")
+
+    def __init__(
+        self,
+        config: PostgresConfig,
+        method: str = "copy",
+        flush_rows: int = 50000,
+        chunk_rows: int = 10000,
+    ):
+        if method not in self.METHODS:
+            raise ValueError(f"Unknown write method {method!r}, expected one of {self.METHODS}")
         self.config = config
+        self.method = method
+        self.flush_rows = flush_rows
+        self.chunk_rows = chunk_rows
+        self._buffer: List[pd.DataFrame] = []
+        self._buffered_rows = 0
+        self._known_columns: Set[str] = set()
         self.conn = psycopg2.connect(
             host=config.host,
             port=config.port,
@@ -31,20 +122,94 @@ class PostgresWriter:
             password=config.password,
         )
         self.conn.autocommit = True
-        self._table_ready = False
 
     def close(self) -> None:
         if self.conn:
-            self.conn.close()
+            try:
+                self.flush()
+            finally:
+                self.conn.close()
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Buffer ``df``; the buffer is loaded once it holds ``flush_rows`` rows."""
+        if df.empty:
+            return
+        self._buffer.append(df)
+        self._buffered_rows += len(df)
+        if self._buffered_rows >= self.flush_rows:
+            self.flush()
+
+    @property
+    def buffered_rows(self) -> int:
+        """Rows accepted by ``write`` but not loaded yet."""
+        return self._buffered_rows
+
+    def flush(self) -> None:
+        frames, self._buffer, self._buffered_rows = self._buffer, [], 0
+        if frames:
+            self._load(frames)
 
     def insert_df(self, df: pd.DataFrame) -> None:
         if df.empty:
             return
+        self._load([df])
+
+    def delete_source(self, source_link: str) -> int:
+        """Delete the rows of one source file, so it can be ingested again."""
+        with self.conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT 1 FROM information_schema.columns
+                WHERE table_schema = %s AND table_name = %s AND column_name = 'source_link'
+                """,
+                (self.config.schema, self.config.table),
+            )
+            if cur.fetchone() is None:
+                return 0
+            cur.execute(
+                sql.SQL("DELETE FROM {}.{} WHERE source_link = %s").format(
+                    sql.Identifier(self.config.schema),
+                    sql.Identifier(self.config.table),
+                ),
+                (source_link,),
+            )
+            return cur.rowcount
 
-        if not self._table_ready:
-            self._ensure_table(df)
-            self._table_ready = True
+    def _load(self, frames: List[pd.DataFrame]) -> None:
+        for df in frames:
+            if not self._known_columns.issuperset(df.columns):
+                self._ensure_table(df)
+        if self.method == "values":
+            for df in frames:
+                self._insert_values(df)
+            return
+        # One COPY per column layout, in a single statement each.
+        groups: List[List[pd.DataFrame]] = []
+        for df in frames:
+            if groups and list(groups[-1][0].columns) == list(df.columns):
+                groups[-1].append(df)
+            else:
+                groups.append([df])
+        for group in groups:
+            self._copy(group)
 
+    def _copy(self, frames: List[pd.DataFrame]) -> None:
+        columns = list(frames[0].columns)
+        copy_stmt = sql.SQL(
+            "COPY {}.{} ({}) FROM STDIN WITH (FORMAT csv, NULL {})"
+        ).format(
+            sql.Identifier(self.config.schema),
+            sql.Identifier(self.config.table),
+            sql.SQL(", ").join(sql.Identifier(col) for col in columns),
+            sql.Literal(_COPY_NULL),
+        )
+        with self.conn.cursor() as cur:
+            cur.copy_expert(
+                copy_stmt.as_string(cur),
+                _CsvStream(frames, columns, self.chunk_rows),
+            )
+
+    def _insert_values(self, df: pd.DataFrame) -> None:
         clean_df = df.copy()
         for col in clean_df.select_dtypes(include=["object"]).columns:
             clean_df[col] = clean_df[col].apply(
@@ -78,9 +243,34 @@ class PostgresWriter:
             sql.SQL(", ").join(column_defs),
         )
 
+        # Columns added to frames since the table was created.
+        add_column_stmts = [
+            sql.SQL("ALTER TABLE {}.{} ADD COLUMN IF NOT EXISTS {}").format(
+                sql.Identifier(self.config.schema),
+                sql.Identifier(self.config.table),
+                definition,
+            )
+            for definition in column_defs
+        ]
+
+        # Lookups by frame (search metadata) and by source file (resumed ingestion).
+        create_index_stmts = [
+            sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {}.{} ({})").format(
+                sql.Identifier(f"{self.config.table}_{col}_idx"),
+                sql.Identifier(self.config.schema),
+                sql.Identifier(self.config.table),
+                sql.Identifier(col),
+            )
+            for col in _INDEXED_COLUMNS
+            if col in columns
+        ]
+
         with self.conn.cursor() as cur:
             cur.execute(create_schema_stmt)
             cur.execute(create_table_stmt)
+            for stmt in add_column_stmts + create_index_stmts:
+                cur.execute(stmt)
+        self._known_columns.update(columns)
 
     def _column_definitions(
         self, df: pd.DataFrame, columns: Iterable[str]
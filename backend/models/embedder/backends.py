@@ -0,0 +1,222 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+from typing import Dict, Optional
+
+import numpy as np
+import torch
+
+logger = logging.getLogger("avsp.embedder")
+
+BACKENDS = ("eager", "int8", "onnx")
+TEXT_INPUTS = ("input_ids", "attention_mask", "token_type_ids")
+
+
+def _pooled(outputs):
+    return outputs.pooler_output if hasattr(outputs, "pooler_output") else outputs
+
+
+def normalize(features: np.ndarray) -> np.ndarray:
+    return features / np.linalg.norm(features, axis=-1, keepdims=True)
+
+
+class _ImageTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, pixel_values):
+        return _pooled(self.model.get_image_features(pixel_values=pixel_values))
+
+
+class _TextTower(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids):
+        return _pooled(
+            self.model.get_text_features(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                token_type_ids=token_type_ids,
+            )
+        )
+
+
+class TorchBackend:
+    """ALIGN towers in PyTorch; takes and returns numpy, features L2-normalized.
+
+    On CPU the convolutional image tower runs in channels-last layout, which
+    oneDNN convolutions are fastest in.
+    """
+
+    def __init__(self, model, device: str = "cpu", name: str = "eager"):
+        self.name = name
+        self.device = device
+        self.channels_last = device == "cpu"
+        self.image_tower = _ImageTower(model).eval()
+        self.text_tower = _TextTower(model).eval()
+        if self.channels_last:
+            self.image_tower.to(memory_format=torch.channels_last)
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        pixel_values = torch.from_numpy(pixel_values).to(self.device)
+        if self.channels_last:
+            pixel_values = pixel_values.contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode():
+            outputs = self.image_tower(pixel_values)
+        return normalize(outputs.float().cpu().numpy())
+
+    def text_features(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        tensors = [torch.from_numpy(np.asarray(inputs[name])).to(self.device) for name in TEXT_INPUTS]
+        with torch.inference_mode():
+            outputs = self.text_tower(*tensors)
+        return normalize(outputs.float().cpu().numpy())
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of every Linear layer, for CPU inference.
+
+    Weights are quantized once, activations per batch, so no calibration
+    data is needed. The BERT text tower and the projection are Linear layers
+    and speed up; the EfficientNet image tower is convolutions and keeps fp32.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+class OnnxBackend:
+    """Both towers exported to ONNX once and run with ONNX Runtime on CPU.
+
+    Graphs are written to ``export_dir`` and reused on later starts; delete
+    the directory after changing the model. The image graph has a fixed
+    input size, recorded next to it, and is exported again when
+    ``image_size`` changes.
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model,
+        export_dir: str,
+        image_size: int = 289,
+        threads: Optional[int] = None,
+        opset: int = 17,
+    ):
+        try:
+            import onnxruntime as ort
+        except ImportError as exc:
+            raise RuntimeError("The onnx embedder backend needs onnxruntime installed") from exc
+
+        os.makedirs(export_dir, exist_ok=True)
+        image_path = os.path.join(export_dir, "image_tower.onnx")
+        text_path = os.path.join(export_dir, "text_tower.onnx")
+        self.image_size = image_size
+        exported_size = self._exported_image_size(image_path)
+        if exported_size is not None and exported_size != image_size:
+            logger.info(
+                "Image tower was exported for %spx input, re-exporting for %spx",
+                exported_size,
+                image_size,
+            )
+        if exported_size != image_size:
+            self._export(
+                _ImageTower(model).eval(),
+                (torch.zeros(1, 3, image_size, image_size),),
+                ["pixel_values"],
+                {"pixel_values": {0: "batch"}},
+                image_path,
+                opset,
+            )
+            with open(image_path + ".json", "w", encoding="utf-8") as f:
+                json.dump({"image_size": image_size}, f)
+        if not os.path.exists(text_path):
+            ids = torch.zeros(1, 8, dtype=torch.long)
+            self._export(
+                _TextTower(model).eval(),
+                (ids, torch.ones_like(ids), torch.zeros_like(ids)),
+                list(TEXT_INPUTS),
+                {name: {0: "batch", 1: "sequence"} for name in TEXT_INPUTS},
+                text_path,
+                opset,
+            )
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        providers = ["CPUExecutionProvider"]
+        self.image_session = ort.InferenceSession(image_path, options, providers=providers)
+        self.text_session = ort.InferenceSession(text_path, options, providers=providers)
+        # The exporter drops inputs the graph does not use.
+        self.text_inputs = [item.name for item in self.text_session.get_inputs()]
+
+    @staticmethod
+    def _exported_image_size(image_path: str) -> Optional[int]:
+        """Input size the cached image graph was exported for; None if unknown."""
+        if not os.path.exists(image_path):
+            return None
+        try:
+            with open(image_path + ".json", encoding="utf-8") as f:
+                return json.load(f)["image_size"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    @staticmethod
+    def _export(tower, args, input_names, dynamic_axes, path: str, opset: int) -> None:
+        logger.info("Exporting %s", path)
+        partial = path + ".partial"
+        with torch.no_grad():
+            torch.onnx.export(
+                tower,
+                args,
+                partial,
+                input_names=input_names,
+                output_names=["features"],
+                dynamic_axes={**dynamic_axes, "features": {0: "batch"}},
+                opset_version=opset,
+                dynamo=False,
+            )
+        os.replace(partial, path)
+
+    def image_features(self, pixel_values: np.ndarray) -> np.ndarray:
+        if pixel_values.shape[-2:] != (self.image_size, self.image_size):
+            raise ValueError(
+                f"ONNX image tower takes {self.image_size}x{self.image_size} pixels, "
+                f"got {pixel_values.shape[-2]}x{pixel_values.shape[-1]}"
+            )
+        (outputs,) = self.image_session.run(
+            None, {"pixel_values": np.ascontiguousarray(pixel_values, dtype=np.float32)}
+        )
+        return normalize(outputs)
+
+    def text_features(self, inputs: Dict[str, np.ndarray]) -> np.ndarray:
+        feed = {name: np.asarray(inputs[name], dtype=np.int64) for name in self.text_inputs}
+        (outputs,) = self.text_session.run(None, feed)
+        return normalize(outputs)
+
+
+def load_backend(
+    name: str,
+    model,
+    device: str = "cpu",
+    image_size: int = 289,
+    onnx_dir: Optional[str] = None,
+    threads: Optional[int] = None,
+):
+    """Backend ``name`` (one of ``BACKENDS``) around a loaded fp32 ``model``."""
+    name = name.lower()
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedder backend {name!r}, expected one of {BACKENDS}")
+    if name != "eager" and device != "cpu":
+        raise ValueError(f"The {name} embedder backend runs on CPU only, device is {device}")
+    if name == "eager":
+        return TorchBackend(model, device)
+    if name == "int8":
+        return TorchBackend(quantize_int8(model), device, name="int8")
+    if onnx_dir is None:
+        raise ValueError("The onnx embedder backend needs an export directory")
+    return OnnxBackend(model, onnx_dir, image_size=image_size, threads=threads)
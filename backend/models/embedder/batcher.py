@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+# A handler embeds a whole batch and returns one result per item, in order.
+# An item that failed on its own is returned as its Exception.
+BatchHandler = Callable[[List[Any]], List[Any]]
+
+
+class _ModalityStats:
+    def __init__(self):
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.wait_ms_total = 0.0
+        self.inference_ms_total = 0.0
+        self.batch_sizes: Counter = Counter()
+
+    def as_dict(self, queue_depth: int) -> Dict[str, Any]:
+        return {
+            "queue_depth": queue_depth,
+            "requests": self.requests,
+            "batches": self.batches,
+            "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+            "mean_wait_ms": self.wait_ms_total / self.items if self.items else 0.0,
+            "mean_inference_ms": (
+                self.inference_ms_total / self.batches if self.batches else 0.0
+            ),
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+
+class MicroBatcher:
+    """Coalesces concurrent embedding requests into shared forward passes.
+
+    Items are queued per modality. A batch is flushed once it reaches
+    ``max_batch_size`` or its oldest item has waited ``max_wait_ms``, and runs
+    on a single dedicated inference thread so the event loop never blocks.
+    """
+
+    def __init__(
+        self,
+        handlers: Dict[str, BatchHandler],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.handlers = handlers
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._tasks: List[asyncio.Task] = []
+        self._stats = {modality: _ModalityStats() for modality in handlers}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def start(self) -> None:
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="embedder-inference"
+        )
+        for modality in self.handlers:
+            self._queues[modality] = asyncio.Queue()
+            self._tasks.append(asyncio.create_task(self._collect(modality)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def submit(self, modality: str, item: Any) -> Any:
+        result = (await self.submit_many(modality, [item]))[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    async def submit_many(self, modality: str, items: List[Any]) -> List[Any]:
+        """Queue items individually; per-item failures come back as exceptions."""
+        loop = asyncio.get_running_loop()
+        futures = []
+        enqueued_at = time.perf_counter()
+        for item in items:
+            future = loop.create_future()
+            self._queues[modality].put_nowait((item, future, enqueued_at))
+            futures.append(future)
+        self._stats[modality].requests += 1
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "modalities": {
+                modality: stats.as_dict(self._queues[modality].qsize())
+                for modality, stats in self._stats.items()
+            },
+        }
+
+    async def _collect(self, modality: str) -> None:
+        queue = self._queues[modality]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._run(modality, batch)
+
+    async def _run(self, modality: str, batch) -> None:
+        loop = asyncio.get_running_loop()
+        items = [item for item, _, _ in batch]
+        started = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(
+                self._executor, self.handlers[modality], items
+            )
+        except Exception as exc:  # noqa: BLE001
+            results = [exc] * len(batch)
+        finished = time.perf_counter()
+
+        stats = self._stats[modality]
+        stats.batches += 1
+        stats.items += len(batch)
+        stats.batch_sizes[len(batch)] += 1
+        stats.inference_ms_total += (finished - started) * 1000.0
+        for (_, future, enqueued_at), result in zip(batch, results):
+            stats.wait_ms_total += (started - enqueued_at) * 1000.0
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
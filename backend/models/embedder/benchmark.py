@@ -0,0 +1,199 @@
+"""Parity and throughput of the embedder inference backends against eager fp32.
+
+Runs offline on a small randomly initialized ALIGN by default; ``--pretrained``
+loads kakaobrain/align-base instead. Besides synthetic tensors, every backend
+embeds ``test.jpg`` as the serving ImageDecoder outputs it, at the decoder's
+real input size. Exits non-zero when a backend fails on that input or its
+cosine agreement with fp32 falls below ``--min-cosine``. For example::
+
+    python -m backend.models.embedder.benchmark
+    python -m backend.models.embedder.benchmark --pretrained --threads 4 --batch-size 32
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Dict, Tuple
+
+import numpy as np
+import torch
+
+from backend.models.embedder.backends import BACKENDS, load_backend
+from backend.models.embedder.preprocessing import ImageDecoder, stack_pixels
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), "test.jpg")
+
+PARITY_TEXTS = [
+    "a pedestrian crossing the street at night",
+    "a truck parked on the side of the road",
+    "cyclist in the bike lane",
+    "traffic light turning red at an intersection",
+    "wet road with reflections after rain",
+    "construction cones blocking a lane",
+    "a bus stopping to pick up passengers",
+    "empty highway in the desert",
+]
+
+
+def tiny_model():
+    """A few-layer ALIGN with random weights; parity needs no trained weights."""
+    from transformers import AlignConfig, AlignModel, AlignTextConfig, AlignVisionConfig
+
+    text_config = AlignTextConfig(
+        vocab_size=1000,
+        hidden_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        intermediate_size=128,
+        max_position_embeddings=64,
+    )
+    vision_config = AlignVisionConfig(
+        image_size=64,
+        kernel_sizes=[3, 3, 5],
+        in_channels=[32, 16, 24],
+        out_channels=[16, 24, 30],
+        hidden_dim=64,
+        strides=[1, 1, 2],
+        num_block_repeats=[1, 1, 2],
+        expand_ratios=[1, 6, 6],
+    )
+    config = AlignConfig.from_text_vision_configs(text_config, vision_config, projection_dim=64)
+    torch.manual_seed(0)
+    return AlignModel(config).eval(), None, 64
+
+
+def pretrained_model():
+    from transformers import AlignModel, AlignProcessor
+
+    processor = AlignProcessor.from_pretrained("kakaobrain/align-base")
+    model = AlignModel.from_pretrained("kakaobrain/align-base").eval()
+    return model, processor, processor.image_processor.size["height"]
+
+
+def fixed_inputs(processor, image_size: int, count: int, seed: int) -> Tuple[np.ndarray, Dict]:
+    """Deterministic pixels (smooth gradients plus noise) and token batches."""
+    rng = np.random.default_rng(seed)
+    grid = np.linspace(-1.0, 1.0, image_size, dtype=np.float32)
+    base = np.stack(np.meshgrid(grid, grid)).sum(axis=0) / 2
+    pixels = np.stack(
+        [
+            np.stack([base * rng.uniform(-1, 1) for _ in range(3)])
+            + rng.normal(scale=0.2, size=(3, image_size, image_size))
+            for _ in range(count)
+        ]
+    ).astype(np.float32)
+
+    texts = [PARITY_TEXTS[index % len(PARITY_TEXTS)] for index in range(count)]
+    if processor is not None:
+        tokens = processor.tokenizer(texts, return_tensors="np", padding=True)
+        inputs = {name: tokens[name] for name in ("input_ids", "attention_mask", "token_type_ids")}
+    else:
+        ids = rng.integers(1, 1000, size=(count, 16))
+        inputs = {
+            "input_ids": ids,
+            "attention_mask": np.ones_like(ids),
+            "token_type_ids": np.zeros_like(ids),
+        }
+    return pixels, inputs
+
+
+def decoded_inputs(processor, image_size: int, count: int) -> np.ndarray:
+    """``SAMPLE_IMAGE`` decoded by the serving ImageDecoder, ``count`` times."""
+    if processor is not None:
+        image_processor = processor.image_processor
+    else:
+        from transformers import EfficientNetImageProcessor
+
+        image_processor = EfficientNetImageProcessor(
+            size={"height": image_size, "width": image_size}, do_center_crop=False
+        )
+    decoder = ImageDecoder(image_processor, workers=1)
+    try:
+        with open(SAMPLE_IMAGE, "rb") as f:
+            decoded = decoder.decode(f.read())
+    finally:
+        decoder.shutdown()
+    return stack_pixels([decoded] * count)
+
+
+def _throughput(fn, batch, items: int, repeats: int) -> float:
+    fn(batch)  # warmup: kernel selection, lazy allocations
+    started = time.perf_counter()
+    for _ in range(repeats):
+        fn(batch)
+    return items * repeats / (time.perf_counter() - started)
+
+
+def run(args: argparse.Namespace) -> int:
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    threads = torch.get_num_threads()
+    model, processor, image_size = pretrained_model() if args.pretrained else tiny_model()
+    decoded = decoded_inputs(processor, image_size, min(args.batch_size, 4))
+    # Backends and synthetic pixels use the decoder's input size, as serving does.
+    image_size = decoded.shape[-1]
+    pixels, tokens = fixed_inputs(processor, image_size, args.batch_size, args.seed)
+
+    failed = False
+    with tempfile.TemporaryDirectory() as onnx_dir:
+        reference = load_backend("eager", model)
+        expected_image = reference.image_features(pixels)
+        expected_text = reference.text_features(tokens)
+        expected_decoded = reference.image_features(decoded)
+
+        print(f"batch={args.batch_size} image={image_size}px threads={threads}")
+        print(
+            f"{'backend':>8} {'img cos min':>11} {'txt cos min':>11} {'jpg cos min':>11} "
+            f"{'img/s':>8} {'img/s/core':>10} {'txt/s':>8} {'speedup':>8}"
+        )
+        baseline = None
+        # Eager fp32 always runs first: it is the throughput baseline.
+        for name in ["eager"] + [name for name in args.backends if name != "eager"]:
+            try:
+                backend = load_backend(
+                    name, model, image_size=image_size, onnx_dir=onnx_dir, threads=args.threads
+                )
+            except RuntimeError as exc:
+                print(f"{name:>8} skipped: {exc}")
+                continue
+            image_cos = np.sum(backend.image_features(pixels) * expected_image, axis=1).min()
+            text_cos = np.sum(backend.text_features(tokens) * expected_text, axis=1).min()
+            try:
+                decoded_cos = np.sum(
+                    backend.image_features(decoded) * expected_decoded, axis=1
+                ).min()
+            except Exception as exc:  # noqa: BLE001
+                print(f"{name:>8} FAILED on decoder output {decoded.shape}: {exc}")
+                failed = True
+                continue
+            image_fps = _throughput(backend.image_features, pixels, len(pixels), args.repeats)
+            text_fps = _throughput(backend.text_features, tokens, len(pixels), args.repeats)
+            baseline = baseline or image_fps
+            print(
+                f"{name:>8} {image_cos:>11.4f} {text_cos:>11.4f} {decoded_cos:>11.4f} "
+                f"{image_fps:>8.1f} {image_fps / threads:>10.2f} {text_fps:>8.1f} "
+                f"{image_fps / baseline:>8.2f}"
+            )
+            if min(image_cos, text_cos, decoded_cos) < args.min_cosine:
+                print(f"{name:>8} FAILED: cosine below {args.min_cosine}")
+                failed = True
+    return 1 if failed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--pretrained", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--min-cosine", type=float, default=0.99)
+    parser.add_argument("--seed", type=int, default=0)
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,21 @@
 import io
-from fastapi import FastAPI
-from fastapi import UploadFile, File, Request
-from PIL import Image
+import struct
+import threading
+import time
+from typing import List, Optional
+import numpy as np
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi import UploadFile, File, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
 from transformers import AlignProcessor, AlignModel
 from configs.hw_settings import EMBEDDER_CONFIG
+from backend.models.embedder.backends import load_backend
+from backend.models.embedder.batcher import MicroBatcher
+from backend.models.embedder.preprocessing import DecodedImage, ImageDecoder, stack_pixels
 import torch
 from transformers import logging
 
-from transformers import logging
 logging.disable_progress_bar()
 
 app = FastAPI(title="Align Text Embedding API")
@@ -21,97 +29,352 @@ elif cfg_device == "mps" and torch.backends.mps.is_available():
 else:
     device = "cpu"
 
-processor = AlignProcessor.from_pretrained("kakaobrain/align-base")
-model = AlignModel.from_pretrained("kakaobrain/align-base").to(device)
-model.eval()
-print(
-    f"Embedder has been successfully initialized.",
-    f"Device: {device}.",
-    f"Port: {EMBEDDER_CONFIG.PORT}"
-)
-if cfg_device != device:
+if EMBEDDER_CONFIG.NUM_THREADS:
+    torch.set_num_threads(EMBEDDER_CONFIG.NUM_THREADS)
+
+# Loaded in the background after the server binds; see load_model.
+processor = None
+model = None
+decoder = None
+backend = None
+ready = threading.Event()
+load_state = {"error": None, "load_sec": None, "warmup_ms": None}
+
+
+def load_model() -> None:
+    """Load weights, build the backend and run a warmup batch, then mark ready.
+
+    safetensors weights in ``HF_HOME`` are memory-mapped, and
+    ``low_cpu_mem_usage`` loads them straight into the model instead of
+    initializing random weights first and copying over them. The warmup
+    batch pays for lazy kernel selection and allocations before the first
+    real request does.
+    """
+    global processor, model, decoder, backend
+    started = time.perf_counter()
+    try:
+        processor = AlignProcessor.from_pretrained(EMBEDDER_CONFIG.MODEL_NAME)
+        model = AlignModel.from_pretrained(
+            EMBEDDER_CONFIG.MODEL_NAME,
+            use_safetensors=True,
+            low_cpu_mem_usage=True,
+        ).to(device)
+        model.eval()
+        decoder = ImageDecoder(
+            processor.image_processor,
+            workers=EMBEDDER_CONFIG.DECODE_WORKERS,
+            draft=EMBEDDER_CONFIG.DECODE_DRAFT,
+        )
+        backend = load_backend(
+            EMBEDDER_CONFIG.BACKEND,
+            model,
+            device=device,
+            image_size=decoder.input_size[1],
+            onnx_dir=EMBEDDER_CONFIG.ONNX_DIR,
+            threads=EMBEDDER_CONFIG.NUM_THREADS,
+        )
+        load_state["load_sec"] = round(time.perf_counter() - started, 2)
+        load_state["warmup_ms"] = warmup(EMBEDDER_CONFIG.WARMUP_BATCH_SIZE)
+    except Exception as exc:  # noqa: BLE001
+        load_state["error"] = f"{type(exc).__name__}: {exc}"
+        print(f"Embedder failed to load: {load_state['error']}")
+        return
+    ready.set()
     print(
-        f"Your config device was: {device}, but currently is used {device}.",
-        f"Check your {cfg_device} availability"
+        f"Embedder has been successfully initialized.",
+        f"Device: {device}.",
+        f"Backend: {backend.name}.",
+        f"Loaded in {load_state['load_sec']}s, warmup {load_state['warmup_ms']}ms."
     )
+    if cfg_device != device:
+        print(
+            f"Your config device was: {device}, but currently is used {device}.",
+            f"Check your {cfg_device} availability"
+        )
+
+
+def warmup(batch_size: int) -> Optional[float]:
+    if batch_size <= 0:
+        return None
+    started = time.perf_counter()
+    width, height = decoder.input_size
+    image_features(np.zeros((batch_size, 3, height, width), dtype=np.float32))
+    text_features(["warmup"] * batch_size)
+    return round((time.perf_counter() - started) * 1000.0, 1)
+
+
+def require_ready() -> None:
+    if not ready.is_set():
+        detail = load_state["error"] or "Model is loading"
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+
+class TextBatchRequest(BaseModel):
+    texts: List[str] = Field(..., min_length=1)
 
 
 def extract_patches(image, patch: bool):
     return [image]
 
 
-@app.post("/embedding/text")
-async def inference_text(text: str):
+def split_length_prefixed(body: bytes) -> List[bytes]:
+    """Split a body of [uint32 little-endian length][payload] records."""
+    items = []
+    offset = 0
+    while offset < len(body):
+        if offset + 4 > len(body):
+            raise ValueError("Truncated length prefix")
+        (size,) = struct.unpack_from("<I", body, offset)
+        offset += 4
+        if offset + size > len(body):
+            raise ValueError("Truncated payload")
+        items.append(body[offset:offset + size])
+        offset += size
+    return items
+
+
+def image_features(pixel_values: np.ndarray) -> np.ndarray:
+    return backend.image_features(pixel_values)  # [N, D], normalized
+
+
+def text_features(texts: List[str]) -> np.ndarray:
     inputs = processor.tokenizer(
-        text,
-        return_tensors="pt",
+        texts,
+        return_tensors="np",
         padding=True
-    ).to(device)
+    )
+    return backend.text_features(inputs)  # [N, D], normalized
 
-    with torch.no_grad():
-        outputs = model.get_text_features(
-            input_ids=inputs['input_ids'],
-            attention_mask=inputs['attention_mask'],
-            token_type_ids=inputs['token_type_ids'],
-        )
 
-    if hasattr(outputs, "pooler_output"):
-        outputs = outputs.pooler_output
+def embed_image_batch(images: List[DecodedImage]) -> list:
+    """Embed decoded images; runs on the batcher's inference thread."""
+    rows = image_features(stack_pixels(images))
+    return [(row, image.size) for image, row in zip(images, rows)]
+
+
+def embed_text_batch(texts: List[str]) -> list:
+    results = [None] * len(texts)
+    valid = []
+    for index, text in enumerate(texts):
+        if text.strip():
+            valid.append(index)
+        else:
+            results[index] = ValueError("Empty text")
+    if valid:
+        rows = text_features([texts[index] for index in valid])
+        for index, row in zip(valid, rows):
+            results[index] = row
+    return results
+
+
+batcher = MicroBatcher(
+    handlers={"image": embed_image_batch, "text": embed_text_batch},
+    max_batch_size=EMBEDDER_CONFIG.MAX_BATCH_SIZE,
+    max_wait_ms=EMBEDDER_CONFIG.MAX_WAIT_MS,
+)
+
+
+@app.on_event("startup")
+async def start_batcher():
+    await batcher.start()
+    threading.Thread(target=load_model, name="embedder-load", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    if decoder:
+        decoder.shutdown()
+
+
+@app.get("/health")
+async def healthcheck():
+    """Liveness: the process serves requests, whether or not the model is loaded."""
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def readiness():
+    """Readiness: 200 once the model is loaded and warmed up, 503 until then."""
+    body = {
+        "ready": ready.is_set(),
+        "model": EMBEDDER_CONFIG.MODEL_NAME,
+        "backend": backend.name if backend else None,
+        "device": device,
+        **load_state,
+    }
+    if not ready.is_set():
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+
+async def embed_image(image_bytes: bytes):
+    (image,) = await decoder.decode_many([image_bytes])
+    if isinstance(image, Exception):
+        raise HTTPException(status_code=400, detail=f"Cannot decode image: {image}")
+    return await batcher.submit("image", image)
+
+
+async def embed_images(payloads: List[bytes]) -> list:
+    """Decode on the decode pool, then embed what decoded; failures stay in place."""
+    results = await decoder.decode_many(payloads)
+    valid = [index for index, image in enumerate(results) if not isinstance(image, Exception)]
+    embedded = await batcher.submit_many("image", [results[index] for index in valid])
+    for index, result in zip(valid, embedded):
+        results[index] = result
+    return results
+
+
+BINARY_MEDIA_TYPES = ("application/octet-stream", "application/x-npy")
+
+
+def negotiated_media_type(request: Request) -> Optional[str]:
+    """Binary media type the client asked for in Accept, None for JSON."""
+    accept = request.headers.get("accept", "")
+    for media_type in BINARY_MEDIA_TYPES:
+        if media_type in accept:
+            return media_type
+    return None
+
+
+def binary_response(matrix: np.ndarray, media_type: str, headers: Optional[dict] = None):
+    """Little-endian float32 embeddings, raw or as an .npy file."""
+    matrix = np.ascontiguousarray(matrix, dtype="<f4")
+    if media_type == "application/x-npy":
+        buffer = io.BytesIO()
+        np.save(buffer, matrix)
+        content = buffer.getvalue()
+    else:
+        content = matrix.tobytes()
+    return Response(
+        content=content,
+        media_type=media_type,
+        headers={
+            "X-Embedding-Dim": str(matrix.shape[-1]),
+            "X-Embedding-Shape": ",".join(str(size) for size in matrix.shape),
+            **(headers or {}),
+        },
+    )
+
+
+def batch_binary_response(results: list, media_type: str):
+    """Binary matrix of a fully successful batch.
+
+    Error messages are unbounded and would not fit in a header, so a batch
+    with any failed item falls back to the JSON body of ``batch_response``.
+    """
+    if any(isinstance(result, Exception) for result in results):
+        return batch_response(results)
+    rows = [result[0] if isinstance(result, tuple) else result for result in results]
+    return binary_response(np.stack(rows), media_type)
 
-    embedding = outputs / outputs.norm(dim=-1, keepdim=True)  # [1, D]
-    embedding = embedding.cpu().tolist()[0]
 
+def batch_response(results: list):
+    embeddings = []
+    errors = []
+    dim = None
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            embeddings.append(None)
+            errors.append({"index": index, "error": str(result)})
+            continue
+        row = result[0] if isinstance(result, tuple) else result
+        embeddings.append(row.tolist())
+        dim = len(row)
     return {
-        "text": text,
-        "embedding": embedding,
-        "dim": len(embedding)
+        "count": len(results),
+        "embeddings": embeddings,
+        "errors": errors,
+        "dim": dim,
     }
 
 
-@app.post("/embedding/image")
-async def inference_image(file: UploadFile = File(...)):
-    image_bytes = file.file.read()
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+@app.get("/stats")
+async def batcher_stats():
+    return batcher.stats()
 
-    inputs = processor(images=image, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model.get_image_features(
-            pixel_values=inputs['pixel_values'],
-        )
 
-    if hasattr(outputs, "pooler_output"):
-        outputs = outputs.pooler_output
+@app.post("/embedding/text", dependencies=[Depends(require_ready)])
+async def inference_text(text: str, request: Request):
+    embedding = await batcher.submit("text", text)
+    media_type = negotiated_media_type(request)
+    if media_type:
+        return binary_response(embedding, media_type)
+    embedding = embedding.tolist()
 
-    embedding = outputs / outputs.norm(dim=-1, keepdim=True)
-    embedding = embedding.cpu().tolist()[0]
+    return {
+        "text": text,
+        "embedding": embedding,
+        "dim": len(embedding)
+    }
+
+
+@app.post("/embedding/image", dependencies=[Depends(require_ready)])
+async def inference_image(request: Request, file: UploadFile = File(...)):
+    image_bytes = await file.read()
+    embedding, image_shape = await embed_image(image_bytes)
+    media_type = negotiated_media_type(request)
+    if media_type:
+        image_header = {"X-Image-Shape": ",".join(str(size) for size in image_shape)}
+        return binary_response(embedding, media_type, image_header)
+    embedding = embedding.tolist()
 
     return {
         "filename": file.filename,
-        "image_shape": image.size,
+        "image_shape": image_shape,
         "embedding": embedding,
         "dim": len(embedding)
     }
 
 
-@app.post("/embedding/image_bytes")
+@app.post("/embedding/image_bytes", dependencies=[Depends(require_ready)])
 async def embedding_image_bytes(request: Request):
     image_bytes = await request.body()
-    image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-
-    inputs = processor(images=image, return_tensors="pt")
-    with torch.no_grad():
-        outputs = model.get_image_features(
-            pixel_values=inputs['pixel_values'],
-        )
-
-    if hasattr(outputs, "pooler_output"):
-        outputs = outputs.pooler_output
-
-    embedding = outputs / outputs.norm(dim=-1, keepdim=True)
-    embedding = embedding.cpu().tolist()[0]
+    embedding, image_shape = await embed_image(image_bytes)
+    media_type = negotiated_media_type(request)
+    if media_type:
+        image_header = {"X-Image-Shape": ",".join(str(size) for size in image_shape)}
+        return binary_response(embedding, media_type, image_header)
+    embedding = embedding.tolist()
 
     return {
-        "image_shape": image.size,
+        "image_shape": image_shape,
         "embedding": embedding,
         "dim": len(embedding)
     }
+
+
+@app.post("/embedding/image_batch", dependencies=[Depends(require_ready)])
+async def embedding_image_batch(request: Request):
+    """Embed N images, sharing forward passes with concurrent requests.
+
+    Accepts multipart/form-data with repeated ``files`` fields or an
+    application/octet-stream body of length-prefixed images. Images that
+    fail to decode are reported in ``errors`` and get a null embedding.
+    """
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        form = await request.form()
+        payloads = [await item.read() for item in form.getlist("files")]
+    else:
+        try:
+            payloads = split_length_prefixed(await request.body())
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+    if not payloads:
+        raise HTTPException(status_code=400, detail="No images in request")
+
+    results = await embed_images(payloads)
+    media_type = negotiated_media_type(request)
+    if media_type:
+        return batch_binary_response(results, media_type)
+    return batch_response(results)
+
+
+@app.post("/embedding/text_batch", dependencies=[Depends(require_ready)])
+async def embedding_text_batch(payload: TextBatchRequest, request: Request):
+    results = await batcher.submit_many("text", payload.texts)
+    media_type = negotiated_media_type(request)
+    if media_type:
+        return batch_binary_response(results, media_type)
+    return batch_response(results)
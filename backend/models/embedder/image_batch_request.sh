@@ -0,0 +1,3 @@
+curl -X POST http://0.0.0.0:8000/embedding/image_batch \
+     -F "files=@test.jpg" \
+     -F "files=@test.jpg"
\ No newline at end of file
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import asyncio
+import io
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, List, Optional, Tuple, Union
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class DecodedImage:
+    pixel_values: np.ndarray  # [C, H, W] float32, ready for the model
+    size: Tuple[int, int]     # (width, height) of the original image
+
+
+class ImageDecoder:
+    """Decodes image bytes into model-ready pixel arrays on a thread pool.
+
+    JPEGs are opened in draft mode: libjpeg scales them down by 1/2, 1/4 or
+    1/8 while decoding the DCT coefficients, to the smallest size still
+    covering what ``image_processor`` resizes to (before any center crop).
+    kakaobrain/align-base resizes straight to 289x289 without a crop, so a
+    1920x1280 camera frame is decoded at 480x320, a sixteenth of the pixels,
+    and only then resized by ``image_processor``. ``input_size`` is what the
+    model receives after the crop. PIL releases the GIL while decoding and
+    resizing, so threads scale across cores without pickling frames to other
+    processes.
+    """
+
+    def __init__(self, image_processor: Any, workers: int = 4, draft: bool = True):
+        self.image_processor = image_processor
+        self.draft = draft
+        self.input_size = self._input_size(image_processor)
+        self._draft_size = self._draft_target(image_processor)
+        self._executor: Optional[ThreadPoolExecutor] = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="embedder-decode"
+        )
+
+    @staticmethod
+    def _resize_size(image_processor: Any) -> Tuple[int, int]:
+        """(width, height) the processor resizes to."""
+        size = image_processor.size
+        if "height" in size and "width" in size:
+            return size["width"], size["height"]
+        edge = size.get("shortest_edge") or size.get("longest_edge")
+        return edge, edge
+
+    @staticmethod
+    def _center_crop(image_processor: Any) -> Optional[Tuple[int, int]]:
+        crop = getattr(image_processor, "crop_size", None)
+        if getattr(image_processor, "do_center_crop", False) and crop:
+            return crop["width"], crop["height"]
+        return None
+
+    @classmethod
+    def _input_size(cls, image_processor: Any) -> Tuple[int, int]:
+        """(width, height) of the pixel values the model gets."""
+        return cls._center_crop(image_processor) or cls._resize_size(image_processor)
+
+    @classmethod
+    def _draft_target(cls, image_processor: Any) -> Tuple[int, int]:
+        """Smallest (width, height) to decode at: the resize, and the center crop it feeds."""
+        width, height = cls._resize_size(image_processor)
+        crop = cls._center_crop(image_processor)
+        if crop:
+            # A crop larger than the resize is padded up to it from that resize.
+            width, height = max(width, crop[0]), max(height, crop[1])
+        return width, height
+
+    def decode(self, image_bytes: bytes) -> DecodedImage:
+        image = Image.open(io.BytesIO(image_bytes))
+        original_size = image.size
+        if self.draft and image.format == "JPEG":
+            image.draft("RGB", self._draft_size)
+        image = image.convert("RGB")
+        pixel_values = self.image_processor(images=image, return_tensors="np")["pixel_values"][0]
+        return DecodedImage(np.ascontiguousarray(pixel_values, dtype=np.float32), original_size)
+
+    async def decode_many(self, payloads: List[bytes]) -> List[Union[DecodedImage, Exception]]:
+        """Decode concurrently; images that fail come back as their exception."""
+        loop = asyncio.get_running_loop()
+        return await asyncio.gather(
+            *(loop.run_in_executor(self._executor, self.decode, payload) for payload in payloads),
+            return_exceptions=True,
+        )
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def stack_pixels(images: List[DecodedImage]) -> np.ndarray:
+    """One [N, C, H, W] batch from decoded images."""
+    return np.stack([image.pixel_values for image in images])
@@ -0,0 +1,3 @@
+curl -X POST http://0.0.0.0:8000/embedding/text_batch \
+     -H "Content-Type: application/json" \
+     -d '{"texts": ["pedestrian at night", "cyclist"]}'
\ No newline at end of file
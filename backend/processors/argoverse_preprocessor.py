@@ -1,11 +1,15 @@
 from .preprocessor import Preprocessor
-from typing import List, Optional, Dict
+from .sampling import SamplingPolicy, step_bucket
+from typing import Iterator, List, Optional, Dict
 from tqdm import tqdm
 import pandas as pd
 import requests
-from pathlib import Path
+import urllib3
+from pathlib import Path, PurePosixPath
 from glob import glob
+import io
 import shutil
+import tarfile
 import os
 
 from configs.common import DATA_DIR, ARGOVERSE_DIR
@@ -14,7 +18,84 @@ S3_DATASET_LINK = "https://s3.amazonaws.com/argoverse/datasets/av2/tars/sensor/"
 DATA_FOLDER = Path(DATA_DIR) / ARGOVERSE_DIR
 
 
+class _TarStream(io.RawIOBase):
+    """Bytes of a remote tar: a partial local copy first, then the rest over HTTP.
+
+    A dropped connection is resumed with a Range request from the last byte
+    read, so one network hiccup does not restart a multi-GB part.
+    """
+
+    def __init__(self, url: str, local_path: str, chunk_size: int, retries: int = 3):
+        self.url = url
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.offset = 0
+        self.local = open(local_path, "rb") if os.path.exists(local_path) else None
+        self.response = None
+        self.exhausted = False
+        self.pbar = tqdm(unit="B", unit_scale=True, unit_divisor=1024, desc=os.path.basename(url))
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        size = self.chunk_size if size is None or size < 0 else size
+        data = b""
+        if self.local is not None:
+            data = self.local.read(size)
+            if not data:
+                self.local.close()
+                self.local = None
+        if not data:
+            data = self._read_remote(size)
+        self.offset += len(data)
+        self.pbar.update(len(data))
+        return data
+
+    def _read_remote(self, size: int) -> bytes:
+        if self.exhausted:
+            return b""
+        for attempt in range(self.retries + 1):
+            try:
+                if self.response is None:
+                    self._open_remote()
+                    if self.exhausted:
+                        return b""
+                return self.response.raw.read(size)
+            except (requests.RequestException, urllib3.exceptions.HTTPError):
+                self._close_response()
+                if attempt == self.retries:
+                    raise
+        return b""
+
+    def _open_remote(self) -> None:
+        headers = {"Range": f"bytes={self.offset}-"} if self.offset else {}
+        self.response = requests.get(self.url, stream=True, timeout=60, headers=headers)
+        if self.response.status_code == 416:  # the local copy was already complete
+            self._close_response()
+            self.exhausted = True
+            return
+        self.response.raise_for_status()
+        if self.offset and self.response.status_code != 206:
+            self._close_response()
+            raise RuntimeError(f"{self.url} does not support range requests")
+
+    def _close_response(self) -> None:
+        if self.response is not None:
+            self.response.close()
+            self.response = None
+
+    def close(self) -> None:
+        if self.local is not None:
+            self.local.close()
+            self.local = None
+        self._close_response()
+        self.pbar.close()
+        super().close()
+
+
 class ArgoversePreprocessor(Preprocessor):
+    DATASET_NAME = "argoverse"
     CHUNK_SIZE = 1024 * 1024  # 1 MB
 
     CAMERA_TO_LABEL = {
@@ -37,9 +118,16 @@ class ArgoversePreprocessor(Preprocessor):
                      "val": range(3),
                      "test": range(3)
                  },  # https://www.argoverse.org/av2.html#download-link
-                 remove_after_load: bool = False
+                 remove_after_load: bool = False,
+                 streaming: bool = True,
+                 save_local: bool = False,
+                 sampling: Optional[SamplingPolicy] = None
                 ):
-        super().__init__()
+        # An explicit policy (keyframes, max frames per log) overrides resample_seconds.
+        super().__init__(
+            save_local=save_local,
+            sampling=sampling or SamplingPolicy(step_seconds=resample_seconds),
+        )
 
         if cameras:
             self.cameras = set([
@@ -49,8 +137,10 @@ class ArgoversePreprocessor(Preprocessor):
             self.cameras = None
         self.download_parts = download_parts
         self.total_parts = sum([len(part) for part in download_parts.values()])
-        self.resample_seconds = resample_seconds
         self.remove_after_load = remove_after_load
+        # Streaming reads the tar straight from the HTTP response and keeps only
+        # the selected camera JPEGs; otherwise the whole part is downloaded and untarred.
+        self.streaming = streaming
 
         os.makedirs(DATA_FOLDER, exist_ok=True)
 
@@ -102,91 +192,190 @@ class ArgoversePreprocessor(Preprocessor):
         os.system(f'tar -xvf "{out_path}" -C "{DATA_FOLDER}"')
         return out_path
 
-    def filter_by_step_seconds(self, files: List[Path]) -> List[Path]:
-        step_ns = int(self.resample_seconds * 1e9)
-
-        parsed = []
-        for file in files:
-            p = Path(file)
-            parts = p.stem.split("_")
-            ts = None
-            for token in reversed(parts):
-                if token.isdigit():
-                    ts = int(token)
-                    break
-            if ts is None:
-                continue
-            parsed.append((ts, p))
-
-        parsed.sort(key=lambda x: x[0])
-
-        out = []
-        last_ts = None
-        for ts, p in parsed:
-            if last_ts is None or (ts - last_ts) >= step_ns:
-                out.append(p)
-                last_ts = ts
-
-        return out
+    def parse_frames(self, paths: List[str]) -> pd.DataFrame:
+        """Log id, camera and timestamp of camera JPEG paths, with vectorized string ops.
+
+        Paths look like ``.../<log_id>/sensors/cameras/<ring_camera>/<ts>.jpg``.
+        """
+        parts = pd.Series(paths, dtype=object).str.split(os.sep)
+        stems = parts.str[-1].str[: -len(".jpg")]
+        frames = pd.DataFrame({
+            "path": paths,
+            "log_id": parts.str[-5],
+            "camera": parts.str[-2],
+            "stem": stems,
+        })
+        frames = frames[stems.str.isdigit().fillna(False).to_numpy()]
+        return frames.assign(timestamp=frames["stem"].astype("int64")).drop(columns="stem")
 
     def fitler_part(self, path, split, part):
         trips_path = path / "sensor" / split
 
         # filter cameras
         paths = [
-            Path(p)
-            for camera in self.cameras
+            p
+            for camera in (self.cameras or ["ring_*"])
             for p in glob(str(trips_path / "**" / camera / "*.jpg"), recursive=True)
         ]
+        frames = self.parse_frames(paths)
+        frames = frames.iloc[self.sample(frames["timestamp"], frames[["log_id", "camera"]])]
 
         images: List[Path] = []
-        for src in paths:
-            ts_str = src.stem
-            cam_raw = src.parent.name
+        for src, cam_raw, ts in zip(frames["path"], frames["camera"], frames["timestamp"]):
             cam = self.REVERSE_CAMERA_TO_LABEL.get(cam_raw, cam_raw)
 
-            dst = DATA_FOLDER / f"{cam}_{ts_str}.jpg"
+            dst = DATA_FOLDER / f"{cam}_{ts}.jpg"
 
             if dst.exists():
                 i = 1
-                while (DATA_FOLDER / f"{cam}_{ts_str}_{i}.jpg").exists():
+                while (DATA_FOLDER / f"{cam}_{ts}_{i}.jpg").exists():
                     i += 1
-                dst = DATA_FOLDER / f"{cam}_{ts_str}_{i}.jpg"
+                dst = DATA_FOLDER / f"{cam}_{ts}_{i}.jpg"
 
-            src.rename(dst)  # moves files from sensor to argoverse data folder
+            Path(src).rename(dst)  # moves kept files from sensor to argoverse data folder
             images.append(dst)
-        
+
         if self.remove_after_load:
             sensor_dir = Path(DATA_FOLDER) / "sensor"
             if sensor_dir.exists():
                 shutil.rmtree(sensor_dir)
 
-        images = self.filter_by_step_seconds(images)
-
-        result = pd.DataFrame([
-            {
-                "timestamp": int(path.stem),
-                "camera_name": self.REVERSE_CAMERA_TO_LABEL[path.parent.name],
-                "dataset_type": "argoverse",
-                "image_path": path,
-                "source_link": os.path.join(S3_DATASET_LINK, f"{split}-{part:03d}.tar"),
-            }
-            for path in images
-        ])
+        result = pd.DataFrame({
+            "timestamp": frames["timestamp"].to_numpy(),
+            "camera_name": frames["camera"].map(
+                lambda camera: self.REVERSE_CAMERA_TO_LABEL.get(camera, camera)
+            ).to_numpy(),
+            "dataset_type": "argoverse",
+            "image_path": images,
+            "source_link": os.path.join(S3_DATASET_LINK, f"{split}-{part:03d}.tar"),
+        })
 
         # out_path = os.path.join(DATA_FOLDER, f"{split}-{part:03d}.parquet")
         # result.to_parquet(out_path, index=False)
         return result
 
+    def _keep_member(self, member: tarfile.TarInfo):
+        """(log_id, camera label, timestamp) of a selected camera JPEG, else None.
+
+        Members look like ``sensor/<split>/<log_id>/sensors/cameras/<ring_camera>/<ts>.jpg``.
+        """
+        if not member.isfile() or not member.name.endswith(".jpg"):
+            return None
+        path = PurePosixPath(member.name)
+        camera = path.parent.name
+        if not camera.startswith("ring_"):
+            return None
+        if self.cameras and camera not in self.cameras:
+            return None
+        if not path.stem.isdigit() or len(path.parts) < 5:
+            return None
+        return path.parts[-5], camera, int(path.stem)
+
+    def stream_part(self, split: str, part: int) -> Iterator[pd.DataFrame]:
+        """Yield the kept frames of one part, one DataFrame per log.
+
+        JPEG bytes stay in memory in the ``image`` column; they are written
+        to ``DATA_FOLDER`` only with ``save_local``.
+        """
+        filename = f"{split}-{part:03d}.tar"
+        url = os.path.join(S3_DATASET_LINK, filename)
+        step_seconds = self.sampling.step_seconds
+
+        # The step policy is applied as members arrive, so frames outside it
+        # are never read, let alone written; the rest of the policy needs the
+        # whole log and runs when the log is complete.
+        seen_buckets = set()
+        records = []
+        current_log = None
+        closed_logs = set()
+        with _TarStream(url, os.path.join(DATA_FOLDER, filename), self.CHUNK_SIZE) as stream:
+            with tarfile.open(fileobj=stream, mode="r|*") as tar:
+                for member in tar:
+                    keep = self._keep_member(member)
+                    if keep is None:
+                        continue
+                    log_id, camera, ts = keep
+                    if step_seconds:
+                        bucket = (log_id, camera, step_bucket(ts, step_seconds, 1e9))
+                        if bucket in seen_buckets:
+                            continue
+                        seen_buckets.add(bucket)
+
+                    # Assumes each log's members are contiguous in the archive (as in
+                    # the published AV2 sensor tars), so a new log closes the previous
+                    # one and its frames can be sampled and released. Buffering the
+                    # whole part instead would hold every JPEG of it in memory; a log
+                    # seen again means the assumption broke and its sampling would be
+                    # wrong, so stop rather than emit it in pieces.
+                    if log_id != current_log:
+                        if log_id in closed_logs:
+                            raise ValueError(
+                                f"{filename}: members of log {log_id} are not contiguous; "
+                                "stream_part needs each log stored in one run"
+                            )
+                        if current_log is not None:
+                            closed_logs.add(current_log)
+                        if records:
+                            yield self._sample_log(records)
+                            records = []
+                    current_log = log_id
+
+                    cam = self.REVERSE_CAMERA_TO_LABEL.get(camera, camera)
+                    name = f"{cam}_{ts}.jpg"
+                    with tar.extractfile(member) as src:
+                        image = src.read()
+                    records.append({
+                        "timestamp": ts,
+                        "camera_name": cam,
+                        "dataset_type": "argoverse",
+                        "image": image,
+                        "image_name": name,
+                        "source_link": url,
+                    })
+        if records:
+            yield self._sample_log(records)
+
+    def _sample_log(self, records: List[dict]) -> pd.DataFrame:
+        frames = pd.DataFrame(records)
+        keep = self.sample(frames["timestamp"], frames["camera_name"])
+        frames = frames.iloc[keep].reset_index(drop=True)
+        if self.save_local:
+            image_paths = []
+            for name, image in zip(frames["image_name"], frames["image"]):
+                dst = DATA_FOLDER / name
+                i = 1
+                while dst.exists():
+                    dst = DATA_FOLDER / f"{Path(name).stem}_{i}.jpg"
+                    i += 1
+                dst.write_bytes(image)
+                image_paths.append(str(dst))
+            frames["image_path"] = image_paths
+        return frames
+
     def process_part(self, split: str, part: int):
         output = self.download_part(split, part)
         output = self.fitler_part(Path(output).parent, split, part)
         return output
 
+    def tasks(self):
+        return [(split, part) for split, parts in self.download_parts.items() for part in parts]
+
+    def task_source(self, task) -> str:
+        split, part = task
+        return os.path.join(S3_DATASET_LINK, f"{split}-{part:03d}.tar")
+
+    def process_task(self, task):
+        split, part = task
+        if self.streaming:
+            return self.stream_part(split, part)
+        return self.process_part(split, part)
+
     def _generate(self):
-        for split, parts in self.download_parts.items():
-            for part in parts:
-                yield self.process_part(split, part)
+        for task in self.tasks():
+            if self.streaming:
+                yield from self.process_task(task)
+            else:
+                yield self.process_task(task)
 
     def __iter__(self):
         return self._generate()
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import logging
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import pandas as pd
+
+logger = logging.getLogger("avsp.executor")
+
+_DONE = object()
+
+
+def _run_task(fn: Callable[[Any], Any], task: Any) -> List[pd.DataFrame]:
+    """Worker side: run ``fn`` and make its frames picklable.
+
+    ``fn`` returns a DataFrame or an iterator of them. In-memory images may be
+    memoryviews into buffers that stay in the worker, so they become bytes.
+    """
+    result = fn(task)
+    frames = [result] if isinstance(result, pd.DataFrame) else list(result)
+    for df in frames:
+        if "image" in df.columns:
+            df["image"] = [
+                image.tobytes() if isinstance(image, memoryview) else image
+                for image in df["image"]
+            ]
+    return frames
+
+
+# What ``map`` yields per task: each DataFrame, then None once the task is
+# complete, or the exception it failed with.
+TaskItem = Tuple[Any, Union[pd.DataFrame, None, Exception]]
+
+
+class EpisodeExecutor:
+    """Runs ``fn`` over tasks on a process pool and streams the frames back.
+
+    At most ``max_inflight`` tasks are submitted and not yet consumed, which
+    bounds the downloads on disk and frames in memory. Results come back as
+    they complete, or in task order with ``ordered``. A failing task is
+    logged and recorded in ``failures`` instead of stopping the run.
+
+    A worker that dies (e.g. OOM-killed on one large episode) breaks the
+    whole pool: every task in flight on it is reported failed, like any
+    other failure, and the remaining tasks continue on a new pool, up to
+    ``max_pool_restarts`` times.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[Any], Any],
+        workers: int = 4,
+        max_inflight: Optional[int] = None,
+        ordered: bool = False,
+        max_pool_restarts: int = 3,
+    ):
+        self.fn = fn
+        self.workers = workers
+        self.max_inflight = max(max_inflight or 2 * workers, 1)
+        self.ordered = ordered
+        self.max_pool_restarts = max_pool_restarts
+        self.failures: List[Dict[str, str]] = []
+
+    def map(self, tasks: Iterable[Any]) -> Iterator[TaskItem]:
+        tasks = iter(tasks)
+        # Tasks taken from ``tasks`` but never submitted because the pool broke.
+        requeued: List[Any] = []
+
+        def next_task():
+            return requeued.pop() if requeued else next(tasks, _DONE)
+
+        restarts = 0
+        while True:
+            lost = yield from self._run_pool(next_task, requeued)
+            if lost is None:
+                return
+            restarts += 1
+            if restarts > self.max_pool_restarts:
+                raise RuntimeError(
+                    f"The episode process pool broke {restarts} times (a worker died, "
+                    "e.g. out of memory); stopping. Episodes lost with it are recorded "
+                    "as failed; rerun the ingest to resume from its manifest, perhaps "
+                    "with fewer workers or MAX_INFLIGHT_EPISODES."
+                )
+            logger.warning(
+                "Episode process pool broke, %s in-flight episodes failed; starting a new pool",
+                lost,
+            )
+
+    def _run_pool(self, next_task, requeued: List[Any]) -> Iterator[TaskItem]:
+        """Run tasks on one pool until they run out (returns None) or the pool
+        breaks (returns the number of in-flight tasks lost with it)."""
+        # Spawned, not forked: the parent already runs upload and producer threads.
+        with ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            inflight: Dict[Future, Any] = {}
+            order: List[Future] = []
+            exhausted = False
+            broken = False
+            lost = 0
+            while True:
+                while not broken and not exhausted and len(inflight) < self.max_inflight:
+                    task = next_task()
+                    if task is _DONE:
+                        exhausted = True
+                        break
+                    try:
+                        future = pool.submit(_run_task, self.fn, task)
+                    except BrokenProcessPool:
+                        requeued.append(task)
+                        broken = True
+                        break
+                    inflight[future] = task
+                    order.append(future)
+                if not inflight:
+                    return lost if broken else None
+
+                if broken:
+                    # The pool fails all its pending futures; collect them.
+                    ready = list(order)
+                    wait(ready)
+                elif self.ordered:
+                    ready = [order[0]]
+                    wait(ready)
+                else:
+                    ready, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                for future in ready:
+                    task = inflight.pop(future)
+                    order.remove(future)
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        broken = True
+                        lost += 1
+                    yield from self._items(future, task)
+
+    def _items(self, future: Future, task: Any) -> Iterator[TaskItem]:
+        try:
+            frames = future.result()
+        except BrokenProcessPool as exc:
+            # A worker died; the task may not be the one that killed it.
+            logger.error("Episode %r lost: a pool worker died", task)
+            self.failures.append({"task": repr(task), "error": repr(exc)})
+            yield task, exc
+            return
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Episode %r failed", task, exc_info=exc)
+            self.failures.append({"task": repr(task), "error": repr(exc)})
+            yield task, exc
+            return
+        for df in frames:
+            yield task, df
+        yield task, None
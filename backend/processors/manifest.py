@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Set
+
+
+class IngestManifest:
+    """Durable per-unit ingestion state, in a local SQLite file.
+
+    A unit is one source file (a Waymo episode, an Argoverse tar part),
+    identified by its ``source_link``. Units move from started to done once
+    all their frames are uploaded and written to Postgres, or to failed.
+    Anything not done on a rerun is partial: its rows are deleted and the
+    unit is processed again.
+    """
+
+    def __init__(self, path: str, dataset: str):
+        self.dataset = dataset
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS units (
+                dataset TEXT NOT NULL,
+                unit TEXT NOT NULL,
+                status TEXT NOT NULL,
+                rows INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (dataset, unit)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def _set(self, unit: str, status: str, rows: int = 0, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._conn.execute(
+                """
+                INSERT INTO units (dataset, unit, status, rows, error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (dataset, unit) DO UPDATE SET
+                    status = excluded.status,
+                    rows = excluded.rows,
+                    error = excluded.error,
+                    updated_at = excluded.updated_at
+                """,
+                (self.dataset, unit, status, rows, error, time.time()),
+            )
+            self._conn.commit()
+
+    def start(self, unit: str) -> None:
+        self._set(unit, "started")
+
+    def complete(self, unit: str, rows: int) -> None:
+        self._set(unit, "done", rows=rows)
+
+    def fail(self, unit: str, error: str) -> None:
+        self._set(unit, "failed", error=error)
+
+    def _units(self, done: bool) -> Set[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT unit FROM units WHERE dataset = ? AND (status = 'done') = ?",
+                (self.dataset, done),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def completed(self) -> Set[str]:
+        return self._units(done=True)
+
+    def unfinished(self) -> Set[str]:
+        """Units a previous run started but did not finish."""
+        return self._units(done=False)
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, count(*) FROM units WHERE dataset = ? GROUP BY status",
+                (self.dataset,),
+            ).fetchall()
+        return dict(rows)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
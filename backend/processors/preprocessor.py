@@ -1,5 +1,9 @@
 from abc import abstractmethod
+from collections import deque
+import queue
+import threading
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.client import Config
 from configs.common import (
     S3_ENDPOINT_URL,
@@ -12,14 +16,25 @@ from configs.common import (
     POSTGRES_PASSWORD,
     POSTGRES_SCHEMA,
     POSTGRES_TABLE,
+    DATA_DIR,
 )
 from backend.db.postgres import PostgresConfig, PostgresWriter
+from backend.processors.executor import EpisodeExecutor
+from backend.processors.manifest import IngestManifest
+from backend.processors.sampling import SamplingPolicy, sample_frames
+from backend.processors.uploader import S3Uploader
+from configs.hw_settings import INGEST_CONFIG
 from botocore.exceptions import ClientError
 from tqdm import tqdm
+import pandas as pd
+import logging
 import os
 
+logger = logging.getLogger("avsp.preprocessor")
+
 class Preprocessor:
     NOT_FOUND_EXCEPTION_CODE = 404
+    DATASET_NAME = None  # Key of this dataset's units in the ingestion manifest
 
     cameras = [
         "FRONT",
@@ -30,7 +45,12 @@ class Preprocessor:
         "BACK_RIGHT"
     ]
 
-    def __init__(self):
+    def __init__(self, save_local: bool = False, sampling: SamplingPolicy = None):
+        self.sampling = sampling or SamplingPolicy()
+        # Frames normally carry their JPEG bytes in memory (``image`` and
+        # ``image_name`` columns) and go straight to S3. With ``save_local``
+        # they are also written to ``image_path`` and kept there, for debugging.
+        self.save_local = save_local
         self.s3 = boto3.client(
             "s3",
             endpoint_url=S3_ENDPOINT_URL,
@@ -40,6 +60,8 @@ class Preprocessor:
             config=Config(
                 signature_version="s3v4",
                 s3={"addressing_style": "path"},
+                # One connection per upload thread, otherwise they queue on the pool.
+                max_pool_connections=INGEST_CONFIG.UPLOAD_WORKERS,
             ),
         )
 
@@ -60,6 +82,56 @@ class Preprocessor:
             Key=object_name
         )
 
+    def sample(self, timestamps, groups=None, ticks_per_second: float = 1e9):
+        """Indices of the frames ``self.sampling`` keeps, per (log, camera) group."""
+        return sample_frames(timestamps, self.sampling, groups, ticks_per_second)
+
+    # Clients that cannot be pickled into worker processes, and are not needed there.
+    _UNPICKLABLE = ("s3",)
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k not in self._UNPICKLABLE}
+
+    def tasks(self):
+        """Units of work (episodes, tar parts) for ``process_task``, in order."""
+        raise NotImplementedError("Dataset preprocessor must list its tasks to run in parallel")
+
+    def task_source(self, task) -> str:
+        """``source_link`` of the frames a task produces; the manifest's unit key."""
+        raise NotImplementedError("Dataset preprocessor must name the source of its tasks")
+
+    def process_task(self, task):
+        """Frames of one task: a DataFrame or an iterator of DataFrames."""
+        raise NotImplementedError("Dataset preprocessor must implement process_task")
+
+    def iter_episodes(self, tasks, workers: int = 1, ordered: bool = False):
+        """(task, item) pairs: each DataFrame of a task, then None when it is
+        complete, or the exception it failed with. ``workers`` > 1 runs the
+        tasks on a process pool."""
+        if workers <= 1:
+            for task in tasks:
+                try:
+                    result = self.process_task(task)
+                    for df in [result] if isinstance(result, pd.DataFrame) else result:
+                        yield task, df
+                except Exception as exc:  # noqa: BLE001
+                    logger.error("Episode %r failed", task, exc_info=exc)
+                    yield task, exc
+                    continue
+                yield task, None
+            return
+        executor = EpisodeExecutor(
+            self.process_task,
+            workers=workers,
+            max_inflight=INGEST_CONFIG.MAX_INFLIGHT_EPISODES,
+            ordered=ordered,
+        )
+        yield from executor.map(tasks)
+        if executor.failures:
+            logger.warning(
+                "%s of the episodes failed: %s", len(executor.failures), executor.failures
+            )
+
     @abstractmethod
     def __iter__(self):
         raise NotImplementedError("Dataset preprocessor must have __iter__")
@@ -73,6 +145,8 @@ class Preprocessor:
         bucket: str = "avsp",
         save_to_db: bool = True,
         db_table: str = None,
+        workers: int = None,
+        ordered: bool = False,
     ):
         self.ensure_bucket(bucket=bucket)
         writer = None
@@ -86,24 +160,152 @@ class Preprocessor:
                     password=POSTGRES_PASSWORD,
                     schema=POSTGRES_SCHEMA,
                     table=db_table or POSTGRES_TABLE,
-                )
+                ),
+                method=INGEST_CONFIG.DB_WRITE_METHOD,
+                flush_rows=INGEST_CONFIG.DB_FLUSH_ROWS,
+                chunk_rows=INGEST_CONFIG.DB_COPY_CHUNK_ROWS,
             )
-        try:
-            for episode_df in tqdm(self):
-                episode_df["storage_path"] = None
-
-                for idx, row in episode_df.iterrows():
-                    local_path = row["image_path"]
-                    name = os.path.basename(local_path)
-                    storage_path = os.path.join(bucket, name)
+        uploader = S3Uploader(
+            self.s3,
+            bucket,
+            max_workers=INGEST_CONFIG.UPLOAD_WORKERS,
+            max_inflight_bytes=INGEST_CONFIG.UPLOAD_MAX_INFLIGHT_MB * 1024 * 1024,
+            transfer_config=TransferConfig(
+                multipart_threshold=INGEST_CONFIG.UPLOAD_MULTIPART_THRESHOLD_MB * 1024 * 1024,
+                multipart_chunksize=INGEST_CONFIG.UPLOAD_MULTIPART_CHUNK_MB * 1024 * 1024,
+                use_threads=False,
+            ),
+        )
+        manifest = IngestManifest(
+            INGEST_CONFIG.MANIFEST_PATH or os.path.join(DATA_DIR, "ingest_manifest.sqlite"),
+            dataset=self.DATASET_NAME,
+        )
+        completed = manifest.completed()
+        # Rows of units a previous run did not finish are dropped and the
+        # units ingested again; uploads simply overwrite the same keys.
+        for unit in manifest.unfinished():
+            deleted = writer.delete_source(unit) if writer else 0
+            logger.info("Resuming %s: deleted %s partial rows", unit, deleted)
+        tasks = (task for task in self.tasks() if self.task_source(task) not in completed)
+        if completed:
+            logger.info("Skipping %s units already ingested", len(completed))
 
-                    episode_df.at[idx, "storage_path"] = storage_path
+        # Entries whose uploads may still be running: (unit, frames, futures),
+        # with frames None marking the end of a unit. Rows reach the DB only
+        # once every image they reference is in the bucket, and a unit is done
+        # once all its rows are loaded, not just buffered.
+        pending = deque()
+        unit_rows = {}
+        awaiting_flush = []
 
-                    self.upload_to_s3(local_path, bucket, name)
-                    os.remove(local_path)
+        def finish_uploaded(block: bool):
+            while pending and (block or all(f.done() for f in pending[0][2])):
+                unit, episode_df, futures = pending.popleft()
+                for future in futures:
+                    future.result()
+                if episode_df is None:
+                    awaiting_flush.append(unit)
+                elif writer:
+                    writer.write(episode_df)
+                if not writer or writer.buffered_rows == 0:
+                    for unit in awaiting_flush:
+                        manifest.complete(unit, unit_rows.pop(unit, 0))
+                    awaiting_flush.clear()
 
-                if writer:
-                    writer.insert_df(episode_df)
+        try:
+            episodes = self._prefetch(
+                self.iter_episodes(tasks, workers or INGEST_CONFIG.PROCESS_WORKERS, ordered),
+                INGEST_CONFIG.PREFETCH_EPISODES,
+            )
+            for task, item in tqdm(episodes):
+                unit = self.task_source(task)
+                if unit not in unit_rows:
+                    manifest.start(unit)
+                    unit_rows[unit] = 0
+                if isinstance(item, Exception):
+                    manifest.fail(unit, repr(item))
+                    unit_rows.pop(unit)
+                    continue
+                if item is None:
+                    pending.append((unit, None, []))
+                elif not item.empty:
+                    futures = self._submit_uploads(uploader, item, bucket)
+                    item = item.drop(columns=["image", "image_name"], errors="ignore")
+                    unit_rows[unit] += len(item)
+                    pending.append((unit, item, futures))
+                finish_uploaded(block=False)
+            finish_uploaded(block=True)
+            if writer:
+                writer.flush()
+            for unit in awaiting_flush:
+                manifest.complete(unit, unit_rows.pop(unit, 0))
+            logger.info("Ingestion manifest: %s", manifest.counts())
         finally:
+            uploader.close()
             if writer:
                 writer.close()
+            manifest.close()
+
+    def _submit_uploads(self, uploader: S3Uploader, episode_df, bucket: str):
+        """Upload an episode's images and fill in ``storage_path``.
+
+        Frames carry either an in-memory ``image`` buffer named by
+        ``image_name``, or only a local ``image_path``. Buffers are uploaded
+        directly; local files are uploaded and removed unless ``save_local``.
+        """
+        empty = pd.Series(None, index=episode_df.index, dtype=object)
+        images = episode_df.get("image", empty)
+        local_paths = episode_df.get("image_path", empty)
+        in_memory = images.notna()
+        on_disk = ~in_memory & local_paths.notna()
+
+        file_names = local_paths.astype("string").str.rsplit(os.sep, n=1).str[-1]
+        names = episode_df.get("image_name", file_names).astype("string").where(in_memory, file_names)
+        episode_df["storage_path"] = (bucket + "/" + names).astype(object).where(
+            in_memory | on_disk, None
+        )
+
+        futures = [
+            uploader.submit_buffer(buffer, name)
+            for buffer, name in zip(images[in_memory], names[in_memory])
+        ]
+        futures += [
+            uploader.submit(local_path, name, remove_after=not self.save_local)
+            for local_path, name in zip(local_paths[on_disk], file_names[on_disk])
+        ]
+        return futures
+
+    def _prefetch(self, episodes, depth: int):
+        """Iterate ``episodes`` on a producer thread, ``depth`` episodes ahead."""
+        buffer = queue.Queue(maxsize=max(depth, 1))
+        done = object()
+        stop = threading.Event()
+
+        def produce():
+            try:
+                for item in episodes:
+                    while not stop.is_set():
+                        try:
+                            buffer.put(item, timeout=0.5)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+            except BaseException as exc:  # noqa: BLE001
+                buffer.put(exc)
+                return
+            buffer.put(done)
+
+        producer = threading.Thread(target=produce, name="episode-producer", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass(frozen=True)
+class SamplingPolicy:
+    """Which frames of each (log, camera) group to keep.
+
+    Policies apply in order, each to the survivors of the previous one:
+    ``step_seconds`` keeps the first frame of every step-long time bucket,
+    ``keyframe_every`` keeps every n-th frame, and ``max_frames`` thins what
+    is left to at most that many frames spread evenly over the group.
+    """
+
+    step_seconds: Optional[float] = None
+    keyframe_every: Optional[int] = None
+    max_frames: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(self.step_seconds or self.keyframe_every or self.max_frames)
+
+
+def step_bucket(timestamps, step_seconds: float, ticks_per_second: float):
+    """Time bucket of each timestamp; works on scalars and arrays alike."""
+    return timestamps // int(step_seconds * ticks_per_second)
+
+
+def sample_frames(
+    timestamps,
+    policy: SamplingPolicy,
+    groups=None,
+    ticks_per_second: float = 1e9,
+) -> np.ndarray:
+    """Sorted indices of the frames to keep.
+
+    ``timestamps`` are integers in ``ticks_per_second`` units (1e9 for
+    nanoseconds, 1e6 for microseconds). ``groups`` labels each frame with its
+    log and/or camera (strings, ints, or a DataFrame of several key columns);
+    frames of different groups never affect each other. Input order does
+    not matter.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if groups is None:
+        codes = np.zeros(timestamps.size, dtype=np.int64)
+    elif isinstance(groups, pd.DataFrame):
+        codes = groups.groupby(list(groups.columns), sort=False, dropna=False).ngroup().to_numpy()
+    else:
+        codes, _ = pd.factorize(np.asarray(groups))
+
+    keep = np.lexsort((timestamps, codes))
+    if not policy.active or keep.size == 0:
+        return np.sort(keep)
+
+    if policy.step_seconds:
+        buckets = step_bucket(timestamps[keep], policy.step_seconds, ticks_per_second)
+        keep = keep[_first_of_runs(codes[keep], buckets)]
+    if policy.keyframe_every and policy.keyframe_every > 1:
+        rank, _ = _group_ranks(codes[keep])
+        keep = keep[rank % policy.keyframe_every == 0]
+    if policy.max_frames:
+        rank, size = _group_ranks(codes[keep])
+        # Rank r survives where floor(r * m / n) steps up: exactly m evenly
+        # spaced frames per group of n > m, all frames otherwise.
+        slot = rank * policy.max_frames // size
+        previous = (rank - 1) * policy.max_frames // size
+        keep = keep[(rank == 0) | (slot != previous)]
+    return np.sort(keep)
+
+
+def _first_of_runs(*keys: np.ndarray) -> np.ndarray:
+    """Mask of elements that start a new run of equal keys, for sorted keys."""
+    first = np.ones(keys[0].size, dtype=bool)
+    if keys[0].size > 1:
+        changed = np.zeros(keys[0].size - 1, dtype=bool)
+        for key in keys:
+            changed |= key[1:] != key[:-1]
+        first[1:] = changed
+    return first
+
+
+def _group_ranks(codes: np.ndarray):
+    """Position of each element within its group, and the group size, for sorted codes."""
+    starts = np.flatnonzero(_first_of_runs(codes))
+    sizes = np.diff(np.append(starts, codes.size))
+    group = np.repeat(np.arange(starts.size), sizes)
+    rank = np.arange(codes.size) - starts[group]
+    return rank, sizes[group]
@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import io
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional, Union
+
+from boto3.s3.transfer import TransferConfig
+
+
+class _BufferReader(io.RawIOBase):
+    """Seekable read-only file over a memoryview, so uploads never copy the buffer."""
+
+    def __init__(self, buffer: Union[bytes, bytearray, memoryview]):
+        self._view = memoryview(buffer).cast("B")
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, target) -> int:
+        count = min(len(target), len(self._view) - self._pos)
+        target[:count] = self._view[self._pos : self._pos + count]
+        self._pos += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class S3Uploader:
+    """Bounded thread pool of S3 uploads.
+
+    ``submit`` blocks while ``max_inflight_bytes`` worth of files are queued
+    or uploading, so a fast producer cannot fill the disk or memory ahead of
+    a slow object store. Each object is uploaded by one pool thread;
+    ``transfer_config`` only matters for objects past its multipart threshold.
+    In-memory buffers below that threshold go out in a single ``put_object``.
+    """
+
+    def __init__(
+        self,
+        s3,
+        bucket: str,
+        max_workers: int = 16,
+        max_inflight_bytes: int = 256 * 1024 * 1024,
+        transfer_config: Optional[TransferConfig] = None,
+    ):
+        self.s3 = s3
+        self.bucket = bucket
+        self.max_inflight_bytes = max_inflight_bytes
+        self.transfer_config = transfer_config or TransferConfig(use_threads=False)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="s3-upload"
+        )
+        self._inflight_bytes = 0
+        self._inflight = threading.Condition()
+
+    def submit(self, local_path: str, key: str, remove_after: bool = True) -> Future:
+        size = os.path.getsize(local_path)
+        return self._submit(size, self._upload, local_path, key, size, remove_after)
+
+    def submit_buffer(self, buffer: Union[bytes, bytearray, memoryview], key: str) -> Future:
+        size = memoryview(buffer).nbytes
+        return self._submit(size, self._upload_buffer, buffer, key, size)
+
+    def _submit(self, size: int, fn, *args) -> Future:
+        with self._inflight:
+            # A single object larger than the limit still goes through, alone.
+            self._inflight.wait_for(
+                lambda: self._inflight_bytes == 0
+                or self._inflight_bytes + size <= self.max_inflight_bytes
+            )
+            self._inflight_bytes += size
+        try:
+            return self._executor.submit(fn, *args)
+        except BaseException:
+            self._release(size)
+            raise
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    def _upload(self, local_path: str, key: str, size: int, remove_after: bool) -> str:
+        try:
+            self.s3.upload_file(
+                Filename=str(local_path),
+                Bucket=self.bucket,
+                Key=key,
+                Config=self.transfer_config,
+            )
+            if remove_after:
+                os.remove(local_path)
+            return key
+        finally:
+            self._release(size)
+
+    def _upload_buffer(self, buffer, key: str, size: int) -> str:
+        try:
+            body = _BufferReader(buffer)
+            if size < self.transfer_config.multipart_threshold:
+                self.s3.put_object(Bucket=self.bucket, Key=key, Body=body, ContentLength=size)
+            else:
+                self.s3.upload_fileobj(body, self.bucket, key, Config=self.transfer_config)
+            return key
+        finally:
+            self._release(size)
+
+    def _release(self, size: int) -> None:
+        with self._inflight:
+            self._inflight_bytes -= size
+            self._inflight.notify_all()
@@ -1,13 +1,18 @@
 from .preprocessor import Preprocessor
+from .sampling import SamplingPolicy
 from google.cloud import storage
 from typing import List, Optional
 from pathlib import Path
 import subprocess
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import shutil
 import os
 
 from configs.common import WAYMO_DIR, DATA_DIR
+from configs.hw_settings import INGEST_CONFIG
 
 BUCKET_NAME = "waymo_open_dataset_v_2_0_1"
 PREFIX = "training/camera_image"
@@ -18,7 +23,27 @@ GOOGLE_CLOUD_GSUTIL_PATH = shutil.which("gsutil")
 DATA_FOLDER = Path(DATA_DIR) / WAYMO_DIR
 
 
+def _binary_views(column: pa.ChunkedArray) -> List[Optional[memoryview]]:
+    """Zero-copy views of every value of a binary column, None for nulls."""
+    views: List[Optional[memoryview]] = []
+    for chunk in column.chunks:
+        _, offsets_buf, data_buf = chunk.buffers()
+        offset_type = np.int64 if pa.types.is_large_binary(chunk.type) else np.int32
+        offsets = np.frombuffer(offsets_buf, dtype=offset_type)[
+            chunk.offset : chunk.offset + len(chunk) + 1
+        ]
+        data = memoryview(data_buf) if data_buf is not None else memoryview(b"")
+        nulls = chunk.is_null().to_numpy(zero_copy_only=False)
+        views.extend(
+            None if is_null else data[start:stop]
+            for start, stop, is_null in zip(offsets[:-1], offsets[1:], nulls)
+        )
+    return views
+
+
 class WaymoPreprocessor(Preprocessor):
+    DATASET_NAME = "waymo"
+
     CAMERA_TO_LABEL = {
         "FRONT": 1,
         "FRONT_LEFT": 2,
@@ -39,15 +64,19 @@ class WaymoPreprocessor(Preprocessor):
     def __init__(self,
                  cameras: Optional[List[str]] = ["FRONT"],
                  resample_seconds: Optional[float] = 0.5,
-                 exist_skip: bool = False
+                 exist_skip: bool = False,
+                 save_local: bool = False,
+                 sampling: Optional[SamplingPolicy] = None
                 ):
-        super().__init__()
+        # An explicit policy (keyframes, max frames per log) overrides resample_seconds.
+        super().__init__(
+            save_local=save_local,
+            sampling=sampling or SamplingPolicy(step_seconds=resample_seconds),
+        )
         self.client = storage.Client(project=PROJECT_NAME)
         self.bucket = self.client.bucket(BUCKET_NAME, user_project=PROJECT_NAME)
-        self.blobs = self.bucket.list_blobs(prefix=PREFIX)
-        self.episodes = [
-            blob.name for blob in self.blobs if blob.name.endswith(".parquet")
-        ]
+        # Listed lazily, page by page, so work starts before the listing ends.
+        self.episodes = self._list_episodes()
         self.exist_skip = exist_skip
 
         if cameras:
@@ -56,13 +85,19 @@ class WaymoPreprocessor(Preprocessor):
             ])
         else:
             self.cameras = None
-        self.resample_seconds = resample_seconds
 
         os.makedirs(DATA_FOLDER, exist_ok=True)
 
         # for iterable
         self.iteration = 0
 
+    def _list_episodes(self):
+        blobs = self.bucket.list_blobs(prefix=PREFIX, page_size=INGEST_CONFIG.GCS_LIST_PAGE_SIZE)
+        for page in blobs.pages:
+            for blob in page:
+                if blob.name.endswith(".parquet"):
+                    yield blob.name
+
     def download_blob(self, name: str, dst_path: str):
         if not os.path.exists(dst_path) or not self.exist_skip:
             cmd = [
@@ -86,29 +121,58 @@ class WaymoPreprocessor(Preprocessor):
         #             os.remove(dst_path)
         #         raise
 
-    def process_parquet(self, path: str) -> pd.DataFrame:
-        df = pd.read_parquet(path)
+    TIMESTAMP_COLUMN = "key.frame_timestamp_micros"
+    CAMERA_COLUMN = "key.camera_name"
+    IMAGE_COLUMN = "[CameraImageComponent].image"
 
+    def select_rows(self, keys: pd.DataFrame) -> np.ndarray:
+        """File row numbers to keep, from the timestamp and camera columns only.
+
+        A Waymo file holds one segment, so sampling groups are its cameras.
+        """
+        rows = np.arange(len(keys))
         if self.cameras:
-            df = df[df["key.camera_name"].isin(self.cameras)]
-            df["key.camera_name"] = df["key.camera_name"].map(self.REVERSE_CAMERA_TO_LABEL)
-
-        if self.resample_seconds:
-            df["ts"] = pd.to_datetime(df["key.frame_timestamp_micros"], unit="us", utc=True)
-            df = df.sort_values("ts")
-
-            df = (
-                df
-                .set_index("ts")
-                .resample(f"{self.resample_seconds}s")
-                .first()
-                .reset_index()
-                .dropna(subset=["ts"])
-            )
+            rows = rows[keys[self.CAMERA_COLUMN].isin(self.cameras).to_numpy()]
+        keep = self.sample(
+            keys[self.TIMESTAMP_COLUMN].to_numpy()[rows],
+            keys[self.CAMERA_COLUMN].to_numpy()[rows],
+            ticks_per_second=1e6,
+        )
+        return rows[keep]
+
+    def process_parquet(self, path: str) -> pd.DataFrame:
+        parquet = pq.ParquetFile(path)
+        key_columns = [self.TIMESTAMP_COLUMN, self.CAMERA_COLUMN]
+        # Image blobs are the bulk of the file: pick rows from the key columns
+        # first, then read images one row group at a time for those rows only.
+        keys = parquet.read(columns=key_columns).to_pandas()
+        rows = self.select_rows(keys)
+
+        offsets = np.cumsum(
+            [0] + [parquet.metadata.row_group(i).num_rows for i in range(parquet.num_row_groups)]
+        )
+        parts = []
+        for group in range(parquet.num_row_groups):
+            start, stop = np.searchsorted(rows, offsets[group : group + 2])
+            if start == stop:
+                continue
+            table = parquet.read_row_group(group, columns=key_columns + [self.IMAGE_COLUMN])
+            table = table.take(pa.array(rows[start:stop] - offsets[group]))
+            part = table.select(key_columns).to_pandas()
+            part[self.IMAGE_COLUMN] = _binary_views(table.column(self.IMAGE_COLUMN))
+            parts.append(part)
+
+        columns = list(self.COLUMNS_TO_SAVE.keys())
+        df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=columns)
+        df = df.sort_values(self.TIMESTAMP_COLUMN, kind="stable")
+        if self.cameras:
+            df[self.CAMERA_COLUMN] = df[self.CAMERA_COLUMN].map(self.REVERSE_CAMERA_TO_LABEL)
 
         episode_name = os.path.basename(path)
-        df = df[self.COLUMNS_TO_SAVE.keys()].rename(columns=self.COLUMNS_TO_SAVE)
+        df = df[columns].rename(columns=self.COLUMNS_TO_SAVE)
         df = self._save_images_and_replace_column(df, episode_name)
+        df["source_link"] = os.path.join(REMOTE_PATH, episode_name)
+        df["dataset_type"] = self.DATASET_NAME
         return df
 
     def _save_images_and_replace_column(
@@ -116,39 +180,31 @@ class WaymoPreprocessor(Preprocessor):
         df: pd.DataFrame,
         episode_name: str,
     ) -> pd.DataFrame:
-        episode_id = Path(episode_name).stem
-
-        image_paths: List[str] = []
-
-        for row in df.itertuples(index=False):
-            ts = getattr(row, "timestamp")
-            cam = getattr(row, "camera_name")
-            img = getattr(row, "image")
-
-            ts_str = str(int(ts))
+        """Name the in-memory images; write them to ``DATA_FOLDER`` only with ``save_local``."""
+        df["image_name"] = (
+            df["camera_name"].astype(str) + "_" + df["timestamp"].astype("int64").astype(str) + ".jpg"
+        )
+        if not self.save_local:
+            return df
+
+        image_paths: List[Optional[str]] = []
+        for name, img in zip(df["image_name"], df["image"]):
+            if img is None:
+                image_paths.append(None)
+                continue
 
-            file_path = DATA_FOLDER / f"{cam}_{ts_str}.jpg"
+            file_path = DATA_FOLDER / name
             if file_path.exists():
                 i = 1
-                while (DATA_FOLDER / f"{ts_str}_{i}.jpg").exists():
+                while (DATA_FOLDER / f"{file_path.stem}_{i}.jpg").exists():
                     i += 1
-                file_path = DATA_FOLDER / f"{ts_str}_{i}.jpg"
-
-            if img is None or (hasattr(pd, "isna") and pd.isna(img)):
-                image_paths.append(None)
-                continue
-
-            if isinstance(img, memoryview):
-                img_bytes = img.tobytes()
-            else:
-                img_bytes = img if isinstance(img, (bytes, bytearray)) else bytes(img)
+                file_path = DATA_FOLDER / f"{file_path.stem}_{i}.jpg"
 
             with open(file_path, "wb") as f:
-                f.write(img_bytes)
+                f.write(img)
 
             image_paths.append(str(file_path))
 
-        df = df.drop(columns=["image"])
         df["image_path"] = image_paths
         return df
 
@@ -161,20 +217,25 @@ class WaymoPreprocessor(Preprocessor):
 
         return result_df
 
+    _UNPICKLABLE = Preprocessor._UNPICKLABLE + ("client", "bucket", "episodes")
+
+    def tasks(self):
+        return self.episodes
+
+    def task_source(self, task) -> str:
+        return os.path.join(REMOTE_PATH, os.path.basename(task))
+
+    def process_task(self, task):
+        return self.process_sample(task)
+
     def __iter__(self):
         return self
 
     def __next__(self):
-        if self.iteration >= len(self.episodes):
-            raise StopIteration
-
-        blob_name = self.episodes[self.iteration]
+        blob_name = next(self.episodes)
         self.iteration += 1
         return self.process_sample(blob_name)
 
-    def __len__(self):
-        return len(self.episodes)
-
 
 if __name__ == "__main__":
     processor = WaymoPreprocessor(resample_seconds=0.5)
@@ -0,0 +1,184 @@
+"""Recall@k, latency and memory of the ANN indexes against exact search.
+
+Run inside the server container, e.g.::
+
+    python -m backend.search.benchmark --source synthetic --rows 200000
+    python -m backend.search.benchmark --source db --nprobe 1 4 16 64
+    python -m backend.search.benchmark --pq-subspaces 16 32 64 --pq-candidates 64 256 1024
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from backend.search.exact import ExactSearchIndex, normalize_rows
+from backend.search.ivf import IVFFlatIndex
+from backend.search.pq import PQIndex, rerank
+
+
+def synthetic_corpus(rows: int, dim: int, clusters: int, seed: int) -> np.ndarray:
+    """Gaussian blobs: unlike uniform noise they have the structure real embeddings have."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    noise = rng.normal(scale=0.5, size=(rows, dim)).astype(np.float32)
+    return normalize_rows(centers[labels] + noise)
+
+
+def db_corpus(limit: int) -> Tuple[List[str], np.ndarray]:
+    import psycopg2
+    from psycopg2 import sql
+
+    from backend.db import embedding_storage
+    from configs.common import (
+        EMBEDDINGS_SCHEMA,
+        EMBEDDINGS_TABLE,
+        POSTGRES_DB,
+        POSTGRES_HOST,
+        POSTGRES_PASSWORD,
+        POSTGRES_PORT,
+        POSTGRES_USER,
+    )
+
+    conn = psycopg2.connect(
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+    )
+    query = sql.SQL("SELECT storage_path, embedding FROM {}.{} LIMIT %s").format(
+        sql.Identifier(EMBEDDINGS_SCHEMA),
+        sql.Identifier(EMBEDDINGS_TABLE),
+    )
+    try:
+        storage_format = embedding_storage.detect_format(conn, EMBEDDINGS_SCHEMA, EMBEDDINGS_TABLE)
+        with conn.cursor(name="avsp_benchmark_load") as cur:
+            cur.itersize = 10000
+            cur.execute(query, (limit,))
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    paths = [row[0] for row in rows]
+    vectors = embedding_storage.decode_many([row[1] for row in rows], storage_format)
+    return paths, normalize_rows(vectors)
+
+
+def make_queries(corpus: np.ndarray, count: int, seed: int) -> np.ndarray:
+    """Perturbed corpus rows stand in for text queries, which need the embedder."""
+    rng = np.random.default_rng(seed + 1)
+    picked = corpus[rng.choice(corpus.shape[0], count, replace=False)]
+    return normalize_rows(picked + rng.normal(scale=0.05, size=picked.shape))
+
+
+def _timed_search(index, queries: np.ndarray, top_k: int, **kwargs):
+    results = []
+    latencies = []
+    for query in queries:
+        started = time.perf_counter()
+        hits = index.search(query, top_k, **kwargs)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append({path for path, _ in hits})
+    return results, np.asarray(latencies)
+
+
+def run(args: argparse.Namespace) -> None:
+    if args.source == "db":
+        paths, corpus = db_corpus(args.rows)
+    else:
+        corpus = synthetic_corpus(args.rows, args.dim, args.clusters, args.seed)
+        paths = [str(i) for i in range(corpus.shape[0])]
+    queries = make_queries(corpus, args.queries, args.seed)
+    print(f"corpus={corpus.shape[0]}x{corpus.shape[1]} queries={len(queries)} k={args.top_k}")
+
+    exact = ExactSearchIndex()
+    exact.upsert(paths, corpus)
+    truth, exact_ms = _timed_search(exact, queries, args.top_k)
+
+    started = time.perf_counter()
+    ann = IVFFlatIndex.build(paths, corpus, nlist=args.nlist, train_sample=args.train_sample)
+    print(f"ivf_flat build: nlist={ann.nlist} elapsed={time.perf_counter() - started:.1f}s")
+
+    print(f"{'nprobe':>8} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8} {'speedup':>8}")
+    print(
+        f"{'exact':>8} {1.0:>9.3f} {np.percentile(exact_ms, 50):>8.2f} "
+        f"{np.percentile(exact_ms, 95):>8.2f} {1.0:>8.1f}"
+    )
+    for nprobe in args.nprobe:
+        found, ann_ms = _timed_search(ann, queries, args.top_k, nprobe=nprobe)
+        recall = np.mean([len(f & t) / max(len(t), 1) for f, t in zip(found, truth)])
+        speedup = np.percentile(exact_ms, 50) / max(np.percentile(ann_ms, 50), 1e-9)
+        print(
+            f"{nprobe:>8} {recall:>9.3f} {np.percentile(ann_ms, 50):>8.2f} "
+            f"{np.percentile(ann_ms, 95):>8.2f} {speedup:>8.1f}"
+        )
+
+    if args.pq_subspaces:
+        run_pq(args, paths, corpus, queries, truth)
+
+
+def run_pq(args, paths: List[str], corpus: np.ndarray, queries: np.ndarray, truth) -> None:
+    """Memory against recall of the PQ index, after exact re-ranking.
+
+    The corpus matrix stands in for the Postgres rows re-ranking fetches.
+    """
+    by_path = dict(zip(paths, corpus))
+    float_mb = corpus.nbytes / 2**20
+    print(f"\nfloat32 vectors: {float_mb:.1f} MB ({corpus.shape[1] * 4} B/vector)")
+    print(
+        f"{'subsp':>6} {'cand':>6} {'B/vec':>6} {'codes MB':>9} {'ratio':>6} "
+        f"{'adc@k':>7} {'recall@k':>9} {'p50 ms':>8} {'p95 ms':>8}"
+    )
+    for subspaces in args.pq_subspaces:
+        started = time.perf_counter()
+        index = PQIndex.build(paths, corpus, subspaces=subspaces, train_sample=args.train_sample)
+        build_sec = time.perf_counter() - started
+        codes_mb = len(index) * index.bytes_per_vector / 2**20
+        for candidates in args.pq_candidates:
+            index.candidates = candidates
+            adc_recall = []
+            recall = []
+            latencies = []
+            for query, expected in zip(queries, truth):
+                started = time.perf_counter()
+                shortlist = index.search_many(query, args.top_k)
+                hits = rerank(
+                    query,
+                    shortlist,
+                    {path: by_path[path] for path, _ in shortlist[0]},
+                    args.top_k,
+                )[0]
+                latencies.append((time.perf_counter() - started) * 1000)
+                adc = {path for path, _ in shortlist[0][:args.top_k]}
+                adc_recall.append(len(adc & expected) / max(len(expected), 1))
+                recall.append(len({path for path, _ in hits} & expected) / max(len(expected), 1))
+            print(
+                f"{subspaces:>6} {candidates:>6} {index.bytes_per_vector:>6} {codes_mb:>9.1f} "
+                f"{float_mb / codes_mb:>6.0f} {np.mean(adc_recall):>7.3f} {np.mean(recall):>9.3f} "
+                f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f}"
+            )
+        print(f"{'':>6} build: {build_sec:.1f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--source", choices=["synthetic", "db"], default="synthetic")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--dim", type=int, default=640)
+    parser.add_argument("--clusters", type=int, default=1000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--train-sample", type=int, default=100000)
+    parser.add_argument("--pq-subspaces", type=int, nargs="*", default=[])
+    parser.add_argument("--pq-candidates", type=int, nargs="+", default=[64, 256, 1024])
+    parser.add_argument("--seed", type=int, default=0)
+    run(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+from __future__ import annotations
+
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.search.filters import MetadataIndex
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0.0] = 1.0
+    return vectors / norms
+
+
+def dedupe_paths(paths: Sequence[str], vectors: np.ndarray):
+    """Keep the last vector for paths that repeat within one batch."""
+    last = {path: i for i, path in enumerate(paths)}
+    if len(last) == len(paths):
+        return paths, vectors
+    keep = sorted(last.values())
+    return [paths[i] for i in keep], vectors[keep]
+
+
+def top_k_indices(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Indices of the ``top_k`` highest scores, best first."""
+    n = scores.shape[0]
+    k = min(top_k, n)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def top_k_rows(scores: np.ndarray, top_k: int) -> np.ndarray:
+    """Column indices of the ``top_k`` highest scores of every row, best first."""
+    n = scores.shape[1]
+    k = min(top_k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(n), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+class ExactSearchIndex:
+    """In-memory brute-force cosine index over pre-normalized float32 rows.
+
+    Rows live in one contiguous matrix that grows by doubling, so a query is a
+    single matrix-vector product over the whole corpus.
+    """
+
+    def __init__(self, initial_capacity: int = 1024):
+        self._lock = threading.RLock()
+        self._initial_capacity = initial_capacity
+        self._matrix: Optional[np.ndarray] = None
+        self._paths: List[str] = []
+        self._row_by_path: Dict[str, int] = {}
+        self.loaded = False
+        self.watermark = None
+        # Paths loaded inside the refresh overlap window, by updated_at.
+        self.recent_rows: Dict[str, datetime] = {}
+        self.metadata = MetadataIndex()
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    @property
+    def dim(self) -> Optional[int]:
+        if self._matrix is None:
+            return None
+        return self._matrix.shape[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._matrix = None
+            self._paths = []
+            self._row_by_path = {}
+            self.loaded = False
+            self.watermark = None
+            self.recent_rows = {}
+            self.metadata = MetadataIndex()
+
+    def ids_of(self, paths: Sequence[str]) -> np.ndarray:
+        """Row ids of ``paths``, -1 for paths not in the index."""
+        with self._lock:
+            return np.array([self._row_by_path.get(path, -1) for path in paths], dtype=np.int64)
+
+    def upsert(self, paths: Sequence[str], embeddings) -> int:
+        if not len(paths):
+            return 0
+        vectors = normalize_rows(embeddings)
+        paths, vectors = dedupe_paths(paths, vectors)
+        if vectors.shape[0] != len(paths):
+            raise ValueError("Number of paths and embeddings do not match")
+
+        with self._lock:
+            if self._matrix is None:
+                capacity = max(self._initial_capacity, len(paths))
+                self._matrix = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            elif vectors.shape[1] != self._matrix.shape[1]:
+                raise ValueError("Embedding dimensions do not match")
+
+            new_rows = []
+            for i, path in enumerate(paths):
+                row = self._row_by_path.get(path)
+                if row is None:
+                    new_rows.append(i)
+                else:
+                    self._matrix[row] = vectors[i]
+
+            if new_rows:
+                start = len(self._paths)
+                self._reserve(start + len(new_rows))
+                self._matrix[start:start + len(new_rows)] = vectors[new_rows]
+                for offset, i in enumerate(new_rows):
+                    self._paths.append(paths[i])
+                    self._row_by_path[paths[i]] = start + offset
+            return len(paths)
+
+    def _reserve(self, size: int) -> None:
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.empty((capacity, self._matrix.shape[1]), dtype=np.float32)
+        grown[:len(self._paths)] = self._matrix[:len(self._paths)]
+        # Readers keep a reference to the old buffer, so it is never mutated
+        # after being replaced.
+        self._matrix = grown
+
+    def snapshot(self) -> Tuple[Optional[np.ndarray], List[str]]:
+        with self._lock:
+            size = len(self._paths)
+            if self._matrix is None or size == 0:
+                return None, []
+            return self._matrix[:size], self._paths
+
+    def search(
+        self,
+        query,
+        top_k: int,
+        rows: Optional[np.ndarray] = None,
+        prefilter: bool = False,
+    ) -> List[Tuple[str, float]]:
+        """Best ``top_k`` rows, restricted to the sorted row ids ``rows`` if given.
+
+        With ``prefilter`` only those rows are gathered and scored; otherwise
+        the whole matrix is scored and the scores of ``rows`` picked after.
+        """
+        matrix, paths = self.snapshot()
+        if matrix is None:
+            return []
+        query_vec = normalize_rows(query)[0]
+        if query_vec.shape[0] != matrix.shape[1]:
+            raise ValueError("Embedding dimensions do not match")
+
+        if rows is None:
+            scores = matrix @ query_vec
+            best = top_k_indices(scores, top_k)
+            return [(paths[i], float(scores[i])) for i in best]
+
+        rows = rows[rows < matrix.shape[0]]
+        if prefilter:
+            scores = matrix[rows] @ query_vec
+        else:
+            scores = (matrix @ query_vec)[rows]
+        best = top_k_indices(scores, top_k)
+        return [(paths[rows[i]], float(scores[i])) for i in best]
+
+    def search_many(
+        self,
+        queries,
+        top_k: int,
+        rows: Optional[np.ndarray] = None,
+        prefilter: bool = False,
+        max_scores: int = 1 << 24,
+    ) -> List[List[Tuple[str, float]]]:
+        """``search`` for many queries at once, as matrix-matrix products.
+
+        Queries are scored in chunks of at most ``max_scores`` scores, which
+        bounds the memory of the (queries x rows) score block.
+        """
+        matrix, paths = self.snapshot()
+        query_vecs = normalize_rows(queries)
+        if matrix is None:
+            return [[] for _ in range(query_vecs.shape[0])]
+        if query_vecs.shape[1] != matrix.shape[1]:
+            raise ValueError("Embedding dimensions do not match")
+
+        candidates = matrix
+        if rows is not None:
+            rows = rows[rows < matrix.shape[0]]
+            if prefilter:
+                candidates = matrix[rows]  # gathered once, shared by every query
+        chunk = max(1, max_scores // max(candidates.shape[0], 1))
+        results = []
+        for start in range(0, query_vecs.shape[0], chunk):
+            scores = query_vecs[start:start + chunk] @ candidates.T
+            if rows is not None and not prefilter:
+                scores = scores[:, rows]
+            best = top_k_rows(scores, top_k)
+            ids = best if rows is None else rows[best]
+            picked = np.take_along_axis(scores, best, axis=1)
+            for row_ids, row_scores in zip(ids, picked):
+                results.append(
+                    [(paths[i], float(score)) for i, score in zip(row_ids, row_scores)]
+                )
+        return results
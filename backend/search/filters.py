@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+CATEGORICAL_ATTRIBUTES = ("dataset_type", "camera_name")
+_MISSING_CODE = -1
+_MISSING_TIMESTAMP = np.iinfo(np.int64).min
+
+# A gathered row (random access into the corpus) costs about this many rows
+# of a contiguous scan; see prefer_prefilter.
+GATHER_COST = 2.0
+
+
+@dataclass(frozen=True)
+class SearchFilter:
+    """Metadata restriction of a search; empty tuples and None match anything.
+
+    Values of one attribute are OR-ed, attributes are AND-ed. Timestamps are
+    compared as stored in the frames table, in the dataset's own unit
+    (nanoseconds for Argoverse, microseconds for Waymo), bounds inclusive.
+    """
+
+    dataset_type: Tuple[str, ...] = ()
+    camera_name: Tuple[str, ...] = ()
+    timestamp_from: Optional[int] = None
+    timestamp_to: Optional[int] = None
+
+    @property
+    def active(self) -> bool:
+        return bool(
+            self.dataset_type
+            or self.camera_name
+            or self.timestamp_from is not None
+            or self.timestamp_to is not None
+        )
+
+
+def prefer_prefilter(matched: int, total: int, scanned_fraction: float = 1.0) -> bool:
+    """Whether scoring only the matching rows beats filtering a normal scan.
+
+    Post-filtering scans ``scanned_fraction`` of the corpus (1.0 for an exact
+    scan, nprobe / nlist for IVF), widened by 1 / selectivity so enough
+    matches survive to fill top-k. Pre-filtering gathers the matching rows
+    one by one. Pick whichever touches less memory.
+    """
+    if total == 0 or matched == 0:
+        return True
+    selectivity = matched / total
+    post_cost = total * min(1.0, scanned_fraction / selectivity)
+    return matched * GATHER_COST <= post_cost
+
+
+def _intersect_sorted(small: np.ndarray, large: np.ndarray) -> np.ndarray:
+    """Elements of ``small`` also in ``large``; both sorted and unique."""
+    if small.size == 0 or large.size == 0:
+        return small[:0]
+    positions = np.searchsorted(large, small)
+    positions[positions == large.size] = 0
+    return small[large[positions] == small]
+
+
+class MetadataIndex:
+    """Frame metadata per search-index row id, with posting lists for filtering.
+
+    Each categorical attribute keeps a code per row; its posting lists (the
+    sorted row ids of every value) are rebuilt lazily after updates, in one
+    argsort. Timestamps keep a sorted order, so a time window is two binary
+    searches. ``select`` intersects the posting lists smallest first and
+    returns the sorted ids of the matching rows, without touching vectors.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._size = 0
+        self._codes: Dict[str, np.ndarray] = {
+            attribute: np.empty(0, dtype=np.int32) for attribute in CATEGORICAL_ATTRIBUTES
+        }
+        self._vocab: Dict[str, Dict[str, int]] = {
+            attribute: {} for attribute in CATEGORICAL_ATTRIBUTES
+        }
+        self._timestamps = np.empty(0, dtype=np.int64)
+        self._postings: Dict[str, Dict[int, np.ndarray]] = {}
+        self._time_order: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return self._size
+
+    def update(
+        self,
+        ids: np.ndarray,
+        dataset_types: Sequence[Optional[str]],
+        camera_names: Sequence[Optional[str]],
+        timestamps: Sequence[Optional[int]],
+    ) -> None:
+        ids = np.asarray(ids, dtype=np.int64)
+        known = ids >= 0
+        if not known.any():
+            return
+        ids = ids[known]
+        columns = {"dataset_type": dataset_types, "camera_name": camera_names}
+        with self._lock:
+            self._reserve(int(ids.max()) + 1)
+            for attribute, values in columns.items():
+                vocab = self._vocab[attribute]
+                codes = [
+                    _MISSING_CODE if value is None else vocab.setdefault(value, len(vocab))
+                    for value, keep in zip(values, known)
+                    if keep
+                ]
+                self._codes[attribute][ids] = codes
+            self._timestamps[ids] = [
+                _MISSING_TIMESTAMP if value is None else int(value)
+                for value, keep in zip(timestamps, known)
+                if keep
+            ]
+            self._postings = {}
+            self._time_order = None
+
+    def _reserve(self, size: int) -> None:
+        if size <= self._size:
+            return
+        capacity = self._timestamps.shape[0]
+        if size > capacity:
+            capacity = max(size, 2 * capacity, 1024)
+            for attribute, codes in self._codes.items():
+                grown = np.full(capacity, _MISSING_CODE, dtype=np.int32)
+                grown[: self._size] = codes[: self._size]
+                self._codes[attribute] = grown
+            grown = np.full(capacity, _MISSING_TIMESTAMP, dtype=np.int64)
+            grown[: self._size] = self._timestamps[: self._size]
+            self._timestamps = grown
+        self._size = size
+
+    def _posting_lists(self, attribute: str) -> Dict[int, np.ndarray]:
+        postings = self._postings.get(attribute)
+        if postings is None:
+            codes = self._codes[attribute][: self._size]
+            order = np.argsort(codes, kind="stable")  # ids ascending within a code
+            boundaries = np.flatnonzero(np.diff(codes[order])) + 1
+            postings = {
+                int(codes[run[0]]): run
+                for run in np.split(order, boundaries)
+                if run.size and codes[run[0]] != _MISSING_CODE
+            }
+            self._postings[attribute] = postings
+        return postings
+
+    def _time_range(self, start: Optional[int], stop: Optional[int]) -> np.ndarray:
+        if self._time_order is None:
+            timestamps = self._timestamps[: self._size]
+            present = np.flatnonzero(timestamps != _MISSING_TIMESTAMP)
+            self._time_order = present[np.argsort(timestamps[present], kind="stable")]
+        sorted_timestamps = self._timestamps[self._time_order]
+        low = 0 if start is None else np.searchsorted(sorted_timestamps, start, side="left")
+        high = (
+            sorted_timestamps.size
+            if stop is None
+            else np.searchsorted(sorted_timestamps, stop, side="right")
+        )
+        return np.sort(self._time_order[low:high])
+
+    def select(self, search_filter: SearchFilter) -> Optional[np.ndarray]:
+        """Sorted row ids matching ``search_filter``; None when it is inactive."""
+        if not search_filter.active:
+            return None
+        with self._lock:
+            candidates: List[np.ndarray] = []
+            for attribute in CATEGORICAL_ATTRIBUTES:
+                values = getattr(search_filter, attribute)
+                if not values:
+                    continue
+                postings = self._posting_lists(attribute)
+                vocab = self._vocab[attribute]
+                lists = [postings[vocab[value]] for value in values if vocab.get(value) in postings]
+                # Posting lists of different values are disjoint.
+                candidates.append(np.sort(np.concatenate(lists)) if lists else np.empty(0, np.int64))
+            if search_filter.timestamp_from is not None or search_filter.timestamp_to is not None:
+                candidates.append(
+                    self._time_range(search_filter.timestamp_from, search_filter.timestamp_to)
+                )
+
+        candidates.sort(key=len)
+        rows = candidates[0]
+        for other in candidates[1:]:
+            rows = _intersect_sorted(rows, other)
+        return rows.astype(np.int64, copy=False)
@@ -0,0 +1,400 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.search.exact import dedupe_paths, normalize_rows, top_k_indices, top_k_rows
+from backend.search.filters import MetadataIndex
+from backend.search.kmeans import assign, spherical_kmeans
+
+_TOMBSTONE = -1
+
+
+class _InvertedList:
+    """Growable, contiguous block of the vectors assigned to one centroid."""
+
+    def __init__(self, dim: int, capacity: int = 16):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.ids = np.empty(capacity, dtype=np.int64)
+        self.size = 0
+
+    def append(self, ids: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+        needed = self.size + ids.shape[0]
+        if needed > self.ids.shape[0]:
+            capacity = max(needed, self.ids.shape[0] * 2)
+            grown_vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+            grown_vectors[:self.size] = self.vectors[:self.size]
+            grown_ids = np.empty(capacity, dtype=np.int64)
+            grown_ids[:self.size] = self.ids[:self.size]
+            self.vectors, self.ids = grown_vectors, grown_ids
+        slots = np.arange(self.size, needed)
+        self.vectors[slots] = vectors
+        self.ids[slots] = ids
+        self.size = needed
+        return slots
+
+
+class IVFFlatIndex:
+    """Inverted-file index with full-precision (flat) vectors per list.
+
+    Queries score only the ``nprobe`` lists whose centroids are closest to the
+    query; ``nprobe == nlist`` degenerates to an exact scan.
+    """
+
+    def __init__(self, centroids: np.ndarray, default_nprobe: int = 16):
+        self.centroids = normalize_rows(centroids)
+        self.default_nprobe = default_nprobe
+        self._lists = [_InvertedList(self.dim) for _ in range(self.nlist)]
+        self._paths: List[str] = []
+        self._location: Dict[str, Tuple[int, int]] = {}
+        # (list, slot) of every row id, for gathering filtered rows.
+        self._id_list = np.empty(0, dtype=np.int32)
+        self._id_slot = np.empty(0, dtype=np.int64)
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.watermark: Optional[datetime] = None
+        # Paths loaded inside the refresh overlap window, by updated_at.
+        self.recent_rows: Dict[str, datetime] = {}
+        self.metadata = MetadataIndex()
+
+    @classmethod
+    def build(
+        cls,
+        paths: Sequence[str],
+        embeddings: np.ndarray,
+        nlist: Optional[int] = None,
+        default_nprobe: int = 16,
+        train_sample: int = 100000,
+        iterations: int = 20,
+    ) -> "IVFFlatIndex":
+        vectors = normalize_rows(embeddings)
+        if nlist is None:
+            nlist = default_nlist(vectors.shape[0])
+        centroids = spherical_kmeans(
+            vectors, nlist, iterations=iterations, sample_size=train_sample
+        )
+        index = cls(centroids, default_nprobe=default_nprobe)
+        index.upsert(paths, vectors)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._location)
+
+    @property
+    def dim(self) -> int:
+        return self.centroids.shape[1]
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._location)
+
+    def ids_of(self, paths: Sequence[str]) -> np.ndarray:
+        """Row ids of ``paths``, -1 for paths not in the index."""
+        ids = np.full(len(paths), -1, dtype=np.int64)
+        with self._lock:
+            for i, path in enumerate(paths):
+                location = self._location.get(path)
+                if location is not None:
+                    ids[i] = self._lists[location[0]].ids[location[1]]
+        return ids
+
+    def _record_locations(self, ids: np.ndarray, list_no: int, slots: np.ndarray) -> None:
+        size = len(self._paths)
+        if size > self._id_list.shape[0]:
+            capacity = max(size, 2 * self._id_list.shape[0])
+            grown_list = np.full(capacity, -1, dtype=np.int32)
+            grown_list[: self._id_list.shape[0]] = self._id_list
+            grown_slot = np.zeros(capacity, dtype=np.int64)
+            grown_slot[: self._id_slot.shape[0]] = self._id_slot
+            self._id_list, self._id_slot = grown_list, grown_slot
+        self._id_list[ids] = list_no
+        self._id_slot[ids] = slots
+
+    def upsert(self, paths: Sequence[str], embeddings) -> int:
+        if not len(paths):
+            return 0
+        vectors = normalize_rows(embeddings)
+        paths, vectors = dedupe_paths(paths, vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError("Embedding dimensions do not match")
+        labels = assign(vectors, self.centroids)
+
+        with self._lock:
+            ids = np.empty(len(paths), dtype=np.int64)
+            for i, path in enumerate(paths):
+                previous = self._location.get(path)
+                if previous is None:
+                    ids[i] = len(self._paths)
+                    self._paths.append(path)
+                    continue
+                list_no, slot = previous
+                inverted = self._lists[list_no]
+                ids[i] = inverted.ids[slot]
+                # The row moves to whatever list it is assigned to now.
+                inverted.ids[slot] = _TOMBSTONE
+
+            for list_no in np.unique(labels):
+                members = np.flatnonzero(labels == list_no)
+                slots = self._lists[list_no].append(ids[members], vectors[members])
+                self._record_locations(ids[members], int(list_no), slots)
+                for member, slot in zip(members, slots):
+                    self._location[paths[member]] = (int(list_no), int(slot))
+        return len(paths)
+
+    def search(
+        self,
+        query,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        rows: Optional[np.ndarray] = None,
+        prefilter: bool = False,
+    ) -> List[Tuple[str, float]]:
+        """Best ``top_k`` rows, restricted to the sorted row ids ``rows`` if given.
+
+        With ``prefilter`` the matching rows are gathered from their lists and
+        scored exactly. Otherwise the probed lists are scanned and rows not in
+        ``rows`` dropped; callers widen ``nprobe`` to make up for them.
+        """
+        query_vec = normalize_rows(query)[0]
+        if query_vec.shape[0] != self.dim:
+            raise ValueError("Embedding dimensions do not match")
+        if rows is not None and prefilter:
+            return self._search_rows(query_vec, top_k, rows)
+        nprobe = min(nprobe or self.default_nprobe, self.nlist)
+        probe = top_k_indices(self.centroids @ query_vec, nprobe)
+
+        ids_parts = []
+        score_parts = []
+        with self._lock:
+            for list_no in probe:
+                inverted = self._lists[list_no]
+                if inverted.size == 0:
+                    continue
+                ids_parts.append(inverted.ids[:inverted.size].copy())
+                score_parts.append(inverted.vectors[:inverted.size] @ query_vec)
+            paths = self._paths
+        if not ids_parts:
+            return []
+
+        ids = np.concatenate(ids_parts)
+        scores = np.concatenate(score_parts)
+        live = ids != _TOMBSTONE
+        ids, scores = ids[live], scores[live]
+        if rows is not None:
+            allowed = _intersect_mask(ids, rows)
+            ids, scores = ids[allowed], scores[allowed]
+        best = top_k_indices(scores, top_k)
+        return [(paths[ids[i]], float(scores[i])) for i in best]
+
+    def _gather_rows(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Ids and vectors of the given row ids, fetched from their lists."""
+        with self._lock:
+            rows = rows[rows < len(self._paths)]
+            rows = rows[self._id_list[rows] >= 0]
+            list_nos = self._id_list[rows]
+            slots = self._id_slot[rows]
+            ids_parts = []
+            vector_parts = []
+            for list_no in np.unique(list_nos):
+                members = list_nos == list_no
+                ids_parts.append(rows[members])
+                vector_parts.append(self._lists[list_no].vectors[slots[members]])
+        if not ids_parts:
+            return np.empty(0, dtype=np.int64), np.empty((0, self.dim), dtype=np.float32)
+        return np.concatenate(ids_parts), np.concatenate(vector_parts)
+
+    def _search_rows(self, query_vec: np.ndarray, top_k: int, rows: np.ndarray):
+        ids, vectors = self._gather_rows(rows)
+        scores = vectors @ query_vec
+        best = top_k_indices(scores, top_k)
+        paths = self._paths
+        return [(paths[ids[i]], float(scores[i])) for i in best]
+
+    def search_many(
+        self,
+        queries,
+        top_k: int,
+        nprobe: Optional[int] = None,
+        rows: Optional[np.ndarray] = None,
+        prefilter: bool = False,
+    ) -> List[List[Tuple[str, float]]]:
+        """``search`` for many queries at once.
+
+        Each inverted list is read once and scored against every query that
+        probes it in one matrix-matrix product, instead of once per query.
+        """
+        query_vecs = normalize_rows(queries)
+        if query_vecs.shape[1] != self.dim:
+            raise ValueError("Embedding dimensions do not match")
+        paths = self._paths
+        if rows is not None and prefilter:
+            ids, vectors = self._gather_rows(rows)
+            scores = query_vecs @ vectors.T
+            best = top_k_rows(scores, top_k)
+            picked = np.take_along_axis(scores, best, axis=1)
+            return [
+                [(paths[ids[i]], float(score)) for i, score in zip(row_best, row_scores)]
+                for row_best, row_scores in zip(best, picked)
+            ]
+
+        nprobe = min(nprobe or self.default_nprobe, self.nlist)
+        probes = top_k_rows(query_vecs @ self.centroids.T, nprobe)
+        ids_parts: List[List[np.ndarray]] = [[] for _ in range(query_vecs.shape[0])]
+        score_parts: List[List[np.ndarray]] = [[] for _ in range(query_vecs.shape[0])]
+        with self._lock:
+            for list_no in np.unique(probes):
+                inverted = self._lists[list_no]
+                if inverted.size == 0:
+                    continue
+                list_ids = inverted.ids[:inverted.size]
+                live = list_ids != _TOMBSTONE
+                if rows is not None:
+                    live[live] = _intersect_mask(list_ids[live], rows)
+                if not live.any():
+                    continue
+                list_ids = list_ids[live]
+                members = np.flatnonzero((probes == list_no).any(axis=1))
+                scores = query_vecs[members] @ inverted.vectors[:inverted.size][live].T
+                for member, member_scores in zip(members, scores):
+                    ids_parts[member].append(list_ids)
+                    score_parts[member].append(member_scores)
+            paths = self._paths
+
+        results = []
+        for query_ids, query_scores in zip(ids_parts, score_parts):
+            if not query_ids:
+                results.append([])
+                continue
+            ids = np.concatenate(query_ids)
+            scores = np.concatenate(query_scores)
+            best = top_k_indices(scores, top_k)
+            results.append([(paths[ids[i]], float(scores[i])) for i in best])
+        return results
+
+    def save(self, directory: str) -> None:
+        """Write the index atomically: a temp dir is swapped into place.
+
+        The lock is held only to snapshot the lists; vectors are then copied
+        list by list into a preallocated ``.npy``, so upserts keep running
+        and no second full matrix is allocated. Rows upserted during the
+        save may be missing from it; they are newer than the saved
+        watermark, so the next refresh after loading reads them again.
+        """
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        with self._lock:
+            # Upserts only append past ``size`` or swap in grown arrays, so
+            # these views keep their content after the lock is released.
+            lists = [
+                (inv.ids[:inv.size], inv.vectors[:inv.size]) for inv in self._lists
+            ]
+            paths = self._paths[:]
+            meta = {
+                "dim": self.dim,
+                "nlist": self.nlist,
+                "rows": len(self),
+                "default_nprobe": self.default_nprobe,
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+            }
+
+        sizes = np.array([ids.shape[0] for ids, _ in lists], dtype=np.int64)
+        np.save(os.path.join(tmp_dir, "centroids.npy"), self.centroids)
+        np.save(os.path.join(tmp_dir, "list_sizes.npy"), sizes)
+        total = int(sizes.sum())
+        ids_out = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "ids.npy"), mode="w+", dtype=np.int64, shape=(total,)
+        )
+        vectors_out = np.lib.format.open_memmap(
+            os.path.join(tmp_dir, "vectors.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(total, self.dim),
+        )
+        offset = 0
+        for ids, vectors in lists:
+            ids_out[offset:offset + ids.shape[0]] = ids
+            vectors_out[offset:offset + ids.shape[0]] = vectors
+            offset += ids.shape[0]
+        ids_out.flush()
+        vectors_out.flush()
+        del ids_out, vectors_out
+        with open(os.path.join(tmp_dir, "paths.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(paths))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        old_dir = f"{directory}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, old_dir)
+        os.replace(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str) -> "IVFFlatIndex":
+        """Read a saved index; each list's vectors are read straight into its own array."""
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(
+            np.load(os.path.join(directory, "centroids.npy")),
+            default_nprobe=meta["default_nprobe"],
+        )
+        sizes = np.load(os.path.join(directory, "list_sizes.npy"))
+        ids = np.load(os.path.join(directory, "ids.npy"))
+        with open(os.path.join(directory, "paths.txt"), encoding="utf-8") as f:
+            index._paths = f.read().split("\n") if meta["rows"] else []
+
+        with open(os.path.join(directory, "vectors.npy"), "rb") as vectors_file:
+            version = np.lib.format.read_magic(vectors_file)
+            if version == (1, 0):
+                _, _, dtype = np.lib.format.read_array_header_1_0(vectors_file)
+            else:
+                _, _, dtype = np.lib.format.read_array_header_2_0(vectors_file)
+            offset = 0
+            for list_no, size in enumerate(sizes):
+                size = int(size)
+                inverted = index._lists[list_no]
+                if size:
+                    inverted.vectors = np.fromfile(
+                        vectors_file, dtype=dtype, count=size * index.dim
+                    ).reshape(size, index.dim)
+                    inverted.ids = ids[offset:offset + size].copy()
+                    inverted.size = size
+                list_ids = inverted.ids[:size]
+                slots = np.arange(size)
+                live = list_ids != _TOMBSTONE
+                index._record_locations(list_ids[live], list_no, slots[live])
+                for slot in np.flatnonzero(live):
+                    index._location[index._paths[list_ids[slot]]] = (list_no, int(slot))
+                offset += size
+
+        if meta["watermark"]:
+            index.watermark = datetime.fromisoformat(meta["watermark"])
+        index.loaded = True
+        return index
+
+
+def _intersect_mask(ids: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Mask of ``ids`` present in the sorted array ``rows``."""
+    if rows.size == 0:
+        return np.zeros(ids.shape[0], dtype=bool)
+    positions = np.searchsorted(rows, ids)
+    positions[positions == rows.size] = 0
+    return rows[positions] == ids
+
+
+def default_nlist(rows: int) -> int:
+    """Rule of thumb: about 4 * sqrt(N) lists, at least one per 39 rows."""
+    return max(1, min(int(4 * np.sqrt(rows)), rows // 39 or 1))
@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+from typing import Optional
+
+import numpy as np
+
+from backend.search.exact import normalize_rows
+
+
+def _assign(data: np.ndarray, centroids: np.ndarray, chunk_size: int) -> np.ndarray:
+    labels = np.empty(data.shape[0], dtype=np.int64)
+    for start in range(0, data.shape[0], chunk_size):
+        block = data[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def _cluster_sums(data: np.ndarray, labels: np.ndarray, k: int):
+    order = np.argsort(labels, kind="stable")
+    counts = np.bincount(labels, minlength=k)
+    sums = np.zeros((k, data.shape[1]), dtype=np.float32)
+    present = np.flatnonzero(counts)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[present]
+    sums[present] = np.add.reduceat(data[order], starts, axis=0)
+    return sums, counts
+
+
+def assign(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Index of the closest (max inner product) centroid for every row."""
+    return _assign(np.asarray(data, dtype=np.float32), centroids, chunk_size)
+
+
+def spherical_kmeans(
+    data: np.ndarray,
+    k: int,
+    iterations: int = 20,
+    sample_size: Optional[int] = 100000,
+    seed: int = 0,
+    chunk_size: int = 65536,
+) -> np.ndarray:
+    """Train ``k`` unit-norm centroids on (a sample of) unit-norm rows."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if sample_size and data.shape[0] > sample_size:
+        data = data[rng.choice(data.shape[0], sample_size, replace=False)]
+    if data.shape[0] < k:
+        raise ValueError(f"Need at least {k} training vectors, got {data.shape[0]}")
+
+    centroids = data[rng.choice(data.shape[0], k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign(data, centroids, chunk_size)
+        sums, counts = _cluster_sums(data, labels, k)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters with random points so every list is used.
+            sums[empty] = data[rng.choice(data.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def _assign_l2(data: np.ndarray, centroids: np.ndarray, chunk_size: int) -> np.ndarray:
+    # argmin ||x - c||^2 == argmin ||c||^2 - 2 x.c; ||x||^2 is the same for every c.
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(data.shape[0], dtype=np.int64)
+    for start in range(0, data.shape[0], chunk_size):
+        block = data[start:start + chunk_size]
+        labels[start:start + chunk_size] = np.argmin(
+            centroid_norms - 2.0 * (block @ centroids.T), axis=1
+        )
+    return labels
+
+
+def assign_l2(data: np.ndarray, centroids: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+    """Index of the closest (Euclidean) centroid for every row."""
+    return _assign_l2(np.asarray(data, dtype=np.float32), centroids, chunk_size)
+
+
+def kmeans(
+    data: np.ndarray,
+    k: int,
+    iterations: int = 20,
+    sample_size: Optional[int] = 100000,
+    seed: int = 0,
+    chunk_size: int = 65536,
+) -> np.ndarray:
+    """Train ``k`` Euclidean centroids on (a sample of) rows of any norm."""
+    rng = np.random.default_rng(seed)
+    data = np.asarray(data, dtype=np.float32)
+    if sample_size and data.shape[0] > sample_size:
+        data = data[rng.choice(data.shape[0], sample_size, replace=False)]
+    if data.shape[0] < k:
+        raise ValueError(f"Need at least {k} training vectors, got {data.shape[0]}")
+
+    centroids = data[rng.choice(data.shape[0], k, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _assign_l2(data, centroids, chunk_size)
+        sums, counts = _cluster_sums(data, labels, k)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = data[rng.choice(data.shape[0], int(empty.sum()), replace=False)]
+            counts[empty] = 1
+        centroids = sums / counts[:, None]
+    return centroids.astype(np.float32)
@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.search.exact import dedupe_paths, normalize_rows, top_k_indices
+from backend.search.filters import MetadataIndex
+from backend.search.kmeans import assign_l2, kmeans
+
+_CODEBOOK_SIZE = 256  # one byte per code
+
+
+class PQIndex:
+    """Product-quantized index: ``subspaces`` one-byte codes per row, no floats.
+
+    Every vector is cut into ``subspaces`` equal slices and each slice is
+    replaced by the id of its nearest codeword in that subspace's 256-entry
+    codebook: 640 float32 dims (2560 bytes) become 64 bytes at 64 subspaces.
+    A query is scored by asymmetric distance computation: one lookup table
+    of query-slice x codeword inner products, then a gather-and-sum over the
+    codes. Those scores only shortlist candidates; ``rerank`` rescores the
+    shortlist with full-precision vectors fetched from Postgres.
+    """
+
+    def __init__(self, codebooks: np.ndarray, candidates: int = 256, initial_capacity: int = 1024):
+        self.codebooks = np.asarray(codebooks, dtype=np.float32)  # [M, 256, D / M]
+        self.candidates = candidates
+        # Codes are stored subspace-major, so each lookup pass reads one
+        # contiguous row of codes.
+        self._codes = np.empty((self.subspaces, initial_capacity), dtype=np.uint8)
+        self._paths: List[str] = []
+        self._row_by_path: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.watermark: Optional[datetime] = None
+        # Paths loaded inside the refresh overlap window, by updated_at.
+        self.recent_rows: Dict[str, datetime] = {}
+        self.metadata = MetadataIndex()
+
+    @classmethod
+    def train(
+        cls,
+        embeddings: np.ndarray,
+        subspaces: int = 64,
+        candidates: int = 256,
+        train_sample: int = 100000,
+        iterations: int = 20,
+    ) -> "PQIndex":
+        vectors = normalize_rows(embeddings)
+        dim = vectors.shape[1]
+        if dim % subspaces:
+            raise ValueError(f"Embedding dim {dim} is not divisible into {subspaces} subspaces")
+        width = dim // subspaces
+        codebooks = np.stack(
+            [
+                kmeans(
+                    vectors[:, j * width:(j + 1) * width],
+                    _CODEBOOK_SIZE,
+                    iterations=iterations,
+                    sample_size=train_sample,
+                    seed=j,
+                )
+                for j in range(subspaces)
+            ]
+        )
+        return cls(codebooks, candidates=candidates)
+
+    @classmethod
+    def build(cls, paths: Sequence[str], embeddings: np.ndarray, **train_kwargs) -> "PQIndex":
+        index = cls.train(embeddings, **train_kwargs)
+        index.upsert(paths, embeddings)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._paths)
+
+    @property
+    def subspaces(self) -> int:
+        return self.codebooks.shape[0]
+
+    @property
+    def dim(self) -> int:
+        return self.codebooks.shape[0] * self.codebooks.shape[2]
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.subspaces
+
+    def paths(self) -> List[str]:
+        with self._lock:
+            return list(self._paths)
+
+    def ids_of(self, paths: Sequence[str]) -> np.ndarray:
+        """Row ids of ``paths``, -1 for paths not in the index."""
+        with self._lock:
+            return np.array([self._row_by_path.get(path, -1) for path in paths], dtype=np.int64)
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        """[M, N] codes of unit-norm ``vectors``."""
+        width = self.codebooks.shape[2]
+        codes = np.empty((self.subspaces, vectors.shape[0]), dtype=np.uint8)
+        for j in range(self.subspaces):
+            codes[j] = assign_l2(vectors[:, j * width:(j + 1) * width], self.codebooks[j])
+        return codes
+
+    def upsert(self, paths: Sequence[str], embeddings) -> int:
+        if not len(paths):
+            return 0
+        vectors = normalize_rows(embeddings)
+        paths, vectors = dedupe_paths(paths, vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError("Embedding dimensions do not match")
+        codes = self.encode(vectors)
+
+        with self._lock:
+            rows = np.empty(len(paths), dtype=np.int64)
+            for i, path in enumerate(paths):
+                row = self._row_by_path.get(path)
+                if row is None:
+                    row = len(self._paths)
+                    self._paths.append(path)
+                    self._row_by_path[path] = row
+                rows[i] = row
+            self._reserve(len(self._paths))
+            self._codes[:, rows] = codes
+        return len(paths)
+
+    def _reserve(self, size: int) -> None:
+        capacity = self._codes.shape[1]
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        grown = np.empty((self.subspaces, capacity), dtype=np.uint8)
+        grown[:, :self._codes.shape[1]] = self._codes
+        self._codes = grown
+
+    def _lookup_tables(self, query_vecs: np.ndarray) -> np.ndarray:
+        """[Q, M, 256] inner products of every query slice with every codeword."""
+        slices = query_vecs.reshape(query_vecs.shape[0], self.subspaces, -1)
+        return np.einsum("qmd,mkd->qmk", slices, self.codebooks)
+
+    def _adc_scores(self, table: np.ndarray, codes: np.ndarray) -> np.ndarray:
+        scores = np.zeros(codes.shape[1], dtype=np.float32)
+        for j in range(self.subspaces):
+            scores += table[j][codes[j]]
+        return scores
+
+    def search_many(
+        self,
+        queries,
+        top_k: int,
+        rows: Optional[np.ndarray] = None,
+        prefilter: bool = False,
+    ) -> List[List[Tuple[str, float]]]:
+        """Approximate hits per query: the best ``max(top_k, candidates)`` by ADC score.
+
+        ``rows`` restricts the search to those sorted row ids, scoring only
+        their codes with ``prefilter`` or picking them from a full scan.
+        """
+        query_vecs = normalize_rows(queries)
+        if query_vecs.shape[1] != self.dim:
+            raise ValueError("Embedding dimensions do not match")
+        shortlist = max(top_k, self.candidates)
+        with self._lock:
+            size = len(self._paths)
+            codes = self._codes[:, :size]
+            paths = self._paths
+        if rows is not None:
+            rows = rows[rows < size]
+            if prefilter:
+                codes = codes[:, rows]
+
+        results = []
+        for table in self._lookup_tables(query_vecs):
+            scores = self._adc_scores(table, codes)
+            if rows is not None and not prefilter:
+                scores = scores[rows]
+            best = top_k_indices(scores, shortlist)
+            ids = best if rows is None else rows[best]
+            results.append([(paths[i], float(scores[b])) for i, b in zip(ids, best)])
+        return results
+
+    def search(self, query, top_k: int, **kwargs) -> List[Tuple[str, float]]:
+        return self.search_many(query, top_k, **kwargs)[0]
+
+    def save(self, directory: str) -> None:
+        """Write the index atomically: a temp dir is swapped into place."""
+        tmp_dir = f"{directory}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        # As in IVFFlatIndex.save, the lock only covers the snapshot; rows
+        # upserted while writing are newer than the saved watermark.
+        with self._lock:
+            codes = self._codes[:, :len(self._paths)]
+            paths = self._paths[:]
+            meta = {
+                "dim": self.dim,
+                "subspaces": self.subspaces,
+                "rows": len(self),
+                "candidates": self.candidates,
+                "watermark": self.watermark.isoformat() if self.watermark else None,
+            }
+        np.save(os.path.join(tmp_dir, "codebooks.npy"), self.codebooks)
+        np.save(os.path.join(tmp_dir, "codes.npy"), codes)
+        with open(os.path.join(tmp_dir, "paths.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(paths))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        old_dir = f"{directory}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.exists(directory):
+            os.replace(directory, old_dir)
+        os.replace(tmp_dir, directory)
+        shutil.rmtree(old_dir, ignore_errors=True)
+
+    @classmethod
+    def load(cls, directory: str) -> "PQIndex":
+        with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        codes = np.load(os.path.join(directory, "codes.npy"))
+        index = cls(
+            np.load(os.path.join(directory, "codebooks.npy")),
+            candidates=meta["candidates"],
+            initial_capacity=max(codes.shape[1], 1),
+        )
+        with open(os.path.join(directory, "paths.txt"), encoding="utf-8") as f:
+            index._paths = f.read().split("\n") if meta["rows"] else []
+        index._row_by_path = {path: row for row, path in enumerate(index._paths)}
+        index._codes[:, :codes.shape[1]] = codes
+        if meta["watermark"]:
+            index.watermark = datetime.fromisoformat(meta["watermark"])
+        index.loaded = True
+        return index
+
+
+def rerank(
+    queries,
+    hits: List[List[Tuple[str, float]]],
+    vectors: Dict[str, np.ndarray],
+    top_k: int,
+) -> List[List[Tuple[str, float]]]:
+    """Exact cosine scores for each query's shortlisted paths, best ``top_k`` kept.
+
+    ``vectors`` holds full-precision embeddings by path; shortlisted paths
+    missing from it (deleted meanwhile) are dropped.
+    """
+    query_vecs = normalize_rows(queries)
+    results = []
+    for query_vec, query_hits in zip(query_vecs, hits):
+        paths = [path for path, _ in query_hits if path in vectors]
+        if not paths:
+            results.append([])
+            continue
+        scores = normalize_rows(np.stack([vectors[path] for path in paths])) @ query_vec
+        best = top_k_indices(scores, top_k)
+        results.append([(paths[i], float(scores[i])) for i in best])
+    return results
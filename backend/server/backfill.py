@@ -0,0 +1,278 @@
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger("avsp.backfill")
+
+_DONE = object()
+# How often the insert thread hands new per-path failures to ``fail`` when
+# no batch arrives to wake it.
+_ERROR_FLUSH_SEC = 1.0
+
+FetchFn = Callable[[str], bytes]
+# Per-item results: either (embedding, dim) or the exception raised for that item.
+EmbedFn = Callable[[Sequence[bytes]], List[Union[Tuple[object, int], Exception]]]
+InsertFn = Callable[[List[Tuple[str, object, int]]], int]
+# Records failed paths, {storage_path: error}, as they happen.
+FailFn = Callable[[Dict[str, str]], None]
+
+STAGES = ("fetch", "embed", "insert")
+
+
+@dataclass
+class PipelineConfig:
+    fetch_workers: int = 16
+    embed_workers: int = 2
+    batch_size: int = 16
+    queue_size: int = 256
+    # A partial embedding batch is sent once no new image arrived for this long.
+    batch_timeout_sec: float = 0.2
+    stop_on_error: bool = False
+    dry_run: bool = False
+
+
+@dataclass
+class PipelineStats:
+    total_seen: int = 0
+    total_inserted: int = 0
+    errors: List[Dict[str, str]] = field(default_factory=list)
+    # Busy time summed over each stage's workers, and the calls it covers:
+    # one per image for fetch, one per batch for embed and insert.
+    stage_seconds: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(STAGES, 0.0))
+    stage_calls: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(STAGES, 0))
+
+
+class BackfillPipeline:
+    """Three-stage backfill connected by bounded queues.
+
+    ``fetch_workers`` threads download images, ``embed_workers`` threads send
+    them to the embedder in batches, and a single insert thread writes results
+    while the next batches are still being fetched and embedded. The insert
+    thread also passes failures of any stage to ``fail`` as they accumulate.
+    """
+
+    def __init__(
+        self,
+        fetch: FetchFn,
+        embed: EmbedFn,
+        insert: InsertFn,
+        config: PipelineConfig,
+        fail: Optional[FailFn] = None,
+    ):
+        self.fetch = fetch
+        self.embed = embed
+        self.insert = insert
+        self.fail = fail
+        self.config = config
+        self.stats = PipelineStats()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._errors_reported = 0
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def snapshot(self) -> PipelineStats:
+        """Consistent copy of the running counters, safe to read from another thread."""
+        with self._stats_lock:
+            return PipelineStats(
+                total_seen=self.stats.total_seen,
+                total_inserted=self.stats.total_inserted,
+                errors=list(self.stats.errors),
+                stage_seconds=dict(self.stats.stage_seconds),
+                stage_calls=dict(self.stats.stage_calls),
+            )
+
+    def _record_stage(self, stage: str, started: float) -> None:
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.stats.stage_seconds[stage] += elapsed
+            self.stats.stage_calls[stage] += 1
+
+    def _record_error(self, storage_path: str, exc: BaseException) -> None:
+        with self._stats_lock:
+            self.stats.errors.append({"storage_path": storage_path, "error": str(exc)})
+        if self.config.stop_on_error:
+            self._stop.set()
+
+    def unreported_errors(self) -> Dict[str, str]:
+        """Failures not yet passed to ``fail``, e.g. because it raised."""
+        with self._stats_lock:
+            return {
+                error["storage_path"]: error["error"]
+                for error in self.stats.errors[self._errors_reported:]
+            }
+
+    def _report_errors(self) -> None:
+        if self.fail is None:
+            return
+        with self._stats_lock:
+            pending = self.stats.errors[self._errors_reported:]
+        if not pending:
+            return
+        try:
+            self.fail({error["storage_path"]: error["error"] for error in pending})
+        except Exception:  # noqa: BLE001
+            logger.exception("Recording %s failed paths failed", len(pending))
+            return
+        with self._stats_lock:
+            self._errors_reported += len(pending)
+
+    def run(self, paths: Iterable[str]) -> PipelineStats:
+        cfg = self.config
+        path_q: queue.Queue = queue.Queue(maxsize=cfg.queue_size)
+        fetched_q: queue.Queue = queue.Queue(maxsize=cfg.queue_size)
+        embedded_q: queue.Queue = queue.Queue(
+            maxsize=max(1, cfg.queue_size // cfg.batch_size)
+        )
+
+        fetchers = _StageGroup(cfg.fetch_workers, fetched_q, cfg.embed_workers)
+        embedders = _StageGroup(cfg.embed_workers, embedded_q, 1)
+
+        threads = [
+            threading.Thread(target=self._fetch_worker, args=(path_q, fetched_q, fetchers))
+            for _ in range(cfg.fetch_workers)
+        ]
+        threads += [
+            threading.Thread(target=self._embed_worker, args=(fetched_q, embedded_q, embedders))
+            for _ in range(cfg.embed_workers)
+        ]
+        threads.append(threading.Thread(target=self._insert_worker, args=(embedded_q,)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            for storage_path in paths:
+                if self._stop.is_set():
+                    break
+                path_q.put(storage_path)
+        finally:
+            for _ in range(cfg.fetch_workers):
+                path_q.put(_DONE)
+            for thread in threads:
+                thread.join()
+        return self.stats
+
+    def _fetch_worker(self, path_q, fetched_q, group: "_StageGroup") -> None:
+        try:
+            while True:
+                storage_path = path_q.get()
+                if storage_path is _DONE:
+                    return
+                if self._stop.is_set():
+                    continue
+                with self._stats_lock:
+                    self.stats.total_seen += 1
+                started = time.perf_counter()
+                try:
+                    image_bytes = self.fetch(storage_path)
+                except Exception as exc:  # noqa: BLE001
+                    logger.exception("Fetch failed for %s", storage_path)
+                    self._record_error(storage_path, exc)
+                    continue
+                finally:
+                    self._record_stage("fetch", started)
+                fetched_q.put((storage_path, image_bytes))
+        finally:
+            group.finish()
+
+    def _embed_worker(self, fetched_q, embedded_q, group: "_StageGroup") -> None:
+        batch: List[Tuple[str, bytes]] = []
+        try:
+            while True:
+                try:
+                    item = fetched_q.get(timeout=self.config.batch_timeout_sec)
+                except queue.Empty:
+                    item = None
+                if item is _DONE:
+                    break
+                if item is not None:
+                    batch.append(item)
+                if batch and (item is None or len(batch) >= self.config.batch_size):
+                    self._embed_batch(batch, embedded_q)
+                    batch = []
+            if batch:
+                self._embed_batch(batch, embedded_q)
+        finally:
+            group.finish()
+
+    def _embed_batch(self, batch: List[Tuple[str, bytes]], embedded_q) -> None:
+        if self._stop.is_set():
+            return
+        started = time.perf_counter()
+        try:
+            results = self.embed([image_bytes for _, image_bytes in batch])
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Embedding batch of %s failed", len(batch))
+            results = [exc] * len(batch)
+        self._record_stage("embed", started)
+
+        rows = []
+        for (storage_path, _), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self._record_error(storage_path, result)
+                continue
+            embedding, dim = result
+            rows.append((storage_path, embedding, dim))
+        if rows:
+            embedded_q.put(rows)
+
+    def _insert_worker(self, embedded_q) -> None:
+        while True:
+            try:
+                rows = embedded_q.get(timeout=_ERROR_FLUSH_SEC)
+            except queue.Empty:
+                self._report_errors()
+                continue
+            if rows is _DONE:
+                self._report_errors()
+                return
+            if self.config.dry_run:
+                self._report_errors()
+                continue
+            started = time.perf_counter()
+            try:
+                inserted = self.insert(rows)
+            except Exception as exc:  # noqa: BLE001
+                logger.exception("Insert of %s rows failed", len(rows))
+                for storage_path, _, _ in rows:
+                    self._record_error(storage_path, exc)
+                self._report_errors()
+                continue
+            finally:
+                self._record_stage("insert", started)
+            with self._stats_lock:
+                self.stats.total_inserted += inserted
+                total_inserted = self.stats.total_inserted
+            logger.info(
+                "Batch inserted: count=%s total_inserted=%s", inserted, total_inserted
+            )
+            self._report_errors()
+
+
+class _StageGroup:
+    """Tracks the workers of one stage; the last one to finish closes the next queue."""
+
+    def __init__(self, workers: int, downstream: queue.Queue, downstream_workers: int):
+        self._remaining = workers
+        self._lock = threading.Lock()
+        self._downstream = downstream
+        self._downstream_workers = downstream_workers
+
+    def finish(self) -> None:
+        with self._lock:
+            self._remaining -= 1
+            last = self._remaining == 0
+        if last:
+            for _ in range(self._downstream_workers):
+                self._downstream.put(_DONE)
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from backend.server.backfill import STAGES, BackfillPipeline, PipelineStats
+
+logger = logging.getLogger("avsp.jobs")
+
+ACTIVE_STATUSES = ("queued", "running", "cancelling")
+
+
+@dataclass
+class BackfillJob:
+    job_id: str
+    params: Dict[str, Any]
+    resumed_from: Optional[str] = None
+    status: str = "queued"
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    _pipeline: Optional[BackfillPipeline] = field(default=None, repr=False)
+    _stats: Optional[PipelineStats] = field(default=None, repr=False)
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel.is_set()
+
+    def attach(self, pipeline: BackfillPipeline) -> None:
+        """Called by the runner once its pipeline exists, so cancel can reach it."""
+        self._pipeline = pipeline
+        if self._cancel.is_set():
+            pipeline.stop()
+
+    def stats(self) -> PipelineStats:
+        if self._stats is not None:
+            return self._stats
+        if self._pipeline is not None:
+            return self._pipeline.snapshot()
+        return PipelineStats()
+
+    def progress(self, remaining: Optional[int] = None) -> Dict[str, Any]:
+        """Counters, throughput and per-stage latency; ``remaining`` drives the ETA."""
+        stats = self.stats()
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        fps = stats.total_seen / elapsed if elapsed > 0 else 0.0
+
+        limit_left = max(self.params["limit"] - stats.total_seen, 0)
+        if remaining is not None:
+            limit_left = min(limit_left, remaining)
+        eta_sec = None
+        if self.status == "running" and fps > 0:
+            eta_sec = round(limit_left / fps, 1)
+
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "resumed_from": self.resumed_from,
+            "params": self.params,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "elapsed_sec": round(elapsed, 1),
+            "total_seen": stats.total_seen,
+            "total_inserted": stats.total_inserted,
+            "total_errors": len(stats.errors),
+            "frames_per_sec": round(fps, 2),
+            "inserted_per_sec": round(stats.total_inserted / elapsed, 2) if elapsed > 0 else 0.0,
+            "remaining": limit_left,
+            "eta_sec": eta_sec,
+            "stage_latency_ms": {
+                stage: round(stats.stage_seconds[stage] / stats.stage_calls[stage] * 1000.0, 2)
+                if stats.stage_calls[stage]
+                else None
+                for stage in STAGES
+            },
+            "error": self.error,
+            "errors": stats.errors[-20:],
+        }
+
+
+class BackfillJobManager:
+    """Runs backfills on background threads and keeps their state for polling.
+
+    ``runner`` does the actual work for one job and returns its final stats;
+    it must call ``job.attach(pipeline)`` so cancellation can stop it. At most
+    ``max_running`` jobs run at once, later ones wait in ``queued``. Jobs live
+    in this process only: progress of a job started by another uvicorn worker
+    is not visible here, though the work queue it drains is shared.
+    """
+
+    def __init__(
+        self,
+        runner: Callable[[BackfillJob], PipelineStats],
+        max_running: int = 1,
+        history: int = 100,
+    ):
+        self.runner = runner
+        self.history = history
+        self._jobs: "OrderedDict[str, BackfillJob]" = OrderedDict()
+        self._threads: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_running)
+
+    def submit(self, params: Dict[str, Any], resumed_from: Optional[str] = None) -> BackfillJob:
+        job = BackfillJob(job_id=uuid.uuid4().hex, params=params, resumed_from=resumed_from)
+        thread = threading.Thread(
+            target=self._run, args=(job,), name=f"backfill-{job.job_id[:8]}", daemon=True
+        )
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._threads[job.job_id] = thread
+            self._trim()
+        thread.start()
+        return job
+
+    def get(self, job_id: str) -> Optional[BackfillJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[BackfillJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id: str) -> Optional[BackfillJob]:
+        job = self.get(job_id)
+        if job is None or job.status not in ACTIVE_STATUSES:
+            return job
+        job._cancel.set()
+        if job.status == "running":
+            job.status = "cancelling"
+        if job._pipeline is not None:
+            job._pipeline.stop()
+        return job
+
+    def shutdown(self, timeout: float = 30.0) -> None:
+        """Cancel every active job and wait for their leases to be released."""
+        for job in self.list():
+            self.cancel(job.job_id)
+        with self._lock:
+            threads = list(self._threads.values())
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+
+    def _run(self, job: BackfillJob) -> None:
+        with self._slots:
+            if job.cancel_requested:
+                job.status = "cancelled"
+                job.finished_at = time.time()
+                return
+            job.status = "running"
+            job.started_at = time.time()
+            logger.info("Backfill job %s started: %s", job.job_id, job.params)
+            try:
+                job._stats = self.runner(job)
+            except Exception as exc:  # noqa: BLE001
+                logger.exception("Backfill job %s failed", job.job_id)
+                job.error = str(exc)
+                job._stats = job.stats()
+                job.status = "failed"
+            else:
+                job.status = "cancelled" if job.cancel_requested else "completed"
+            finally:
+                job.finished_at = time.time()
+                job._pipeline = None
+                with self._lock:
+                    self._threads.pop(job.job_id, None)
+        logger.info("Backfill job %s %s", job.job_id, job.status)
+
+    def _trim(self) -> None:
+        finished = [
+            job_id for job_id, job in self._jobs.items() if job.status not in ACTIVE_STATUSES
+        ]
+        for job_id in finished[: max(len(self._jobs) - self.history, 0)]:
+            del self._jobs[job_id]
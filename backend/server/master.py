@@ -1,22 +1,41 @@
 import logging
+import os
+import socket
+import struct
+import threading
+from contextlib import asynccontextmanager, contextmanager
 from dataclasses import dataclass
-from math import sqrt
-from typing import List, Tuple
+from datetime import timedelta
+from typing import Iterator, List, Optional, Tuple, Union
 
 import boto3
 import httpx
+import numpy as np
 import psycopg2
 from botocore.client import Config
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel, Field
 from psycopg2 import sql
 from psycopg2.extras import execute_values
+from psycopg2.pool import ThreadedConnectionPool
 import time
 
+from backend.db import embedding_storage
+from backend.search.exact import ExactSearchIndex
+from backend.search.filters import SearchFilter, prefer_prefilter
+from backend.search.ivf import IVFFlatIndex
+from backend.search.pq import PQIndex, rerank
+from backend.server.backfill import BackfillPipeline, PipelineConfig, PipelineStats
+from backend.server.jobs import ACTIVE_STATUSES, BackfillJob, BackfillJobManager
+from backend.server.query_cache import QueryEmbeddingCache
+from backend.server.work_queue import EmbeddingWorkQueue
 from configs.common import (
     EMBEDDER_ENDPOINT,
+    EMBEDDER_MODEL_ID,
     EMBEDDER_TIMEOUT_SEC,
+    EMBEDDINGS_QUEUE_TABLE,
     EMBEDDINGS_SCHEMA,
+    EMBEDDINGS_STORAGE,
     EMBEDDINGS_TABLE,
     POSTGRES_DB,
     POSTGRES_HOST,
@@ -29,11 +48,80 @@ from configs.common import (
     S3_ENDPOINT_URL,
     S3_SECRET_ACCESS_KEY,
 )
+from configs.hw_settings import MASTER_SERVER_CONFIG
 
 logger = logging.getLogger("avsp.master")
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="AVSP Master Server")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create the shared Postgres pool, embedder HTTP client and S3 client once."""
+    app.state.db_pool = ThreadedConnectionPool(
+        MASTER_SERVER_CONFIG.DB_POOL_MIN,
+        MASTER_SERVER_CONFIG.DB_POOL_MAX,
+        host=POSTGRES_HOST,
+        port=POSTGRES_PORT,
+        dbname=POSTGRES_DB,
+        user=POSTGRES_USER,
+        password=POSTGRES_PASSWORD,
+    )
+    # ThreadedConnectionPool raises when exhausted; callers wait here instead.
+    app.state.db_slots = threading.BoundedSemaphore(MASTER_SERVER_CONFIG.DB_POOL_MAX)
+    app.state.embedder = httpx.Client(
+        timeout=httpx.Timeout(EMBEDDER_TIMEOUT_SEC),
+        limits=httpx.Limits(
+            max_connections=MASTER_SERVER_CONFIG.EMBEDDER_MAX_CONNECTIONS,
+            max_keepalive_connections=MASTER_SERVER_CONFIG.EMBEDDER_MAX_CONNECTIONS,
+        ),
+    )
+    app.state.s3 = _s3_client()
+    try:
+        yield
+    finally:
+        if isinstance(_search_index, _ANN_INDEXES):
+            _save_ann_index(_search_index)
+        _backfill_jobs.shutdown()
+        app.state.embedder.close()
+        app.state.db_pool.closeall()
+
+
+app = FastAPI(title="AVSP Master Server", lifespan=lifespan)
+
+# Exact scan for small corpora, replaced by an ANN index (IVF-Flat or PQ, per
+# ANN_INDEX_TYPE) past ANN_MIN_ROWS.
+_ANN_INDEXES = (IVFFlatIndex, PQIndex)
+_search_index = ExactSearchIndex()
+_search_index_sync_lock = threading.Lock()
+_search_index_synced_at = 0.0
+_ann_index_saved_at = 0.0
+_ann_build_thread: Optional[threading.Thread] = None
+_ann_save_thread: Optional[threading.Thread] = None
+# Saves come from the build thread, the periodic save thread and shutdown;
+# they share one temp directory, so they take turns.
+_ann_index_save_lock = threading.Lock()
+
+_work_queue = EmbeddingWorkQueue(
+    schema=EMBEDDINGS_SCHEMA,
+    table=EMBEDDINGS_QUEUE_TABLE,
+    frames_schema=POSTGRES_SCHEMA,
+    frames_table=POSTGRES_TABLE,
+    embeddings_schema=EMBEDDINGS_SCHEMA,
+    embeddings_table=EMBEDDINGS_TABLE,
+    lease_sec=MASTER_SERVER_CONFIG.BACKFILL_LEASE_SEC,
+    max_attempts=MASTER_SERVER_CONFIG.BACKFILL_MAX_ATTEMPTS,
+)
+
+_storage_format: Optional[str] = None
+_storage_format_lock = threading.Lock()
+
+_query_cache = QueryEmbeddingCache(
+    model_id=EMBEDDER_MODEL_ID,
+    max_entries=MASTER_SERVER_CONFIG.QUERY_CACHE_SIZE,
+    ttl_sec=MASTER_SERVER_CONFIG.QUERY_CACHE_TTL_SEC,
+    path=MASTER_SERVER_CONFIG.QUERY_CACHE_PATH,
+)
 
 
 class BackfillRequest(BaseModel):
@@ -41,21 +129,78 @@ class BackfillRequest(BaseModel):
     batch_size: int = Field(50, ge=1)
     stop_on_error: bool = False
     dry_run: bool = False
+    # Per-stage concurrency; None falls back to MASTER_SERVER_CONFIG.
+    fetch_workers: Optional[int] = Field(None, ge=1)
+    embed_workers: Optional[int] = Field(None, ge=1)
+    queue_size: Optional[int] = Field(None, ge=1)
+    # Enqueue frames without embeddings first; other workers can skip this scan.
+    seed_queue: bool = True
 
 
-class TextSearchRequest(BaseModel):
+class SearchFilters(BaseModel):
+    """Restricts results to frames whose metadata in the frames table matches.
+
+    Values of one field are OR-ed, fields are AND-ed. Timestamps are in the
+    dataset's own unit as stored (Argoverse: ns, Waymo: us), inclusive.
+    """
+
+    dataset_type: Optional[Union[str, List[str]]] = None
+    camera_name: Optional[Union[str, List[str]]] = None
+    timestamp_from: Optional[int] = None
+    timestamp_to: Optional[int] = None
+
+    def search_filter(self) -> SearchFilter:
+        def values(value) -> Tuple[str, ...]:
+            if value is None:
+                return ()
+            return (value,) if isinstance(value, str) else tuple(value)
+
+        return SearchFilter(
+            dataset_type=values(self.dataset_type),
+            camera_name=values(self.camera_name),
+            timestamp_from=self.timestamp_from,
+            timestamp_to=self.timestamp_to,
+        )
+
+
+class TextSearchRequest(SearchFilters):
     query: str = Field(..., min_length=1)
     top_k: int = Field(5, ge=1)
+    # Kept for compatibility: the in-memory index always covers the whole table.
     max_rows: int = Field(10000, ge=1)
+    # IVF-Flat knobs, ignored while the corpus is small enough for an exact scan.
+    nprobe: Optional[int] = Field(None, ge=1)
+    exact: bool = False
+
+
+class SimilarSearchRequest(SearchFilters):
+    storage_path: str = Field(..., min_length=1)
+    top_k: int = Field(5, ge=1)
+    # The frame itself is normally its own best match.
+    exclude_self: bool = True
+    nprobe: Optional[int] = Field(None, ge=1)
+    exact: bool = False
+
+
+class BatchSearchRequest(SearchFilters):
+    queries: List[str] = Field(default_factory=list)
+    storage_paths: List[str] = Field(default_factory=list)
+    top_k: int = Field(5, ge=1)
+    nprobe: Optional[int] = Field(None, ge=1)
+    exact: bool = False
 
 
 @dataclass(frozen=True)
 class EmbedResult:
     storage_path: str
-    embedding: List[float]
+    embedding: np.ndarray
     dim: int
 
 
+# Asks the embedder for raw little-endian float32 instead of JSON lists.
+_BINARY_EMBEDDING_HEADERS = {"Accept": "application/octet-stream"}
+
+
 def _parse_storage_path(storage_path: str) -> Tuple[str, str]:
     if storage_path.startswith("s3://"):
         storage_path = storage_path[5:]
@@ -79,14 +224,20 @@ def _s3_client():
     )
 
 
+@contextmanager
 def _db_conn():
-    return psycopg2.connect(
-        host=POSTGRES_HOST,
-        port=POSTGRES_PORT,
-        dbname=POSTGRES_DB,
-        user=POSTGRES_USER,
-        password=POSTGRES_PASSWORD,
-    )
+    """Borrow a pooled connection; commit on success, roll back on error."""
+    pool = app.state.db_pool
+    with app.state.db_slots:
+        conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            pool.putconn(conn, close=conn.closed != 0)
 
 
 def _ensure_embedding_table(conn) -> None:
@@ -97,65 +248,98 @@ def _ensure_embedding_table(conn) -> None:
         """
         CREATE TABLE IF NOT EXISTS {}.{} (
             storage_path TEXT PRIMARY KEY,
-            embedding DOUBLE PRECISION[] NOT NULL,
+            embedding {} NOT NULL,
             embedding_dim INT NOT NULL,
-            created_at TIMESTAMPTZ DEFAULT now()
+            created_at TIMESTAMPTZ DEFAULT now(),
+            updated_at TIMESTAMPTZ DEFAULT clock_timestamp()
         )
         """
     ).format(
         sql.Identifier(EMBEDDINGS_SCHEMA),
         sql.Identifier(EMBEDDINGS_TABLE),
+        sql.SQL(embedding_storage.column_type(EMBEDDINGS_STORAGE)),
     )
+    table = sql.SQL("{}.{}").format(
+        sql.Identifier(EMBEDDINGS_SCHEMA), sql.Identifier(EMBEDDINGS_TABLE)
+    )
+    create_index_stmt = sql.SQL("CREATE INDEX IF NOT EXISTS {} ON {} (updated_at)").format(
+        sql.Identifier(f"{EMBEDDINGS_TABLE}_updated_at_idx"), table
+    )
+    # Tables created before updated_at existed: add it without a table
+    # rewrite, then backfill it from created_at once.
+    upgrade_stmts = [
+        sql.SQL("ALTER TABLE {} ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ").format(table),
+        sql.SQL("ALTER TABLE {} ALTER COLUMN updated_at SET DEFAULT clock_timestamp()").format(
+            table
+        ),
+        create_index_stmt,
+        sql.SQL(
+            "UPDATE {} SET updated_at = COALESCE(created_at, clock_timestamp()) "
+            "WHERE updated_at IS NULL"
+        ).format(table),
+    ]
     with conn.cursor() as cur:
-        cur.execute(create_schema_stmt)
-        cur.execute(create_table_stmt)
+        # DDL takes an ACCESS EXCLUSIVE lock even when it changes nothing, so
+        # only run what the catalog says is missing.
+        cur.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            """,
+            (EMBEDDINGS_SCHEMA, EMBEDDINGS_TABLE),
+        )
+        columns = {row[0] for row in cur.fetchall()}
+        if not columns:
+            cur.execute(create_schema_stmt)
+            cur.execute(create_table_stmt)
+            cur.execute(create_index_stmt)
+        elif "updated_at" not in columns:
+            logger.info("Adding updated_at to %s.%s", EMBEDDINGS_SCHEMA, EMBEDDINGS_TABLE)
+            for stmt in upgrade_stmts:
+                cur.execute(stmt)
+        else:
+            return
+    _invalidate_storage_format()
 
 
-def _fetch_pending_paths(conn, limit: int) -> List[str]:
-    query = sql.SQL(
-        """
-        SELECT src.storage_path
-        FROM {}.{} AS src
-        LEFT JOIN {}.{} AS emb
-            ON src.storage_path = emb.storage_path
-        WHERE src.storage_path IS NOT NULL
-          AND emb.storage_path IS NULL
-        LIMIT %s
-        """
-    ).format(
-        sql.Identifier(POSTGRES_SCHEMA),
-        sql.Identifier(POSTGRES_TABLE),
-        sql.Identifier(EMBEDDINGS_SCHEMA),
-        sql.Identifier(EMBEDDINGS_TABLE),
-    )
-    with conn.cursor() as cur:
-        cur.execute(query, (limit,))
-        rows = cur.fetchall()
-    return [row[0] for row in rows]
+def _claim_paths(worker_id: str, limit: int, batch_size: int) -> Iterator[str]:
+    """Lazily lease up to ``limit`` paths; the pipeline's bounded queue paces the claims."""
+    claimed = 0
+    while claimed < limit:
+        with _db_conn() as conn:
+            paths = _work_queue.claim(conn, worker_id, min(batch_size, limit - claimed))
+        if not paths:
+            return
+        claimed += len(paths)
+        yield from paths
+
 
+def _embedding_storage_format(conn) -> str:
+    """Format of the existing column; EMBEDDINGS_STORAGE before the table exists.
 
-def _embedding_column_is_vector(conn) -> bool:
-    query = """
-        SELECT data_type, udt_name
-        FROM information_schema.columns
-        WHERE table_schema = %s
-          AND table_name = %s
-          AND column_name = 'embedding'
+    The information_schema probe is cached until _invalidate_storage_format().
     """
-    with conn.cursor() as cur:
-        cur.execute(query, (EMBEDDINGS_SCHEMA, EMBEDDINGS_TABLE))
-        row = cur.fetchone()
-    if not row:
-        return False
-    data_type, udt_name = row
-    return data_type == "USER-DEFINED" and udt_name == "vector"
+    global _storage_format
 
+    with _storage_format_lock:
+        if _storage_format is None:
+            detected = embedding_storage.detect_format(
+                conn, EMBEDDINGS_SCHEMA, EMBEDDINGS_TABLE
+            )
+            if detected is None:
+                return EMBEDDINGS_STORAGE
+            _storage_format = detected
+        return _storage_format
 
-def _vector_literal(values: List[float]) -> str:
-    return "[" + ",".join(f"{value:.8f}" for value in values) + "]"
 
+def _invalidate_storage_format() -> None:
+    global _storage_format
 
-def _insert_embeddings(conn, rows: List[EmbedResult]) -> int:
+    with _storage_format_lock:
+        _storage_format = None
+
+
+def _insert_embeddings(conn, rows: List[EmbedResult], storage_format: str) -> int:
     if not rows:
         return 0
     insert_stmt = sql.SQL(
@@ -164,15 +348,29 @@ def _insert_embeddings(conn, rows: List[EmbedResult]) -> int:
         VALUES %s
         ON CONFLICT (storage_path)
         DO UPDATE SET embedding = EXCLUDED.embedding,
-                      embedding_dim = EXCLUDED.embedding_dim
+                      embedding_dim = EXCLUDED.embedding_dim,
+                      updated_at = clock_timestamp()
         """
     ).format(
         sql.Identifier(EMBEDDINGS_SCHEMA),
         sql.Identifier(EMBEDDINGS_TABLE),
     )
-    values = [(row.storage_path, row.embedding, row.dim) for row in rows]
-    with conn.cursor() as cur:
-        execute_values(cur, insert_stmt.as_string(cur), values)
+    values = [
+        (
+            row.storage_path,
+            embedding_storage.encode(row.embedding, storage_format),
+            row.dim,
+        )
+        for row in rows
+    ]
+    template = f"(%s, {embedding_storage.value_placeholder(storage_format)}, %s)"
+    try:
+        with conn.cursor() as cur:
+            execute_values(cur, insert_stmt.as_string(cur), values, template=template)
+    except (psycopg2.DataError, psycopg2.ProgrammingError):
+        # The column may have been migrated to another format since it was probed.
+        _invalidate_storage_format()
+        raise
     return len(rows)
 
 
@@ -186,36 +384,389 @@ def _fetch_image_bytes(s3, storage_path: str) -> bytes:
     return obj["Body"].read()
 
 
-def _embed_image(client: httpx.Client, image_bytes: bytes) -> Tuple[List[float], int]:
+def _decode_embeddings(response: httpx.Response) -> np.ndarray:
+    shape = tuple(int(size) for size in response.headers["X-Embedding-Shape"].split(","))
+    return np.frombuffer(response.content, dtype="<f4").reshape(shape)
+
+
+def _embed_image(client: httpx.Client, image_bytes: bytes) -> Tuple[np.ndarray, int]:
     url = f"{EMBEDDER_ENDPOINT}/embedding/image_bytes"
-    response = client.post(url, content=image_bytes)
+    response = client.post(url, content=image_bytes, headers=_BINARY_EMBEDDING_HEADERS)
     response.raise_for_status()
-    payload = response.json()
-    return payload["embedding"], payload["dim"]
+    embedding = _decode_embeddings(response)
+    return embedding, embedding.shape[0]
 
 
-def _embed_text(client: httpx.Client, text: str) -> Tuple[List[float], int]:
+def _pack_length_prefixed(items: List[bytes]) -> bytes:
+    parts = []
+    for item in items:
+        parts.append(struct.pack("<I", len(item)))
+        parts.append(item)
+    return b"".join(parts)
+
+
+def _batch_results(
+    response: httpx.Response,
+) -> List[Union[Tuple[np.ndarray, int], Exception]]:
+    if response.headers.get("content-type", "").startswith("application/json"):
+        # The embedder answers in JSON when any item failed, with its error.
+        body = response.json()
+        errors = {error["index"]: error["error"] for error in body["errors"]}
+        return [
+            ValueError(errors[index])
+            if index in errors
+            else (np.asarray(embedding, dtype=np.float32), body["dim"])
+            for index, embedding in enumerate(body["embeddings"])
+        ]
+    matrix = _decode_embeddings(response)
+    return [(embedding, matrix.shape[1]) for embedding in matrix]
+
+
+def _embed_images(
+    client: httpx.Client, images: List[bytes]
+) -> List[Union[Tuple[np.ndarray, int], Exception]]:
+    url = f"{EMBEDDER_ENDPOINT}/embedding/image_batch"
+    response = client.post(
+        url,
+        content=_pack_length_prefixed(images),
+        headers={"Content-Type": "application/octet-stream", **_BINARY_EMBEDDING_HEADERS},
+    )
+    response.raise_for_status()
+    return _batch_results(response)
+
+
+def _embed_text(client: httpx.Client, text: str) -> Tuple[np.ndarray, int]:
     url = f"{EMBEDDER_ENDPOINT}/embedding/text"
-    response = client.post(url, params={"text": text})
+    response = client.post(url, params={"text": text}, headers=_BINARY_EMBEDDING_HEADERS)
     response.raise_for_status()
-    payload = response.json()
-    return payload["embedding"], payload["dim"]
-
-
-def _cosine_similarity(vec_a: List[float], vec_b: List[float]) -> float:
-    if len(vec_a) != len(vec_b):
-        raise ValueError("Embedding dimensions do not match")
-    dot = 0.0
-    norm_a = 0.0
-    norm_b = 0.0
-    for a, b in zip(vec_a, vec_b):
-        dot += a * b
-        norm_a += a * a
-        norm_b += b * b
-    denom = sqrt(norm_a) * sqrt(norm_b)
-    if denom == 0.0:
-        return 0.0
-    return dot / denom
+    embedding = _decode_embeddings(response)
+    return embedding, embedding.shape[0]
+
+
+def _embed_texts(
+    client: httpx.Client, texts: List[str]
+) -> List[Union[Tuple[np.ndarray, int], Exception]]:
+    url = f"{EMBEDDER_ENDPOINT}/embedding/text_batch"
+    response = client.post(url, json={"texts": texts}, headers=_BINARY_EMBEDDING_HEADERS)
+    response.raise_for_status()
+    return _batch_results(response)
+
+
+def _load_index_rows(conn, index, since=None) -> List[str]:
+    """Upsert rows written since the watermark ``since`` (all rows if None); returns their paths.
+
+    Incremental loads re-read an overlap window behind the watermark (see
+    _refresh_from). Rows already loaded at the same updated_at are excluded
+    in the query, so the overlap costs a list of keys, not re-decoding and
+    re-upserting vectors.
+    """
+    storage_format = _embedding_storage_format(conn)
+    start = _refresh_from(since)
+    params = None
+    where = sql.SQL("")
+    if start is not None:
+        seen = index.recent_rows
+        where = sql.SQL(
+            """
+            WHERE updated_at >= %s
+              AND (storage_path, updated_at) NOT IN (
+                  SELECT * FROM unnest(%s::text[], %s::timestamptz[])
+              )
+            """
+        )
+        params = (start, list(seen), list(seen.values()))
+    query = sql.SQL(
+        """
+        SELECT storage_path, embedding, updated_at
+        FROM {}.{}
+        {}
+        ORDER BY updated_at
+        """
+    ).format(
+        sql.Identifier(EMBEDDINGS_SCHEMA),
+        sql.Identifier(EMBEDDINGS_TABLE),
+        where,
+    )
+    loaded: List[str] = []
+    # A named cursor streams the table instead of materializing it client-side.
+    with conn.cursor(name="avsp_search_index_load") as cur:
+        cur.itersize = MASTER_SERVER_CONFIG.SEARCH_INDEX_LOAD_BATCH
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(MASTER_SERVER_CONFIG.SEARCH_INDEX_LOAD_BATCH)
+            if not rows:
+                break
+            paths = [row[0] for row in rows]
+            index.upsert(
+                paths,
+                embedding_storage.decode_many([row[1] for row in rows], storage_format),
+            )
+            if start is not None:
+                index.recent_rows.update((row[0], row[2]) for row in rows)
+            if rows[-1][2] is not None:
+                index.watermark = max(rows[-1][2], index.watermark or rows[-1][2])
+            loaded.extend(paths)
+    # Keys older than the next overlap window can never be re-read.
+    cutoff = _refresh_from(index.watermark)
+    if cutoff is not None:
+        index.recent_rows = {
+            path: updated_at
+            for path, updated_at in index.recent_rows.items()
+            if updated_at >= cutoff
+        }
+    return loaded
+
+
+def _refresh_from(watermark):
+    """Where an incremental load starts: the watermark minus the overlap window.
+
+    updated_at is taken when a row is written, not when its transaction
+    commits, so rows can commit with timestamps just behind the watermark.
+    Re-reading the overlap catches them; rows the index already holds at
+    the same updated_at are skipped.
+    """
+    if watermark is None:
+        return None
+    return watermark - timedelta(seconds=MASTER_SERVER_CONFIG.SEARCH_INDEX_REFRESH_OVERLAP_SEC)
+
+
+_FRAME_METADATA_COLUMNS = ("dataset_type", "camera_name", "timestamp")
+
+
+def _load_frame_metadata(conn, index, paths: Optional[List[str]] = None) -> int:
+    """Attach frames-table metadata to indexed rows (only ``paths`` if given), for filtered search.
+
+    Columns the frames table does not have (yet) load as NULL; such rows
+    never match a filter on that column.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+            """,
+            (POSTGRES_SCHEMA, POSTGRES_TABLE),
+        )
+        available = {row[0] for row in cur.fetchall()}
+    if "storage_path" not in available:
+        return 0
+
+    columns = [
+        sql.SQL("f.{}").format(sql.Identifier(column)) if column in available else sql.NULL
+        for column in _FRAME_METADATA_COLUMNS
+    ]
+    where = sql.SQL("WHERE e.storage_path = ANY(%s)") if paths is not None else sql.SQL("")
+    query = sql.SQL(
+        """
+        SELECT DISTINCT ON (e.storage_path) e.storage_path, {}, {}, {}::bigint
+        FROM {}.{} e
+        JOIN {}.{} f ON f.storage_path = e.storage_path
+        {}
+        """
+    ).format(
+        *columns,
+        sql.Identifier(EMBEDDINGS_SCHEMA),
+        sql.Identifier(EMBEDDINGS_TABLE),
+        sql.Identifier(POSTGRES_SCHEMA),
+        sql.Identifier(POSTGRES_TABLE),
+        where,
+    )
+    loaded = 0
+    with conn.cursor(name="avsp_search_metadata_load") as cur:
+        cur.itersize = MASTER_SERVER_CONFIG.SEARCH_INDEX_LOAD_BATCH
+        cur.execute(query, (paths,) if paths is not None else None)
+        while True:
+            rows = cur.fetchmany(MASTER_SERVER_CONFIG.SEARCH_INDEX_LOAD_BATCH)
+            if not rows:
+                break
+            index.metadata.update(
+                index.ids_of([row[0] for row in rows]),
+                [row[1] for row in rows],
+                [row[2] for row in rows],
+                [row[3] for row in rows],
+            )
+            loaded += len(rows)
+    return loaded
+
+
+def _use_pq_index() -> bool:
+    index_type = MASTER_SERVER_CONFIG.ANN_INDEX_TYPE
+    if index_type not in ("ivf_flat", "pq"):
+        raise ValueError(f"Unknown ANN_INDEX_TYPE {index_type!r}, expected ivf_flat or pq")
+    return index_type == "pq"
+
+
+def _ann_index_dir() -> str:
+    if _use_pq_index():
+        return MASTER_SERVER_CONFIG.PQ_INDEX_DIR
+    return MASTER_SERVER_CONFIG.ANN_INDEX_DIR
+
+
+def _start_ann_build(exact: ExactSearchIndex) -> None:
+    """Build the ANN index from ``exact`` on a background thread.
+
+    Searches keep scanning ``exact`` until the build swaps the new index in.
+    Called with _search_index_sync_lock held; at most one build runs.
+    """
+    global _ann_build_thread
+
+    if _ann_build_thread is not None and _ann_build_thread.is_alive():
+        return
+    _ann_build_thread = threading.Thread(
+        target=_build_ann_index, args=(exact,), name="ann-index-build", daemon=True
+    )
+    _ann_build_thread.start()
+
+
+def _build_ann_index(exact: ExactSearchIndex) -> None:
+    global _search_index
+
+    started = time.perf_counter()
+    # Taken before the snapshot, so the first refresh after the swap re-reads
+    # every row written or re-embedded while the index was being trained.
+    watermark = exact.watermark
+    matrix, paths = exact.snapshot()
+    size = matrix.shape[0]
+    try:
+        index = _train_ann_index(paths[:size], matrix)
+    except Exception:  # noqa: BLE001
+        logger.exception("ANN index build failed; searches keep the exact scan")
+        return
+    index.watermark = watermark
+    # Rows are added in the exact index's row order, so row ids carry over.
+    index.metadata = exact.metadata
+    index.loaded = True
+
+    with _search_index_sync_lock:
+        if _search_index is not exact:
+            logger.info("ANN index build discarded: the search index was replaced meanwhile")
+            return
+        # Rows the exact index gained during the build, in its row order too.
+        matrix, paths = exact.snapshot()
+        if matrix.shape[0] > size:
+            index.upsert(paths[size:matrix.shape[0]], matrix[size:])
+        _search_index = index
+    logger.info(
+        "ANN index built: rows=%s elapsed=%.2fs", len(index), time.perf_counter() - started
+    )
+    _save_ann_index(index)
+
+
+def _train_ann_index(paths: List[str], matrix: np.ndarray):
+    if _use_pq_index():
+        return PQIndex.build(
+            paths,
+            matrix,
+            subspaces=MASTER_SERVER_CONFIG.PQ_SUBSPACES,
+            candidates=MASTER_SERVER_CONFIG.PQ_RERANK_CANDIDATES,
+            train_sample=MASTER_SERVER_CONFIG.ANN_TRAIN_SAMPLE,
+        )
+    return IVFFlatIndex.build(
+        paths,
+        matrix,
+        nlist=MASTER_SERVER_CONFIG.ANN_NLIST,
+        default_nprobe=MASTER_SERVER_CONFIG.ANN_DEFAULT_NPROBE,
+        train_sample=MASTER_SERVER_CONFIG.ANN_TRAIN_SAMPLE,
+    )
+
+
+def _start_ann_save(index) -> None:
+    """Save ``index`` on a background thread; at most one periodic save runs."""
+    global _ann_save_thread
+
+    if _ann_save_thread is not None and _ann_save_thread.is_alive():
+        return
+    _ann_save_thread = threading.Thread(
+        target=_save_ann_index_logged, args=(index,), name="ann-index-save", daemon=True
+    )
+    _ann_save_thread.start()
+
+
+def _save_ann_index_logged(index) -> None:
+    try:
+        _save_ann_index(index)
+    except Exception:  # noqa: BLE001
+        logger.exception("ANN index save failed")
+
+
+def _save_ann_index(index) -> None:
+    global _ann_index_saved_at
+
+    started = time.perf_counter()
+    directory = _ann_index_dir()
+    with _ann_index_save_lock:
+        index.save(directory)
+        _ann_index_saved_at = time.monotonic()
+    logger.info(
+        "ANN index saved: rows=%s path=%s elapsed=%.2fs",
+        len(index),
+        directory,
+        time.perf_counter() - started,
+    )
+
+
+def _load_search_index(conn):
+    started = time.perf_counter()
+    _ensure_embedding_table(conn)
+    directory = _ann_index_dir()
+    if os.path.exists(os.path.join(directory, "meta.json")):
+        if _use_pq_index():
+            index = PQIndex.load(directory)
+            index.candidates = MASTER_SERVER_CONFIG.PQ_RERANK_CANDIDATES
+        else:
+            index = IVFFlatIndex.load(directory)
+        caught_up = _load_index_rows(conn, index, since=index.watermark)
+        _load_frame_metadata(conn, index)
+        logger.info(
+            "ANN index loaded from disk: rows=%s caught_up=%s elapsed=%.2fs",
+            len(index),
+            len(caught_up),
+            time.perf_counter() - started,
+        )
+        return index
+
+    index = ExactSearchIndex()
+    loaded = _load_index_rows(conn, index)
+    _load_frame_metadata(conn, index)
+    index.loaded = True
+    logger.info(
+        "Search index loaded: rows=%s elapsed=%.2fs",
+        len(loaded),
+        time.perf_counter() - started,
+    )
+    if len(index) >= MASTER_SERVER_CONFIG.ANN_MIN_ROWS:
+        _start_ann_build(index)
+    return index
+
+
+def _sync_search_index(conn) -> None:
+    global _search_index, _search_index_synced_at
+
+    now = time.monotonic()
+    if (
+        _search_index.loaded
+        and now - _search_index_synced_at < MASTER_SERVER_CONFIG.SEARCH_INDEX_REFRESH_SEC
+    ):
+        return
+    with _search_index_sync_lock:
+        if not _search_index.loaded:
+            _search_index = _load_search_index(conn)
+        elif now - _search_index_synced_at >= MASTER_SERVER_CONFIG.SEARCH_INDEX_REFRESH_SEC:
+            loaded = _load_index_rows(conn, _search_index, since=_search_index.watermark)
+            if loaded:
+                _load_frame_metadata(conn, _search_index, paths=loaded)
+                logger.info("Search index refreshed: new_rows=%s", len(loaded))
+            if (
+                isinstance(_search_index, ExactSearchIndex)
+                and len(_search_index) >= MASTER_SERVER_CONFIG.ANN_MIN_ROWS
+            ):
+                _start_ann_build(_search_index)
+            elif (
+                isinstance(_search_index, _ANN_INDEXES)
+                and now - _ann_index_saved_at >= MASTER_SERVER_CONFIG.ANN_SAVE_INTERVAL_SEC
+            ):
+                _start_ann_save(_search_index)
+        _search_index_synced_at = time.monotonic()
 
 
 @app.get("/health")
@@ -223,137 +774,494 @@ def healthcheck():
     return {"status": "ok"}
 
 
-@app.post("/embeddings/backfill")
-def backfill_embeddings(payload: BackfillRequest):
-    total_seen = 0
-    total_inserted = 0
-    errors = []
+def _renew_leases(worker_id: str, stop: threading.Event) -> None:
+    """Keep a running job's leases alive, renewing three times per lease period."""
+    while not stop.wait(_work_queue.lease_sec / 3):
+        try:
+            with _db_conn() as conn:
+                renewed = _work_queue.renew(conn, worker_id)
+            logger.debug("Renewed %s leases for %s", renewed, worker_id)
+        except Exception:  # noqa: BLE001
+            logger.exception("Lease renewal failed for %s", worker_id)
 
+
+def _run_backfill(job: BackfillJob) -> PipelineStats:
+    payload = BackfillRequest(**job.params)
+    config = PipelineConfig(
+        fetch_workers=payload.fetch_workers or MASTER_SERVER_CONFIG.BACKFILL_FETCH_WORKERS,
+        embed_workers=payload.embed_workers or MASTER_SERVER_CONFIG.BACKFILL_EMBED_WORKERS,
+        batch_size=payload.batch_size,
+        queue_size=payload.queue_size or MASTER_SERVER_CONFIG.BACKFILL_QUEUE_SIZE,
+        stop_on_error=payload.stop_on_error,
+        dry_run=payload.dry_run,
+    )
     logger.info(
-        "Backfill started: limit=%s batch_size=%s dry_run=%s",
+        "Backfill started: job_id=%s limit=%s batch_size=%s fetch_workers=%s "
+        "embed_workers=%s dry_run=%s",
+        job.job_id,
         payload.limit,
-        payload.batch_size,
+        config.batch_size,
+        config.fetch_workers,
+        config.embed_workers,
         payload.dry_run,
     )
-    s3 = _s3_client()
-    timeout = httpx.Timeout(EMBEDDER_TIMEOUT_SEC)
+    s3 = app.state.s3
+    client = app.state.embedder
 
     with _db_conn() as conn:
         _ensure_embedding_table(conn)
-        with httpx.Client(timeout=timeout) as client:
-            while total_seen < payload.limit:
-                batch_limit = min(payload.batch_size, payload.limit - total_seen)
-                paths = _fetch_pending_paths(conn, batch_limit)
-                if not paths:
-                    logger.info("Backfill complete: no more pending rows.")
-                    break
-
-                logger.info(
-                    "Processing batch: size=%s seen=%s inserted=%s errors=%s",
-                    len(paths),
-                    total_seen,
-                    total_inserted,
-                    len(errors),
+        storage_format = _embedding_storage_format(conn)
+        _work_queue.ensure(conn)
+        if payload.seed_queue:
+            logger.info("Work queue seeded: new_paths=%s", _work_queue.seed(conn))
+        conn.commit()
+        worker_id = f"{socket.gethostname()}:{os.getpid()}:{job.job_id[:8]}"
+
+        def insert(rows) -> int:
+            results = [
+                EmbedResult(storage_path=path, embedding=embedding, dim=dim)
+                for path, embedding, dim in rows
+            ]
+            try:
+                inserted = _insert_embeddings(conn, results, storage_format)
+                _work_queue.complete(conn, [row.storage_path for row in results])
+                conn.commit()
+            except Exception:
+                # The connection is shared by the whole job: leave it usable
+                # so only this batch is recorded as failed.
+                conn.rollback()
+                raise
+            if _search_index.loaded:
+                _search_index.upsert(
+                    [row.storage_path for row in results],
+                    [row.embedding for row in results],
                 )
-                total_seen += len(paths)
-                rows: List[EmbedResult] = []
-
-                for storage_path in paths:
-                    try:
-                        image_bytes = _fetch_image_bytes(s3, storage_path)
-                        embedding, dim = _embed_image(client, image_bytes)
-                        rows.append(
-                            EmbedResult(
-                                storage_path=storage_path,
-                                embedding=embedding,
-                                dim=dim,
-                            )
-                        )
-                    except Exception as exc:  # noqa: BLE001
-                        logger.exception("Failed for %s", storage_path)
-                        errors.append(
-                            {"storage_path": storage_path, "error": str(exc)}
-                        )
-                        if payload.stop_on_error:
-                            break
-
-                if rows and not payload.dry_run:
-                    total_inserted += _insert_embeddings(conn, rows)
-                    logger.info(
-                        "Batch inserted: count=%s total_inserted=%s",
-                        len(rows),
-                        total_inserted,
-                    )
-
-                if payload.stop_on_error and errors:
-                    break
+            return inserted
+
+        def fail(errors) -> None:
+            # Runs on the insert thread, like insert, so the connection is not shared.
+            try:
+                _work_queue.fail(conn, worker_id, errors)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        pipeline = BackfillPipeline(
+            fetch=lambda storage_path: _fetch_image_bytes(s3, storage_path),
+            embed=lambda images: _embed_images(client, images),
+            insert=insert,
+            fail=fail,
+            config=config,
+        )
+        job.attach(pipeline)
+        renewer_stop = threading.Event()
+        renewer = threading.Thread(
+            target=_renew_leases, args=(worker_id, renewer_stop), daemon=True
+        )
+        renewer.start()
+        try:
+            stats = pipeline.run(
+                _claim_paths(worker_id, payload.limit, config.batch_size)
+            )
+        finally:
+            renewer_stop.set()
+            renewer.join()
+            # Cancelled or not, unfinished paths go back to the queue, which
+            # is what lets a resumed job pick up exactly where this one stopped.
+            conn.rollback()
+            _work_queue.fail(conn, worker_id, pipeline.unreported_errors())
+            released = _work_queue.release(conn, worker_id)
+            conn.commit()
+        if released:
+            logger.info("Released %s unprocessed leases", released)
 
     logger.info(
-        "Backfill finished: total_seen=%s total_inserted=%s errors=%s",
-        total_seen,
-        total_inserted,
-        len(errors),
+        "Backfill finished: job_id=%s total_seen=%s total_inserted=%s errors=%s",
+        job.job_id,
+        stats.total_seen,
+        stats.total_inserted,
+        len(stats.errors),
     )
-    return {
-        "total_seen": total_seen,
-        "total_inserted": total_inserted,
-        "errors": errors[:50],
-    }
+    return stats
+
+
+_backfill_jobs = BackfillJobManager(
+    runner=_run_backfill,
+    max_running=MASTER_SERVER_CONFIG.BACKFILL_MAX_RUNNING_JOBS,
+)
+
+
+def _job_progress(job: BackfillJob):
+    remaining = None
+    if job.status in ("running", "queued"):
+        with _db_conn() as conn:
+            counts = _work_queue.counts(conn)
+        remaining = counts.get("pending", 0) + counts.get("expired", 0) + counts.get("leased", 0)
+    return job.progress(remaining)
+
+
+def _get_job(job_id: str) -> BackfillJob:
+    job = _backfill_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown backfill job {job_id}")
+    return job
+
+
+@app.post("/embeddings/backfill", status_code=202)
+def backfill_embeddings(payload: BackfillRequest):
+    job = _backfill_jobs.submit(payload.model_dump())
+    return {"job_id": job.job_id, "status": job.status}
+
+
+@app.get("/embeddings/backfill")
+def list_backfill_jobs():
+    return [
+        {"job_id": job.job_id, "status": job.status, "created_at": job.created_at}
+        for job in _backfill_jobs.list()
+    ]
+
+
+@app.get("/embeddings/backfill/{job_id}")
+def backfill_job_status(job_id: str):
+    return _job_progress(_get_job(job_id))
+
+
+@app.post("/embeddings/backfill/{job_id}/cancel")
+def cancel_backfill_job(job_id: str):
+    _get_job(job_id)
+    job = _backfill_jobs.cancel(job_id)
+    return {"job_id": job.job_id, "status": job.status}
+
+
+@app.post("/embeddings/backfill/{job_id}/resume", status_code=202)
+def resume_backfill_job(job_id: str):
+    """Start a new job for the part of ``limit`` the stopped one did not reach."""
+    job = _get_job(job_id)
+    if job.status in ACTIVE_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Backfill job {job_id} is {job.status}")
+    remaining = job.params["limit"] - job.stats().total_seen
+    if remaining <= 0:
+        raise HTTPException(status_code=409, detail=f"Backfill job {job_id} reached its limit")
+    # The queue was already seeded, and done paths are never claimed again.
+    params = {**job.params, "limit": remaining, "seed_queue": False}
+    resumed = _backfill_jobs.submit(params, resumed_from=job.job_id)
+    return {"job_id": resumed.job_id, "status": resumed.status, "resumed_from": job.job_id}
+
+
+@app.get("/embeddings/queue")
+def embedding_queue_status():
+    with _db_conn() as conn:
+        _work_queue.ensure(conn)
+        return _work_queue.counts(conn)
+
+
+@app.post("/embeddings/schema/refresh")
+def refresh_embedding_schema():
+    """Re-probe the embedding column, e.g. after backend.db.embedding_storage ran."""
+    _invalidate_storage_format()
+    with _db_conn() as conn:
+        return {"storage_format": _embedding_storage_format(conn)}
+
+
+@app.get("/search/cache/stats")
+def query_cache_stats():
+    return _query_cache.stats()
+
+
+def _frame_filter_sql(search_filter: SearchFilter):
+    """``WHERE`` clause restricting embedding rows to frames matching the filter."""
+    if not search_filter.active:
+        return sql.SQL(""), []
+    conditions = []
+    params: list = []
+    for column in ("dataset_type", "camera_name"):
+        values = getattr(search_filter, column)
+        if values:
+            conditions.append(sql.SQL("f.{} = ANY(%s)").format(sql.Identifier(column)))
+            params.append(list(values))
+    if search_filter.timestamp_from is not None:
+        conditions.append(sql.SQL("f.{} >= %s").format(sql.Identifier("timestamp")))
+        params.append(search_filter.timestamp_from)
+    if search_filter.timestamp_to is not None:
+        conditions.append(sql.SQL("f.{} <= %s").format(sql.Identifier("timestamp")))
+        params.append(search_filter.timestamp_to)
+    clause = sql.SQL("WHERE storage_path IN (SELECT f.storage_path FROM {}.{} f WHERE {})").format(
+        sql.Identifier(POSTGRES_SCHEMA),
+        sql.Identifier(POSTGRES_TABLE),
+        sql.SQL(" AND ").join(conditions),
+    )
+    return clause, params
+
+
+def _search_vector_distance(
+    conn, query_embedding, top_k: int, search_filter: SearchFilter, storage_format: str
+):
+    vector_value = embedding_storage.vector_literal(query_embedding)
+    where, params = _frame_filter_sql(search_filter)
+    query = sql.SQL(
+        """
+        SELECT storage_path, embedding <-> %s::{} AS distance
+        FROM {}.{}
+        {}
+        ORDER BY embedding <-> %s::{}
+        LIMIT %s
+        """
+    ).format(
+        sql.SQL(storage_format),
+        sql.Identifier(EMBEDDINGS_SCHEMA),
+        sql.Identifier(EMBEDDINGS_TABLE),
+        where,
+        sql.SQL(storage_format),
+    )
+    with conn.cursor() as cur:
+        cur.execute(query, (vector_value, *params, vector_value, top_k))
+        rows = cur.fetchall()
+    results = [
+        {"storage_path": row[0], "distance": row[1]} for row in rows
+    ]
+    return {"mode": "vector_distance", "results": results}
+
+
+def _search_in_memory(
+    index,
+    query_embeddings,
+    top_k: int,
+    search_filter: SearchFilter,
+    nprobe: Optional[int] = None,
+    exact: bool = False,
+):
+    """Score queries (one per row) against the in-memory index, applying metadata filters.
+
+    A filter is resolved to the sorted row ids it matches from the posting
+    lists first. Narrow filters score only those rows (pre-filter); broad
+    ones scan as usual and drop the rest (post-filter), with IVF probing
+    proportionally more lists so top_k still fills. Returns the hits of
+    every query and the response fields describing the search.
+    """
+    rows = index.metadata.select(search_filter)
+    total = len(index)
+    is_ivf = isinstance(index, IVFFlatIndex)
+    is_pq = isinstance(index, PQIndex)
+    mode = "ivf_flat" if is_ivf else "pq" if is_pq else "python_cosine"
+    info = {"mode": mode, "evaluated_rows": total}
+    prefilter = False
+    if is_ivf:
+        nprobe = min(index.nlist if exact else (nprobe or index.default_nprobe), index.nlist)
+    if rows is not None:
+        scanned_fraction = nprobe / index.nlist if is_ivf else 1.0
+        prefilter = prefer_prefilter(len(rows), total, scanned_fraction)
+        if is_ivf and not prefilter and len(rows):
+            nprobe = min(index.nlist, int(np.ceil(nprobe * total / len(rows))))
+        if prefilter:
+            info["evaluated_rows"] = len(rows)
+        info["filter"] = {
+            "matched_rows": len(rows),
+            "strategy": "prefilter" if prefilter else "postfilter",
+        }
+
+    if is_ivf:
+        info["nprobe"] = nprobe
+        hits = index.search_many(
+            query_embeddings, top_k, nprobe=nprobe, rows=rows, prefilter=prefilter
+        )
+    elif is_pq:
+        hits = index.search_many(query_embeddings, top_k, rows=rows, prefilter=prefilter)
+        info["reranked_candidates"] = max(top_k, index.candidates)
+        hits = _rerank_hits(query_embeddings, hits, top_k)
+    else:
+        hits = index.search_many(
+            query_embeddings,
+            top_k,
+            rows=rows,
+            prefilter=prefilter,
+            max_scores=MASTER_SERVER_CONFIG.SEARCH_BATCH_MAX_SCORE_MB * 1024 * 1024 // 4,
+        )
+    return hits, info
+
+
+def _rerank_hits(query_embeddings, hits, top_k: int):
+    """Exact scores for PQ shortlists, from the full-precision vectors in Postgres."""
+    paths = sorted({path for query_hits in hits for path, _ in query_hits})
+    vectors = {}
+    batch_size = MASTER_SERVER_CONFIG.SEARCH_INDEX_LOAD_BATCH
+    with _db_conn() as conn:
+        storage_format = _embedding_storage_format(conn)
+        for start in range(0, len(paths), batch_size):
+            vectors.update(
+                _stored_embeddings(conn, paths[start:start + batch_size], storage_format)
+            )
+    return rerank(query_embeddings, hits, vectors, top_k)
+
+
+def _similarity_results(scored) -> List[dict]:
+    return [
+        {"storage_path": storage_path, "similarity": score}
+        for storage_path, score in scored
+    ]
+
+
+def _stored_embeddings(conn, paths: List[str], storage_format: str) -> dict:
+    """Embeddings already in the table, by storage_path; unknown paths are missing."""
+    query = sql.SQL(
+        "SELECT storage_path, embedding FROM {}.{} WHERE storage_path = ANY(%s)"
+    ).format(
+        sql.Identifier(EMBEDDINGS_SCHEMA),
+        sql.Identifier(EMBEDDINGS_TABLE),
+    )
+    with conn.cursor() as cur:
+        cur.execute(query, (list(paths),))
+        rows = cur.fetchall()
+    if not rows:
+        return {}
+    vectors = embedding_storage.decode_many([row[1] for row in rows], storage_format)
+    return {row[0]: vector for row, vector in zip(rows, vectors)}
+
+
+def _query_embeddings(texts: List[str]) -> List[Union[np.ndarray, Exception]]:
+    """Embeddings of query texts: cached ones, the rest in one batched embedder call."""
+    embeddings = [_query_cache.get(text) for text in texts]
+    missing = sorted({text for text, embedding in zip(texts, embeddings) if embedding is None})
+    if not missing:
+        return embeddings
+    embedded = {}
+    for text, result in zip(missing, _embed_texts(app.state.embedder, missing)):
+        if isinstance(result, Exception):
+            embedded[text] = result
+        else:
+            embedded[text] = result[0]
+            _query_cache.put(text, result[0])
+    return [
+        embedded[text] if embedding is None else embedding
+        for text, embedding in zip(texts, embeddings)
+    ]
 
 
 @app.post("/search/text")
 def search_text(payload: TextSearchRequest):
-    timeout = httpx.Timeout(EMBEDDER_TIMEOUT_SEC)
-    with httpx.Client(timeout=timeout) as client:
-        query_embedding, _ = _embed_text(client, payload.query)
+    query_embedding = _query_cache.get(payload.query)
+    if query_embedding is None:
+        query_embedding, _ = _embed_text(app.state.embedder, payload.query)
+        _query_cache.put(payload.query, query_embedding)
+    search_filter = payload.search_filter()
 
     with _db_conn() as conn:
-        if _embedding_column_is_vector(conn):
-            vector_value = _vector_literal(query_embedding)
-            query = sql.SQL(
-                """
-                SELECT storage_path, embedding <-> %s::vector AS distance
-                FROM {}.{}
-                ORDER BY embedding <-> %s::vector
-                LIMIT %s
-                """
-            ).format(
-                sql.Identifier(EMBEDDINGS_SCHEMA),
-                sql.Identifier(EMBEDDINGS_TABLE),
+        storage_format = _embedding_storage_format(conn)
+        if storage_format in embedding_storage.PGVECTOR_FORMATS:
+            return _search_vector_distance(
+                conn, query_embedding, payload.top_k, search_filter, storage_format
             )
-            with conn.cursor() as cur:
-                cur.execute(query, (vector_value, vector_value, payload.top_k))
-                rows = cur.fetchall()
-            results = [
-                {"storage_path": row[0], "distance": row[1]} for row in rows
-            ]
-            return {"mode": "vector_distance", "results": results}
+        _sync_search_index(conn)
 
-        query = sql.SQL(
-            """
-            SELECT storage_path, embedding
-            FROM {}.{}
-            LIMIT %s
-            """
-        ).format(
-            sql.Identifier(EMBEDDINGS_SCHEMA),
-            sql.Identifier(EMBEDDINGS_TABLE),
+    (scored,), info = _search_in_memory(
+        _search_index,
+        query_embedding,
+        payload.top_k,
+        search_filter,
+        nprobe=payload.nprobe,
+        exact=payload.exact,
+    )
+    return {**info, "results": _similarity_results(scored)}
+
+
+@app.post("/search/similar")
+def search_similar(payload: SimilarSearchRequest):
+    """Frames like an already embedded one; reuses its stored vector, no embedder call."""
+    search_filter = payload.search_filter()
+    # One extra hit, since the frame itself is normally the best match.
+    top_k = payload.top_k + int(payload.exclude_self)
+
+    with _db_conn() as conn:
+        storage_format = _embedding_storage_format(conn)
+        embedding = _stored_embeddings(conn, [payload.storage_path], storage_format).get(
+            payload.storage_path
         )
-        with conn.cursor() as cur:
-            cur.execute(query, (payload.max_rows,))
-            rows = cur.fetchall()
-
-    scored = []
-    for storage_path, embedding in rows:
-        similarity = _cosine_similarity(query_embedding, embedding)
-        scored.append((storage_path, similarity))
-    scored.sort(key=lambda item: item[1], reverse=True)
-    results = [
-        {"storage_path": storage_path, "similarity": score}
-        for storage_path, score in scored[: payload.top_k]
+        if embedding is None:
+            raise HTTPException(
+                status_code=404, detail=f"No embedding for {payload.storage_path}"
+            )
+        if storage_format in embedding_storage.PGVECTOR_FORMATS:
+            response = _search_vector_distance(
+                conn, embedding, top_k, search_filter, storage_format
+            )
+        else:
+            _sync_search_index(conn)
+            response = None
+
+    if response is None:
+        (scored,), info = _search_in_memory(
+            _search_index,
+            embedding,
+            top_k,
+            search_filter,
+            nprobe=payload.nprobe,
+            exact=payload.exact,
+        )
+        response = {**info, "results": _similarity_results(scored)}
+    if payload.exclude_self:
+        results = [r for r in response["results"] if r["storage_path"] != payload.storage_path]
+        response["results"] = results[: payload.top_k]
+    return {"storage_path": payload.storage_path, **response}
+
+
+@app.post("/search/batch")
+def search_batch(payload: BatchSearchRequest):
+    """Many text and/or example queries, embedded in one call and scored together.
+
+    Every query gets its own ``results``; a query whose text could not be
+    embedded or whose path has no embedding gets an ``error`` instead.
+    """
+    queries = [{"query": text} for text in payload.queries] + [
+        {"storage_path": path} for path in payload.storage_paths
     ]
-    return {
-        "mode": "python_cosine",
-        "results": results,
-        "evaluated_rows": len(rows),
-    }
+    if not queries:
+        raise HTTPException(status_code=400, detail="No queries in request")
+    if len(queries) > MASTER_SERVER_CONFIG.SEARCH_BATCH_MAX_QUERIES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MASTER_SERVER_CONFIG.SEARCH_BATCH_MAX_QUERIES} queries per batch",
+        )
+    search_filter = payload.search_filter()
+    embeddings: List[Union[np.ndarray, Exception]] = (
+        _query_embeddings(payload.queries) if payload.queries else []
+    )
+
+    with _db_conn() as conn:
+        storage_format = _embedding_storage_format(conn)
+        if payload.storage_paths:
+            stored = _stored_embeddings(conn, payload.storage_paths, storage_format)
+            embeddings += [
+                stored.get(path, LookupError(f"No embedding for {path}"))
+                for path in payload.storage_paths
+            ]
+        valid = [
+            i for i, embedding in enumerate(embeddings) if not isinstance(embedding, Exception)
+        ]
+
+        if storage_format in embedding_storage.PGVECTOR_FORMATS:
+            info = {"mode": "vector_distance"}
+            for i in valid:
+                queries[i]["results"] = _search_vector_distance(
+                    conn, embeddings[i], payload.top_k, search_filter, storage_format
+                )["results"]
+        else:
+            _sync_search_index(conn)
+            info = None
+
+    if info is None:
+        info = {}
+        if valid:
+            hits, info = _search_in_memory(
+                _search_index,
+                np.stack([embeddings[i] for i in valid]),
+                payload.top_k,
+                search_filter,
+                nprobe=payload.nprobe,
+                exact=payload.exact,
+            )
+            for i, scored in zip(valid, hits):
+                queries[i]["results"] = _similarity_results(scored)
+    for i, embedding in enumerate(embeddings):
+        if isinstance(embedding, Exception):
+            queries[i]["error"] = str(embedding)
+    return {**info, "count": len(queries), "queries": queries}
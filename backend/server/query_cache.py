@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+
+class QueryEmbeddingCache:
+    """LRU + TTL cache of text-query embeddings.
+
+    Keys are the normalized query text plus the embedder model id, so a model
+    change never serves stale vectors. With ``path`` set, entries are also
+    kept in a SQLite file that survives restarts and is shared by all uvicorn
+    workers on the host; the in-process LRU stays in front of it.
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        max_entries: int = 10000,
+        ttl_sec: float = 3600.0,
+        path: Optional[str] = None,
+    ):
+        self.model_id = model_id
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self._entries: "OrderedDict[str, Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            "hits": 0,
+            "shared_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+        }
+        self._shared: Optional[sqlite3.Connection] = None
+        self._shared_puts = 0
+        if path:
+            self._shared = sqlite3.connect(path, check_same_thread=False, timeout=5.0)
+            self._shared.execute("PRAGMA journal_mode=WAL")
+            self._shared.execute(
+                """
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    key TEXT PRIMARY KEY,
+                    expires_at REAL NOT NULL,
+                    embedding BLOB NOT NULL
+                )
+                """
+            )
+            self._shared.commit()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return " ".join(text.casefold().split())
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_id}\x00{self.normalize(text)}"
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        key = self._key(text)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, embedding = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return embedding
+                del self._entries[key]
+                self._counters["expirations"] += 1
+
+            embedding = self._shared_get(key, now)
+            if embedding is not None:
+                self._counters["shared_hits"] += 1
+                self._store(key, embedding, now)
+                return embedding
+            self._counters["misses"] += 1
+            return None
+
+    def put(self, text: str, embedding) -> None:
+        key = self._key(text)
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        now = time.time()
+        with self._lock:
+            self._store(key, embedding, now)
+            self._shared_put(key, embedding, now)
+
+    def _store(self, key: str, embedding: np.ndarray, now: float) -> None:
+        self._entries[key] = (now + self.ttl_sec, embedding)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _shared_get(self, key: str, now: float) -> Optional[np.ndarray]:
+        if self._shared is None:
+            return None
+        row = self._shared.execute(
+            "SELECT embedding FROM query_embeddings WHERE key = ? AND expires_at > ?",
+            (key, now),
+        ).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype="<f4")
+
+    def _shared_put(self, key: str, embedding: np.ndarray, now: float) -> None:
+        if self._shared is None:
+            return
+        self._shared.execute(
+            "INSERT OR REPLACE INTO query_embeddings (key, expires_at, embedding) VALUES (?, ?, ?)",
+            (key, now + self.ttl_sec, embedding.astype("<f4").tobytes()),
+        )
+        self._shared_puts += 1
+        # Trimming is amortized over many writes instead of paid on each one.
+        if self._shared_puts % 100 == 0:
+            self._shared.execute("DELETE FROM query_embeddings WHERE expires_at <= ?", (now,))
+            self._shared.execute(
+                """
+                DELETE FROM query_embeddings WHERE key IN (
+                    SELECT key FROM query_embeddings
+                    ORDER BY expires_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+        self._shared.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            counters = dict(self._counters)
+            size = len(self._entries)
+        lookups = counters["hits"] + counters["shared_hits"] + counters["misses"]
+        return {
+            **counters,
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_sec": self.ttl_sec,
+            "shared": self._shared is not None,
+            "hit_rate": (counters["hits"] + counters["shared_hits"]) / lookups if lookups else 0.0,
+        }
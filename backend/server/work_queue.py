@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+from typing import Dict, Iterable, List
+
+from psycopg2 import sql
+
+
+class EmbeddingWorkQueue:
+    """Postgres-backed queue of storage paths waiting to be embedded.
+
+    Workers claim batches with ``FOR UPDATE SKIP LOCKED`` and hold a lease on
+    them, so any number of backfill workers on any number of nodes drain the
+    queue without embedding a path twice. Running workers ``renew`` their
+    leases; a lease that expires (worker crash) makes its paths claimable again.
+
+    Row states: pending -> leased -> done, or back to pending on failure until
+    ``max_attempts`` is reached, then failed.
+    """
+
+    def __init__(
+        self,
+        schema: str,
+        table: str,
+        frames_schema: str,
+        frames_table: str,
+        embeddings_schema: str,
+        embeddings_table: str,
+        lease_sec: int = 600,
+        max_attempts: int = 3,
+    ):
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self._ident = {
+            "queue": sql.SQL("{}.{}").format(sql.Identifier(schema), sql.Identifier(table)),
+            "schema": sql.Identifier(schema),
+            "claim_index": sql.Identifier(f"{table}_claimable_idx"),
+            "frames": sql.SQL("{}.{}").format(
+                sql.Identifier(frames_schema), sql.Identifier(frames_table)
+            ),
+            "embeddings": sql.SQL("{}.{}").format(
+                sql.Identifier(embeddings_schema), sql.Identifier(embeddings_table)
+            ),
+        }
+
+    def ensure(self, conn) -> None:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("CREATE SCHEMA IF NOT EXISTS {schema}").format(**self._ident))
+            cur.execute(
+                sql.SQL(
+                    """
+                    CREATE TABLE IF NOT EXISTS {queue} (
+                        storage_path TEXT PRIMARY KEY,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        lease_owner TEXT,
+                        lease_expires_at TIMESTAMPTZ,
+                        attempts INT NOT NULL DEFAULT 0,
+                        last_error TEXT,
+                        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                    """
+                ).format(**self._ident)
+            )
+            # Only claimable rows are indexed, so claims stay cheap as done rows pile up.
+            cur.execute(
+                sql.SQL(
+                    """
+                    CREATE INDEX IF NOT EXISTS {claim_index}
+                    ON {queue} (status, lease_expires_at)
+                    WHERE status IN ('pending', 'leased')
+                    """
+                ).format(**self._ident)
+            )
+
+    def seed(self, conn) -> int:
+        """Enqueue frames that have no embedding yet; run once per job, not per batch."""
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    INSERT INTO {queue} (storage_path)
+                    SELECT src.storage_path
+                    FROM {frames} AS src
+                    WHERE src.storage_path IS NOT NULL
+                      AND NOT EXISTS (
+                          SELECT 1 FROM {embeddings} AS emb
+                          WHERE emb.storage_path = src.storage_path
+                      )
+                    ON CONFLICT (storage_path) DO NOTHING
+                    """
+                ).format(**self._ident)
+            )
+            return cur.rowcount
+
+    def claim(self, conn, worker_id: str, limit: int) -> List[str]:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    UPDATE {queue} AS q
+                    SET status = 'leased',
+                        lease_owner = %s,
+                        lease_expires_at = now() + make_interval(secs => %s),
+                        attempts = q.attempts + 1,
+                        updated_at = now()
+                    WHERE q.storage_path IN (
+                        SELECT storage_path
+                        FROM {queue}
+                        WHERE status = 'pending'
+                           OR (status = 'leased' AND lease_expires_at < now())
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING q.storage_path
+                    """
+                ).format(**self._ident),
+                (worker_id, self.lease_sec, limit),
+            )
+            return [row[0] for row in cur.fetchall()]
+
+    def renew(self, conn, worker_id: str) -> int:
+        """Push back the expiry of every lease ``worker_id`` still holds.
+
+        Paths can wait in a worker's pipeline queues for longer than one
+        lease; a worker renews while it runs so they are not reclaimed and
+        embedded twice. Leases already taken over by another worker stay theirs.
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    UPDATE {queue}
+                    SET lease_expires_at = now() + make_interval(secs => %s),
+                        updated_at = now()
+                    WHERE status = 'leased' AND lease_owner = %s
+                    """
+                ).format(**self._ident),
+                (self.lease_sec, worker_id),
+            )
+            return cur.rowcount
+
+    def complete(self, conn, paths: Iterable[str]) -> None:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    UPDATE {queue}
+                    SET status = 'done', lease_owner = NULL, lease_expires_at = NULL,
+                        last_error = NULL, updated_at = now()
+                    WHERE storage_path = ANY(%s)
+                    """
+                ).format(**self._ident),
+                (list(paths),),
+            )
+
+    def fail(self, conn, worker_id: str, errors: Dict[str, str]) -> None:
+        if not errors:
+            return
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    UPDATE {queue} AS q
+                    SET status = CASE WHEN q.attempts >= %s THEN 'failed' ELSE 'pending' END,
+                        lease_owner = NULL, lease_expires_at = NULL,
+                        last_error = v.error, updated_at = now()
+                    FROM unnest(%s::text[], %s::text[]) AS v(storage_path, error)
+                    WHERE q.storage_path = v.storage_path
+                      AND q.lease_owner = %s
+                    """
+                ).format(**self._ident),
+                (self.max_attempts, list(errors), list(errors.values()), worker_id),
+            )
+
+    def release(self, conn, worker_id: str) -> int:
+        """Return paths still leased by ``worker_id`` to the queue, without an attempt."""
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    UPDATE {queue}
+                    SET status = 'pending', lease_owner = NULL, lease_expires_at = NULL,
+                        attempts = GREATEST(attempts - 1, 0), updated_at = now()
+                    WHERE status = 'leased' AND lease_owner = %s
+                    """
+                ).format(**self._ident),
+                (worker_id,),
+            )
+            return cur.rowcount
+
+    def counts(self, conn) -> Dict[str, int]:
+        with conn.cursor() as cur:
+            cur.execute(
+                sql.SQL(
+                    """
+                    SELECT CASE
+                               WHEN status = 'leased' AND lease_expires_at < now() THEN 'expired'
+                               ELSE status
+                           END,
+                           count(*)
+                    FROM {queue}
+                    GROUP BY 1
+                    """
+                ).format(**self._ident)
+            )
+            return {status: count for status, count in cur.fetchall()}
+
@@ -27,5 +27,11 @@ POSTGRES_TABLE = os.getenv("POSTGRES_TABLE", "frames")
 # Embeddings configuration
 EMBEDDER_ENDPOINT = os.getenv("EMBEDDER_ENDPOINT", "http://embedder:8000")
 EMBEDDER_TIMEOUT_SEC = int(os.getenv("EMBEDDER_TIMEOUT_SEC", "30"))
+# Identifies the embedding model; part of every query-cache key.
+EMBEDDER_MODEL_ID = os.getenv("EMBEDDER_MODEL_ID", "kakaobrain/align-base")
 EMBEDDINGS_SCHEMA = os.getenv("EMBEDDINGS_SCHEMA", POSTGRES_SCHEMA)
 EMBEDDINGS_TABLE = os.getenv("EMBEDDINGS_TABLE", "image_embeddings")
+EMBEDDINGS_QUEUE_TABLE = os.getenv("EMBEDDINGS_QUEUE_TABLE", "embedding_queue")
+# Embedding column format for new tables: float8, float4, bytea, vector, halfvec.
+# Convert an existing table with `python -m backend.db.embedding_storage --to <format>`.
+EMBEDDINGS_STORAGE = os.getenv("EMBEDDINGS_STORAGE", "float4")
@@ -1,6 +1,48 @@
 from types import SimpleNamespace
 
 MASTER_SERVER_CONFIG = SimpleNamespace(
+    DB_POOL_MIN=1,                   # Postgres connections opened at startup
+    DB_POOL_MAX=16,                  # Upper bound on concurrent Postgres connections
+    EMBEDDER_MAX_CONNECTIONS=32,     # Keep-alive connections to the embedder
+    SEARCH_INDEX_LOAD_BATCH=10000,   # Rows fetched per round trip when loading the search index
+    SEARCH_INDEX_REFRESH_SEC=30,     # How often a search pulls rows added by other processes
+    SEARCH_INDEX_REFRESH_OVERLAP_SEC=300,  # Re-read behind the watermark; > longest write transaction
+    ANN_INDEX_DIR="/app/data/index/ivf_flat",  # Where the IVF-Flat index is persisted
+    ANN_MIN_ROWS=1_000_000,          # Switch from exact scan to IVF-Flat at this corpus size
+    ANN_NLIST=None,                  # Number of IVF lists. None: about 4 * sqrt(rows)
+    ANN_DEFAULT_NPROBE=16,           # Lists scanned per query unless the request overrides it
+    ANN_TRAIN_SAMPLE=100_000,        # Vectors used to train the IVF centroids
+    ANN_SAVE_INTERVAL_SEC=3600,      # How often incremental ANN updates are flushed to disk
+    ANN_INDEX_TYPE="ivf_flat",       # ivf_flat: float32 vectors in memory; pq: 1-byte codes, re-ranked
+    PQ_INDEX_DIR="/app/data/index/pq",  # Where the PQ index is persisted
+    PQ_SUBSPACES=64,                 # Bytes per vector in the PQ index; must divide the embedding dim
+    PQ_RERANK_CANDIDATES=256,        # PQ hits per query re-scored exactly from Postgres vectors
+    BACKFILL_FETCH_WORKERS=16,       # Concurrent S3/HTTP image downloads per backfill
+    BACKFILL_EMBED_WORKERS=2,        # Concurrent embedding batches sent to the embedder
+    BACKFILL_QUEUE_SIZE=256,         # Images buffered between pipeline stages
+    BACKFILL_LEASE_SEC=600,          # A lease not renewed for this long is handed to another worker
+    BACKFILL_MAX_ATTEMPTS=3,         # Failures before a path is parked as failed
+    BACKFILL_MAX_RUNNING_JOBS=1,     # Backfill jobs run concurrently per process; others wait queued
+    QUERY_CACHE_SIZE=10_000,         # Text-query embeddings kept in memory per worker
+    QUERY_CACHE_TTL_SEC=3600,        # Lifetime of a cached query embedding
+    QUERY_CACHE_PATH=None,           # SQLite file to persist and share the cache between workers
+    SEARCH_BATCH_MAX_QUERIES=10_000,  # Queries accepted by one /search/batch request
+    SEARCH_BATCH_MAX_SCORE_MB=256,   # Size of one (queries x rows) score block in a batched exact scan
+)
+
+INGEST_CONFIG = SimpleNamespace(
+    DB_WRITE_METHOD="copy",          # copy: streamed COPY FROM STDIN; values: INSERT ... VALUES fallback
+    DB_FLUSH_ROWS=50_000,            # Frame rows buffered across episodes before one bulk load
+    DB_COPY_CHUNK_ROWS=10_000,       # Rows rendered to CSV at a time while streaming a COPY
+    PREFETCH_EPISODES=2,             # Episodes prepared ahead while the current one uploads
+    PROCESS_WORKERS=1,               # Processes producing episodes; 1 keeps it in-process
+    MAX_INFLIGHT_EPISODES=8,         # Episodes submitted to workers and not yet uploaded
+    MANIFEST_PATH=None,              # SQLite ingestion manifest. None: <DATA_DIR>/ingest_manifest.sqlite
+    GCS_LIST_PAGE_SIZE=1000,         # Blobs per listing page when enumerating Waymo episodes
+    UPLOAD_WORKERS=16,               # Concurrent S3 uploads
+    UPLOAD_MAX_INFLIGHT_MB=256,      # Bytes queued or uploading before new uploads wait
+    UPLOAD_MULTIPART_THRESHOLD_MB=64,  # Files above this size are uploaded in parts
+    UPLOAD_MULTIPART_CHUNK_MB=16,    # Part size for multipart uploads
 )
 
 TORCH_CONFIG = SimpleNamespace(
@@ -13,6 +55,15 @@ TORCH_CONFIG = SimpleNamespace(
 EMBEDDER_CONFIG = SimpleNamespace(
     PORT=8000,
     DEVICE="CPU",           # CPU, CUDA, MPS
+    MODEL_NAME="kakaobrain/align-base",  # Loaded from HF_HOME in the background after the server binds
+    WARMUP_BATCH_SIZE=4,    # Dummy images and texts run before /ready reports ready. 0: no warmup
+    MAX_BATCH_SIZE=32,      # Concurrent requests are coalesced into batches up to this size
+    MAX_WAIT_MS=5,          # How long the oldest queued request may wait for a batch to fill
+    DECODE_WORKERS=4,       # Threads decoding and resizing images ahead of inference
+    DECODE_DRAFT=True,      # Decode JPEGs downscaled in the DCT domain, close to the model input size
+    BACKEND="eager",        # eager: fp32 PyTorch; int8: dynamic int8 Linear layers; onnx: ONNX Runtime (CPU only)
+    NUM_THREADS=None,       # Intra-op CPU threads for inference. None: library default
+    ONNX_DIR="/app/.cache/onnx/align-base",  # Exported ONNX graphs, reused across restarts
 )
 
 VLM_CONFIG = SimpleNamespace(